@@ -23,8 +23,17 @@ from utils.cache import CacheManager
 from services.emby_proxy import EmbyProxyService
 from services.strm_parser import StrmParserService
 from services.alist_api import AlistApiService
+from services.library_crawler import LibraryCrawler
+from services.library_change_feed import LibraryChangeFeed
 # SQLite 数据库管理器
 from database.database import init_database
+from utils.shared_state import get_shared_state, GEN_CONFIG
+from utils.relay import get_relay_stats
+from utils.upstream_client import get_upstream_pool
+from services.block_cache import get_block_cache, parse_proxy_download_query
+from services.read_ahead import get_read_ahead_stats
+from services.fanout import get_fanout_hub
+from services.bandwidth import get_bandwidth_scheduler
 
 # 设置日志
 logger = setup_logger()
@@ -50,22 +59,31 @@ client_manager = None
 cache_manager = None
 emby_proxy_service = None
 alist_api_service = None
+library_crawler = None
+library_change_feed = None
+emby_worker_pool = None
 
 def initialize_services():
     """初始化所有服务（在数据库初始化后）"""
-    global config_manager, client_manager, cache_manager, emby_proxy_service, alist_api_service
+    global config_manager, client_manager, cache_manager, emby_proxy_service, alist_api_service, library_crawler, library_change_feed
     
     config_manager = ConfigManager()
     client_manager = ClientManager()
     cache_manager = CacheManager()
     emby_proxy_service = EmbyProxyService(client_manager)
     alist_api_service = AlistApiService(cache_manager)
+    library_crawler = LibraryCrawler(emby_proxy_service.get_emby_session, emby_proxy_service.item_path_db)
+    library_change_feed = LibraryChangeFeed(
+        library_crawler, emby_proxy_service.items_resolver, emby_proxy_service.item_path_db
+    )
+    # 多 worker 模式：其他进程保存配置后重新加载本进程的配置快照
+    get_shared_state().subscribe(GEN_CONFIG, config_manager.reload_config_snapshot)
 
 def token_required(f):
     """Token 认证装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        config = config_manager.load_config()
+        config = config_manager.get_config_snapshot().config
         token = request.headers.get('Authorization', '')
         
         if token != config.get('service', {}).get('token', ''):
@@ -159,8 +177,18 @@ def update_config():
         
         return clean_config
     
-    # 清理标志位
-    new_config = clean_config_flags(new_config)
+    def merge_config(base, override):
+        """以旧配置为底合并新配置（页面未提交的高级配置项保持原值）"""
+        merged = dict(base)
+        for key, value in override.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = merge_config(merged[key], value)
+            else:
+                merged[key] = value
+        return merged
+    
+    # 清理标志位，并用旧配置补齐页面未提交的配置项
+    new_config = merge_config(old_config, clean_config_flags(new_config))
     
     # 处理密码字段（如果是******则保留原值）
     if new_config.get('service', {}).get('password') == '******':
@@ -384,6 +412,17 @@ def test_123_connection():
             'message': f'测试失败: {str(e)}'
         }), 500
 
+@app.route('/api/cache/blocks/clear', methods=['POST'])
+def clear_block_cache():
+    """清空代理下载分块缓存（磁盘上的块文件和索引）"""
+    count = get_block_cache().clear()
+
+    return jsonify({
+        'code': 200,
+        'message': f'已清除 {count} 个缓存块',
+        'data': {'blocks': count}
+    })
+
 @app.route('/api/cache/clear', methods=['POST'])
 def clear_cache():
     """清除所有缓存"""
@@ -403,6 +442,11 @@ def get_performance_stats():
     
     stats = db.get_performance_stats()
     
+    from utils.bounded_cache import get_cache_stats
+    from utils.singleflight import get_singleflight_stats
+    from services.domain_health import get_domain_health_monitor
+    from services.link_validator import get_link_validator
+    
     return jsonify({
         'code': 200,
         'message': '性能统计获取成功',
@@ -410,6 +454,20 @@ def get_performance_stats():
             'optimization': '🚀 SQLite 高性能优化已启用',
             'database_size': stats.get('database_size', 0),
             'cache_stats': stats.get('cache_stats', {}),
+            'memory_cache_stats': get_cache_stats(),
+            'singleflight_stats': get_singleflight_stats(),
+            'domain_health': get_domain_health_monitor().stats(),
+            'link_validation': get_link_validator().stats(),
+            'speculative': emby_proxy_service.speculative_resolver.stats(),
+            'redirect_negative_cache': emby_proxy_service.negative_cache_stats(),
+            'emby_workers': emby_worker_pool.stats() if emby_worker_pool else None,
+            'shared_state': get_shared_state().stats(),
+            'relay': get_relay_stats(),
+            'upstream_clients': get_upstream_pool().stats(),
+            'block_cache': get_block_cache().stats(),
+            'read_ahead': get_read_ahead_stats(),
+            'fanout': get_fanout_hub().stats(),
+            'bandwidth': get_bandwidth_scheduler().stats(),
             'api_performance': stats.get('api_stats', [])[:10],  # 最近10个API调用
             'benefits': {
                 'speed_improvement': '查询速度提升 10-100x',
@@ -420,6 +478,88 @@ def get_performance_stats():
         }
     })
 
+@app.route('/api/library/crawl', methods=['POST'])
+def start_library_crawl():
+    """启动媒体库预热（默认增量，full=true 全量）"""
+    data = request.get_json(silent=True) or {}
+    try:
+        concurrency = int(data['concurrency']) if data.get('concurrency') else None
+        rate_limit = float(data['rate_limit']) if data.get('rate_limit') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({
+            'code': 400,
+            'message': 'concurrency / rate_limit 参数无效'
+        }), 400
+    
+    started = library_crawler.start(
+        full=bool(data.get('full', False)),
+        concurrency=concurrency,
+        rate_limit=rate_limit
+    )
+    if not started:
+        return jsonify({
+            'code': 409,
+            'message': '媒体库预热正在运行',
+            'data': library_crawler.get_status()
+        }), 409
+    
+    return jsonify({
+        'code': 200,
+        'message': '媒体库预热已启动',
+        'data': library_crawler.get_status()
+    })
+
+@app.route('/api/library/crawl/status', methods=['GET'])
+def get_library_crawl_status():
+    """获取媒体库预热进度"""
+    return jsonify({
+        'code': 200,
+        'message': 'success',
+        'data': library_crawler.get_status()
+    })
+
+@app.route('/api/library/crawl/stop', methods=['POST'])
+def stop_library_crawl():
+    """停止媒体库预热"""
+    stopped = library_crawler.stop()
+    return jsonify({
+        'code': 200,
+        'message': '正在停止媒体库预热' if stopped else '没有正在运行的预热任务',
+        'data': library_crawler.get_status()
+    })
+
+@app.route('/api/emby/webhook', methods=['POST'])
+def emby_library_webhook():
+    """Emby 媒体库变更 Webhook（?token= 为服务 token）"""
+    config = config_manager.get_config_snapshot().config
+    if request.args.get('token', '') != config.get('service', {}).get('token', ''):
+        return jsonify({
+            'code': 403,
+            'message': 'Invalid token'
+        }), 403
+    
+    payload = LibraryChangeFeed.parse_webhook_payload(request.get_json(silent=True), request.form)
+    if not payload:
+        return jsonify({
+            'code': 400,
+            'message': '无法解析 Webhook 数据'
+        }), 400
+    
+    try:
+        result = library_change_feed.handle_webhook(payload)
+    except Exception as e:
+        logger.error(f"❌ 处理媒体库 Webhook 失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e)
+        }), 500
+    
+    return jsonify({
+        'code': 200,
+        'message': 'success',
+        'data': result
+    })
+
 @app.route('/api/database/optimize', methods=['POST'])
 def optimize_database():
     """优化数据库"""
@@ -564,6 +704,23 @@ def api_get_clients():
             'data': None
         })
 
+@app.route('/api/bandwidth/streams', methods=['GET'])
+def api_get_bandwidth_streams():
+    """获取代理媒体流的实时速率（带宽调度）"""
+    try:
+        return jsonify({
+            'code': 200,
+            'message': '获取实时流量成功',
+            'data': get_bandwidth_scheduler().stats()
+        })
+    except Exception as e:
+        logger.error(f"获取实时流量失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e),
+            'data': None
+        })
+
 @app.route('/api/clients/block', methods=['POST'])
 def api_block_client():
     """拦截客户端"""
@@ -927,26 +1084,33 @@ def proxy_download():
     """
     代理下载 - 简单粗暴版本
     """
+    bandwidth = None
     try:
         # 获取完整的查询字符串
         query_string = request.query_string.decode('utf-8')
         logger.info(f"🔍 原始查询字符串: {query_string}")
         
-        # 从查询字符串中提取url参数
-        if not query_string.startswith('url='):
+        # 提取url参数（url= 之后的全部内容）和文件标识
+        download_url, file_key = parse_proxy_download_query(query_string)
+        if not download_url:
             return jsonify({'error': '缺少url参数'}), 400
-        
-        # 提取url=后面的所有内容
-        download_url = query_string[4:]  # 去掉 'url=' 前缀
-        
-        # URL解码处理
-        from urllib.parse import unquote
-        download_url = unquote(download_url)
 
-        # 直接下载文件
-        import requests
+        # 带宽调度：按用户 / 设备限速，响应结束时关闭
+        bandwidth = get_bandwidth_scheduler().open_download(request.remote_addr, download_url, file_key)
+
+        # 分块缓存 / 顺序预读：已缓存的块从磁盘返回，缺失的块从上游拉取（开启预读时提前拉取后续段）
+        download = get_block_cache().open_download(file_key, download_url, request.headers.get('Range'),
+                                                   client=request.remote_addr)
+        if download is not None:
+            from flask import Response
+            return Response(bandwidth.wrap(download), status=download.status,
+                            headers=download.response_headers())
+
+        # 经上游长连接池下载（同一 CDN 主机复用连接，拖动进度条不再重新握手）
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            # 原样转发字节，Content-Length 与响应体一致
+            'Accept-Encoding': 'identity'
         }
         
         # 支持Range请求（断点续传）
@@ -954,19 +1118,19 @@ def proxy_download():
         if range_header:
             headers['Range'] = range_header
         
-        response = requests.get(download_url, stream=True, timeout=30, headers=headers)
+        # 直链 / 下载网关可能 302 到 CDN 节点，跟随重定向
+        response = get_upstream_pool().stream('GET', download_url, headers=headers, timeout=30,
+                                              follow_redirects=True)
         
         # 支持206 Partial Content响应
         if response.status_code not in [200, 206]:
             logger.error(f"❌ 代理下载失败: {response.status_code}")
+            response.close()
+            bandwidth.close()
             return jsonify({'error': f'下载失败: {response.status_code}'}), 500
         
-        # 流式传输
-        def generate():
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    yield chunk
-        
+        # 流式传输（splice / 复用缓冲区直写客户端 socket，见 utils/relay.py）
+        from utils.relay import UpstreamRelay
         from flask import Response
         
         # 构建响应头
@@ -986,13 +1150,15 @@ def proxy_download():
             status_code = 200
         
         return Response(
-            generate(),
+            UpstreamRelay(response, request.environ, bandwidth=bandwidth),
             status=status_code,
             headers=response_headers
         )
 
     except Exception as e:
         logger.error(f"❌ 代理下载异常: {e}")
+        if bandwidth is not None:
+            bandwidth.close()
         return jsonify({'error': '服务器错误'}), 500
 
 # ==================== Emby 反向代理 ====================
@@ -1010,8 +1176,14 @@ def run_emby_server(config):
     if config.get('emby', {}).get('enable'):
         emby_host = config.get('emby', {}).get('host', '0.0.0.0')
         emby_port = config.get('emby', {}).get('port', 8096)
-        logger.info(f"启动 Emby 反向代理服务器: http://{emby_host}:{emby_port}")
+        engine = os.environ.get('EMBY_PROXY_ENGINE', 'flask').lower()
+        logger.info(f"启动 Emby 反向代理服务器: http://{emby_host}:{emby_port} (引擎: {engine})")
         try:
+            # ASGI 数据面（uvicorn + httpx 异步流式转发），未安装 uvicorn 时回退到 Flask
+            if engine == 'asgi':
+                from services.emby_asgi import run_asgi_server
+                if run_asgi_server(emby_app, emby_proxy_service, emby_host, emby_port):
+                    return
             emby_app.run(
                 host=emby_host,
                 port=emby_port,
@@ -1024,6 +1196,40 @@ def run_emby_server(config):
     else:
         logger.info("Emby 反向代理未启用")
 
+def bootstrap_emby_worker():
+    """
+    多进程模式下 Emby 代理 worker 的初始化（worker 进程中执行）
+
+    :return: (emby_app, emby_proxy_service)
+    """
+    init_database()
+    initialize_services()
+    config = config_manager.load_config()
+    log_level = config.get('service', {}).get('log_level', 'INFO')
+    logging.getLogger().setLevel(getattr(logging, log_level.upper(), logging.INFO))
+    client_manager.init_clients(config)
+
+    # 每个 worker 维护自己的域名健康状态（熔断在进程内生效）
+    from services.domain_health import get_domain_health_monitor
+    get_domain_health_monitor().start()
+    return emby_app, emby_proxy_service
+
+def start_emby_worker_pool(config, workers):
+    """以多进程模式启动 Emby 反向代理（主进程只负责监督 worker）"""
+    global emby_worker_pool
+    from services.emby_workers import EmbyWorkerPool
+
+    emby_host = config.get('emby', {}).get('host', '0.0.0.0')
+    emby_port = config.get('emby', {}).get('port', 8096)
+    engine = os.environ.get('EMBY_PROXY_ENGINE', 'flask').lower()
+    logger.info(f"启动 Emby 反向代理服务器: http://{emby_host}:{emby_port} (引擎: {engine}, worker: {workers})")
+
+    # 主进程也参与跨进程缓存失效（管理界面保存配置、媒体库同步修改路径）
+    get_shared_state().start()
+    emby_worker_pool = EmbyWorkerPool(bootstrap_emby_worker, emby_host, emby_port, workers, engine=engine)
+    emby_worker_pool.start()
+    emby_worker_pool.install_signal_handlers()
+
 if __name__ == '__main__':
     # 1. 初始化SQLite数据库
     try:
@@ -1051,8 +1257,21 @@ if __name__ == '__main__':
     # 5. 初始化客户端
     client_manager.init_clients(config)
 
-    # 如果启用了 Emby 反向代理，在独立线程中启动
-    if config.get('emby', {}).get('enable'):
+    # 6. 媒体库变更同步（定时增量）
+    library_change_feed.start()
+
+    # 7. 自定义域名健康监测（后台探测 + 熔断）
+    from services.domain_health import get_domain_health_monitor
+    get_domain_health_monitor().start()
+
+    # 如果启用了 Emby 反向代理：EMBY_PROXY_WORKERS > 1 时多进程，否则在独立线程中启动
+    emby_workers = int(os.environ.get('EMBY_PROXY_WORKERS', 1))
+    if config.get('emby', {}).get('enable') and emby_workers > 1:
+        try:
+            start_emby_worker_pool(config, emby_workers)
+        except Exception as e:
+            logger.error(f"Emby 反向代理服务器启动失败: {e}")
+    elif config.get('emby', {}).get('enable'):
         emby_thread = threading.Thread(
             target=run_emby_server,
             args=(config,),
@@ -6,17 +6,61 @@
 每个配置项都有独立的字段，不使用JSON存储
 """
 
+import copy
 import json
+import time
 import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Callable, List
 from database.database import get_db_manager
+from utils.shared_state import get_shared_state, GEN_CONFIG
 
 logger = logging.getLogger(__name__)
 
+
+def _freeze(value):
+    """递归冻结配置：dict -> 只读映射，list -> tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ConfigSnapshot:
+    """
+    不可变的版本化配置快照
+
+    - version: 单调递增的版本号，每次保存配置后 +1
+    - config: 只读配置（热路径直接读取，禁止修改）
+    """
+
+    __slots__ = ('version', 'config', 'loaded_at', '_raw')
+
+    def __init__(self, version: int, raw: Dict[str, Any]):
+        self.version = version
+        self.config = _freeze(raw)
+        self.loaded_at = time.time()
+        self._raw = raw
+
+    def to_dict(self) -> Dict[str, Any]:
+        """返回可修改的深拷贝（管理接口使用）"""
+        return copy.deepcopy(self._raw)
+
+
 class StandardConfigManager:
     """标准关系型配置管理器"""
 
+    # 🚀 进程内配置快照（所有实例共享），由 save_* 原子替换
+    _snapshot: Optional[ConfigSnapshot] = None
+    _snapshot_version = 0
+    _snapshot_lock = threading.RLock()
+    _subscribers: List[Callable[[ConfigSnapshot], None]] = []
+    _batch_state = threading.local()
+
     def __init__(self):
         self.db = get_db_manager()
         self.ensure_config_tables()
@@ -58,6 +102,11 @@ class StandardConfigManager:
                 path_mapping_enable INTEGER DEFAULT 0,
                 path_mapping_from TEXT DEFAULT '',
                 path_mapping_to TEXT DEFAULT '',
+                items_batch_window_ms INTEGER DEFAULT 5,
+                items_batch_size INTEGER DEFAULT 50,
+                change_feed_interval INTEGER DEFAULT 600,
+                speculative_enable INTEGER DEFAULT 1,
+                speculative_episodes INTEGER DEFAULT 2,
                 created_at INTEGER DEFAULT (unixepoch()),
                 updated_at INTEGER DEFAULT (unixepoch())
             );
@@ -80,7 +129,10 @@ class StandardConfigManager:
                 url_auth_secret_key TEXT DEFAULT '',
                 url_auth_uid TEXT DEFAULT '',
                 url_auth_expire_time INTEGER DEFAULT 3600,
+                url_auth_bucket_seconds INTEGER DEFAULT 300,
                 custom_domains TEXT DEFAULT '',
+                domain_strategy TEXT DEFAULT 'latency',
+                domain_weights TEXT DEFAULT '{}',
                 created_at INTEGER DEFAULT (unixepoch()),
                 updated_at INTEGER DEFAULT (unixepoch())
             );
@@ -99,15 +151,97 @@ class StandardConfigManager:
                 created_at INTEGER DEFAULT (unixepoch()),
                 updated_at INTEGER DEFAULT (unixepoch())
             );
+
+            -- 路径映射规则表（多规则，按 sort_order 排序）
+            CREATE TABLE IF NOT EXISTS path_mapping_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sort_order INTEGER NOT NULL DEFAULT 0,
+                enable INTEGER NOT NULL DEFAULT 1,
+                match_type TEXT NOT NULL DEFAULT 'prefix',
+                pattern TEXT NOT NULL DEFAULT '',
+                target TEXT NOT NULL DEFAULT '',
+                mount_path TEXT DEFAULT '',
+                download_mode TEXT DEFAULT '',
+                created_at INTEGER DEFAULT (unixepoch()),
+                updated_at INTEGER DEFAULT (unixepoch())
+            );
+
+            -- 代理模式流传输配置表
+            CREATE TABLE IF NOT EXISTS stream_config (
+                id INTEGER PRIMARY KEY DEFAULT 1,
+                block_cache_enable INTEGER NOT NULL DEFAULT 0,
+                block_cache_size_mb INTEGER DEFAULT 20480,
+                block_size_mb INTEGER DEFAULT 4,
+                block_cache_policy TEXT DEFAULT 'lru',
+                read_ahead_enable INTEGER DEFAULT 0,
+                read_ahead_seconds INTEGER DEFAULT 30,
+                read_ahead_max_mb INTEGER DEFAULT 64,
+                read_ahead_memory_mb INTEGER DEFAULT 256,
+                parallel_fetch_enable INTEGER DEFAULT 0,
+                parallel_max_connections INTEGER DEFAULT 4,
+                parallel_file_connections INTEGER DEFAULT 8,
+                fanout_enable INTEGER DEFAULT 0,
+                fanout_buffer_mb INTEGER DEFAULT 32,
+                bandwidth_enable INTEGER DEFAULT 0,
+                bandwidth_global_mbps INTEGER DEFAULT 0,
+                bandwidth_user_mbps INTEGER DEFAULT 0,
+                bandwidth_device_mbps INTEGER DEFAULT 0,
+                bandwidth_user_weights TEXT DEFAULT '{}',
+                created_at INTEGER DEFAULT (unixepoch()),
+                updated_at INTEGER DEFAULT (unixepoch())
+            );
             """
             
             with self.db.get_cursor() as cursor:
                 cursor.executescript(schema_sql)
+                self._ensure_columns(cursor)
             
             logger.info("配置表架构初始化完成")
         except Exception as e:
             logger.error(f"配置表初始化失败: {e}")
 
+    # 后续版本新增的列（CREATE TABLE IF NOT EXISTS 不会给旧表补列）
+    _COLUMN_MIGRATIONS = {
+        'emby_config': [
+            ('items_batch_window_ms', 'INTEGER DEFAULT 5'),
+            ('items_batch_size', 'INTEGER DEFAULT 50'),
+            ('change_feed_interval', 'INTEGER DEFAULT 600'),
+            ('speculative_enable', 'INTEGER DEFAULT 1'),
+            ('speculative_episodes', 'INTEGER DEFAULT 2'),
+        ],
+        'pan123_config': [
+            ('url_auth_bucket_seconds', 'INTEGER DEFAULT 300'),
+            ('domain_strategy', "TEXT DEFAULT 'latency'"),
+            ('domain_weights', "TEXT DEFAULT '{}'"),
+        ],
+        'stream_config': [
+            ('read_ahead_enable', 'INTEGER DEFAULT 0'),
+            ('read_ahead_seconds', 'INTEGER DEFAULT 30'),
+            ('read_ahead_max_mb', 'INTEGER DEFAULT 64'),
+            ('read_ahead_memory_mb', 'INTEGER DEFAULT 256'),
+            ('parallel_fetch_enable', 'INTEGER DEFAULT 0'),
+            ('parallel_max_connections', 'INTEGER DEFAULT 4'),
+            ('parallel_file_connections', 'INTEGER DEFAULT 8'),
+            ('fanout_enable', 'INTEGER DEFAULT 0'),
+            ('fanout_buffer_mb', 'INTEGER DEFAULT 32'),
+            ('bandwidth_enable', 'INTEGER DEFAULT 0'),
+            ('bandwidth_global_mbps', 'INTEGER DEFAULT 0'),
+            ('bandwidth_user_mbps', 'INTEGER DEFAULT 0'),
+            ('bandwidth_device_mbps', 'INTEGER DEFAULT 0'),
+            ('bandwidth_user_weights', "TEXT DEFAULT '{}'"),
+        ],
+    }
+
+    def _ensure_columns(self, cursor):
+        """为旧数据库补充新增的列"""
+        for table, columns in self._COLUMN_MIGRATIONS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existing = {row['name'] for row in cursor.fetchall()}
+            for name, definition in columns:
+                if name not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                    logger.info(f"配置表新增列: {table}.{name}")
+
     # ==================== Service 配置 ====================
 
     def get_service_config(self) -> Dict[str, Any]:
@@ -154,7 +288,8 @@ class StandardConfigManager:
                     config.get('password', 'admin123'),
                     config.get('log_level', 'INFO')
                 ))
-                return True
+            self._publish_snapshot()
+            return True
         except Exception as e:
             logger.error(f"保存服务配置失败: {e}")
             return False
@@ -180,7 +315,9 @@ class StandardConfigManager:
                 cursor.execute("""
                     SELECT enable, server, api_key, port, host, proxy_enable, redirect_enable,
                            ssl_verify, cache_enable, cache_expire_time, modify_playback_info,
-                           modify_items_info, path_mapping_enable, path_mapping_from, path_mapping_to
+                           modify_items_info, path_mapping_enable, path_mapping_from, path_mapping_to,
+                           items_batch_window_ms, items_batch_size, change_feed_interval,
+                           speculative_enable, speculative_episodes
                     FROM emby_config WHERE id = 1
                 """)
                 row = cursor.fetchone()
@@ -199,10 +336,16 @@ class StandardConfigManager:
                         'cache_expire_time': row['cache_expire_time'],
                         'modify_playback_info': bool(row['modify_playback_info']),
                         'modify_items_info': bool(row['modify_items_info']),
+                        'items_batch_window_ms': row['items_batch_window_ms'],
+                        'items_batch_size': row['items_batch_size'],
+                        'change_feed_interval': row['change_feed_interval'],
+                        'speculative_enable': bool(row['speculative_enable']),
+                        'speculative_episodes': row['speculative_episodes'],
                         'path_mapping': {
                             'enable': bool(row['path_mapping_enable']),
                             'from': row['path_mapping_from'],
-                            'to': row['path_mapping_to']
+                            'to': row['path_mapping_to'],
+                            'rules': self._get_path_mapping_rules()
                         }
                     }
                     
@@ -229,8 +372,10 @@ class StandardConfigManager:
                     INSERT OR REPLACE INTO emby_config 
                     (id, enable, server, api_key, port, host, proxy_enable, redirect_enable,
                      ssl_verify, cache_enable, cache_expire_time, modify_playback_info,
-                     modify_items_info, path_mapping_enable, path_mapping_from, path_mapping_to, updated_at)
-                    VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
+                     modify_items_info, path_mapping_enable, path_mapping_from, path_mapping_to,
+                     items_batch_window_ms, items_batch_size, change_feed_interval,
+                     speculative_enable, speculative_episodes, updated_at)
+                    VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
                 """, (
                     1 if config.get('enable', False) else 0,
                     config.get('server', ''),
@@ -246,15 +391,25 @@ class StandardConfigManager:
                     1 if config.get('modify_items_info', True) else 0,
                     1 if path_mapping.get('enable', False) else 0,
                     path_mapping.get('from', ''),
-                    path_mapping.get('to', '')
+                    path_mapping.get('to', ''),
+                    config.get('items_batch_window_ms', 5),
+                    config.get('items_batch_size', 50),
+                    config.get('change_feed_interval', 600),
+                    1 if config.get('speculative_enable', True) else 0,
+                    config.get('speculative_episodes', 2)
                 ))
                 
                 # 🛡️ 保存客户端拦截配置到单独的表
                 if client_filter:
                     self._save_client_filter_config(client_filter)
+
+                # 🗺️ 路径映射规则表（只在提交了 rules 时整体替换，兼容旧的单规则表单）
+                if 'rules' in path_mapping:
+                    self._save_path_mapping_rules(cursor, path_mapping.get('rules') or [])
                 
                 logger.info(f"Emby配置已保存: server={config.get('server', '')}")
-                return True
+            self._publish_snapshot()
+            return True
         except Exception as e:
             logger.error(f"保存Emby配置失败: {e}")
             return False
@@ -287,6 +442,45 @@ class StandardConfigManager:
             logger.error(f"保存客户端拦截配置失败: {e}")
             return False
 
+    def _save_path_mapping_rules(self, cursor, rules: List[Dict[str, Any]]):
+        """整体替换路径映射规则（规则顺序即匹配优先级）"""
+        cursor.execute("DELETE FROM path_mapping_rules")
+        for sort_order, rule in enumerate(rules):
+            cursor.execute("""
+                INSERT INTO path_mapping_rules
+                (sort_order, enable, match_type, pattern, target, mount_path, download_mode)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (
+                sort_order,
+                1 if rule.get('enable', True) else 0,
+                rule.get('type', 'prefix'),
+                rule.get('pattern', ''),
+                rule.get('target', ''),
+                rule.get('mount_path', ''),
+                rule.get('download_mode', '')
+            ))
+        logger.info(f"🗺️ 路径映射规则已保存: {len(rules)} 条")
+
+    def _get_path_mapping_rules(self) -> List[Dict[str, Any]]:
+        """获取路径映射规则列表"""
+        try:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT enable, match_type, pattern, target, mount_path, download_mode
+                    FROM path_mapping_rules ORDER BY sort_order, id
+                """)
+                return [{
+                    'enable': bool(row['enable']),
+                    'type': row['match_type'] or 'prefix',
+                    'pattern': row['pattern'] or '',
+                    'target': row['target'] or '',
+                    'mount_path': row['mount_path'] or '',
+                    'download_mode': row['download_mode'] or ''
+                } for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取路径映射规则失败: {e}")
+            return []
+
     def _get_client_filter_config(self) -> Dict[str, Any]:
         """获取客户端拦截配置"""
         try:
@@ -353,10 +547,16 @@ class StandardConfigManager:
             'cache_expire_time': 3600,
             'modify_playback_info': False,
             'modify_items_info': True,
+            'items_batch_window_ms': 5,
+            'items_batch_size': 50,
+            'change_feed_interval': 600,
+            'speculative_enable': True,
+            'speculative_episodes': 2,
             'path_mapping': {
                 'enable': False,
                 'from': '',
-                'to': ''
+                'to': '',
+                'rules': []
             }
         }
 
@@ -370,7 +570,7 @@ class StandardConfigManager:
                     SELECT enable, token, passport, password, client_id, client_secret, mount_path,
                            use_open_api, open_api_token, fallback_to_search, download_mode,
                            url_auth_enable, url_auth_secret_key, url_auth_uid, url_auth_expire_time,
-                           custom_domains
+                           url_auth_bucket_seconds, custom_domains, domain_strategy, domain_weights
                     FROM pan123_config WHERE id = 1
                 """)
                 row = cursor.fetchone()
@@ -383,6 +583,12 @@ class StandardConfigManager:
                             custom_domains = json.loads(row['custom_domains'])
                     except:
                         custom_domains = []
+
+                    # 域名权重（JSON对象：域名 → 权重）
+                    try:
+                        domain_weights = json.loads(row['domain_weights'] or '{}')
+                    except ValueError:
+                        domain_weights = {}
                     
                     return {
                         'enable': bool(row['enable']),
@@ -401,7 +607,10 @@ class StandardConfigManager:
                             'secret_key': row['url_auth_secret_key'],
                             'uid': row['url_auth_uid'],
                             'expire_time': row['url_auth_expire_time'],
-                            'custom_domains': custom_domains
+                            'bucket_seconds': row['url_auth_bucket_seconds'],
+                            'custom_domains': custom_domains,
+                            'domain_strategy': row['domain_strategy'] or 'latency',
+                            'domain_weights': domain_weights
                         }
                     }
                 else:
@@ -424,8 +633,8 @@ class StandardConfigManager:
                     (id, enable, token, passport, password, client_id, client_secret, mount_path,
                      use_open_api, open_api_token, fallback_to_search, download_mode,
                      url_auth_enable, url_auth_secret_key, url_auth_uid, url_auth_expire_time,
-                     custom_domains, updated_at)
-                    VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
+                     url_auth_bucket_seconds, custom_domains, domain_strategy, domain_weights, updated_at)
+                    VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
                 """, (
                     1 if config.get('enable', False) else 0,
                     config.get('token', ''),
@@ -442,11 +651,15 @@ class StandardConfigManager:
                     url_auth.get('secret_key', ''),
                     url_auth.get('uid', ''),
                     url_auth.get('expire_time', 3600),
-                    custom_domains_json
+                    url_auth.get('bucket_seconds', 300),
+                    custom_domains_json,
+                    url_auth.get('domain_strategy', 'latency'),
+                    json.dumps(url_auth.get('domain_weights', {}) or {})
                 ))
                 
                 logger.info(f"123网盘配置已保存: client_id={config.get('client_id', '')[:8]}...")
-                return True
+            self._publish_snapshot()
+            return True
         except Exception as e:
             logger.error(f"保存123网盘配置失败: {e}")
             return False
@@ -470,19 +683,142 @@ class StandardConfigManager:
                 'secret_key': '',
                 'uid': '',
                 'expire_time': 3600,
-                'custom_domains': []
+                'bucket_seconds': 300,
+                'custom_domains': [],
+                'domain_strategy': 'latency',
+                'domain_weights': {}
             }
         }
 
+    # ==================== 流传输配置 ====================
+
+    def get_stream_config(self) -> Dict[str, Any]:
+        """获取代理模式流传输配置"""
+        try:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT block_cache_enable, block_cache_size_mb, block_size_mb, block_cache_policy,
+                           read_ahead_enable, read_ahead_seconds, read_ahead_max_mb, read_ahead_memory_mb,
+                           parallel_fetch_enable, parallel_max_connections, parallel_file_connections,
+                           fanout_enable, fanout_buffer_mb,
+                           bandwidth_enable, bandwidth_global_mbps, bandwidth_user_mbps, bandwidth_device_mbps,
+                           bandwidth_user_weights
+                    FROM stream_config WHERE id = 1
+                """)
+                row = cursor.fetchone()
+
+                if row:
+                    try:
+                        user_weights = json.loads(row['bandwidth_user_weights'] or '{}')
+                    except (TypeError, ValueError):
+                        user_weights = {}
+                    return {
+                        'block_cache_enable': bool(row['block_cache_enable']),
+                        'block_cache_size_mb': row['block_cache_size_mb'],
+                        'block_size_mb': row['block_size_mb'],
+                        'block_cache_policy': row['block_cache_policy'] or 'lru',
+                        'read_ahead_enable': bool(row['read_ahead_enable']),
+                        'read_ahead_seconds': row['read_ahead_seconds'],
+                        'read_ahead_max_mb': row['read_ahead_max_mb'],
+                        'read_ahead_memory_mb': row['read_ahead_memory_mb'],
+                        'parallel_fetch_enable': bool(row['parallel_fetch_enable']),
+                        'parallel_max_connections': row['parallel_max_connections'],
+                        'parallel_file_connections': row['parallel_file_connections'],
+                        'fanout_enable': bool(row['fanout_enable']),
+                        'fanout_buffer_mb': row['fanout_buffer_mb'],
+                        'bandwidth_enable': bool(row['bandwidth_enable']),
+                        'bandwidth_global_mbps': row['bandwidth_global_mbps'],
+                        'bandwidth_user_mbps': row['bandwidth_user_mbps'],
+                        'bandwidth_device_mbps': row['bandwidth_device_mbps'],
+                        'bandwidth_user_weights': user_weights
+                    }
+                else:
+                    return self._get_default_stream_config()
+        except Exception as e:
+            logger.error(f"获取流传输配置失败: {e}")
+            return self._get_default_stream_config()
+
+    def save_stream_config(self, config: Dict[str, Any]) -> bool:
+        """保存代理模式流传输配置"""
+        try:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO stream_config
+                    (id, block_cache_enable, block_cache_size_mb, block_size_mb, block_cache_policy,
+                     read_ahead_enable, read_ahead_seconds, read_ahead_max_mb, read_ahead_memory_mb,
+                     parallel_fetch_enable, parallel_max_connections, parallel_file_connections,
+                     fanout_enable, fanout_buffer_mb,
+                     bandwidth_enable, bandwidth_global_mbps, bandwidth_user_mbps, bandwidth_device_mbps,
+                     bandwidth_user_weights, updated_at)
+                    VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
+                """, (
+                    1 if config.get('block_cache_enable', False) else 0,
+                    config.get('block_cache_size_mb', 20480),
+                    config.get('block_size_mb', 4),
+                    config.get('block_cache_policy', 'lru'),
+                    1 if config.get('read_ahead_enable', False) else 0,
+                    config.get('read_ahead_seconds', 30),
+                    config.get('read_ahead_max_mb', 64),
+                    config.get('read_ahead_memory_mb', 256),
+                    1 if config.get('parallel_fetch_enable', False) else 0,
+                    config.get('parallel_max_connections', 4),
+                    config.get('parallel_file_connections', 8),
+                    1 if config.get('fanout_enable', False) else 0,
+                    config.get('fanout_buffer_mb', 32),
+                    1 if config.get('bandwidth_enable', False) else 0,
+                    config.get('bandwidth_global_mbps', 0),
+                    config.get('bandwidth_user_mbps', 0),
+                    config.get('bandwidth_device_mbps', 0),
+                    json.dumps(config.get('bandwidth_user_weights', {}) or {})
+                ))
+            self._publish_snapshot()
+            return True
+        except Exception as e:
+            logger.error(f"保存流传输配置失败: {e}")
+            return False
+
+    def _get_default_stream_config(self) -> Dict[str, Any]:
+        """获取默认流传输配置"""
+        return {
+            'block_cache_enable': False,
+            'block_cache_size_mb': 20480,
+            'block_size_mb': 4,
+            'block_cache_policy': 'lru',
+            'read_ahead_enable': False,
+            'read_ahead_seconds': 30,
+            'read_ahead_max_mb': 64,
+            'read_ahead_memory_mb': 256,
+            'parallel_fetch_enable': False,
+            'parallel_max_connections': 4,
+            'parallel_file_connections': 8,
+            'fanout_enable': False,
+            'fanout_buffer_mb': 32,
+            'bandwidth_enable': False,
+            'bandwidth_global_mbps': 0,
+            'bandwidth_user_mbps': 0,
+            'bandwidth_device_mbps': 0,
+            'bandwidth_user_weights': {}
+        }
+
     # ==================== 统一配置接口 ====================
 
     def load_config(self) -> Dict[str, Any]:
-        """加载完整配置"""
+        """
+        加载完整配置（可修改的副本）
+
+        数据来自进程内快照，不再每次查询数据库；
+        热路径只读访问请使用 get_config_snapshot()，避免深拷贝开销
+        """
+        return self.get_config_snapshot().to_dict()
+
+    def _load_config_from_db(self) -> Dict[str, Any]:
+        """从数据库读取完整配置"""
         try:
             config = {
                 'service': self.get_service_config(),
                 'emby': self.get_emby_config(),
-                '123': self.get_pan123_config()
+                '123': self.get_pan123_config(),
+                'stream': self.get_stream_config()
             }
             
             logger.debug("配置加载完成")
@@ -494,7 +830,8 @@ class StandardConfigManager:
             return {
                 'service': self._get_default_service_config(),
                 'emby': self._get_default_emby_config(),
-                '123': self._get_default_pan123_config()
+                '123': self._get_default_pan123_config(),
+                'stream': self._get_default_stream_config()
             }
 
     def save_config(self, config: Dict[str, Any]) -> bool:
@@ -502,21 +839,27 @@ class StandardConfigManager:
         try:
             success = True
             
-            # 分别保存各个配置段
-            if 'service' in config:
-                if not self.save_service_config(config['service']):
-                    success = False
-                    logger.error("保存服务配置失败")
-            
-            if 'emby' in config:
-                if not self.save_emby_config(config['emby']):
-                    success = False
-                    logger.error("保存Emby配置失败")
-            
-            if '123' in config:
-                if not self.save_pan123_config(config['123']):
-                    success = False
-                    logger.error("保存123网盘配置失败")
+            # 分别保存各个配置段（合并为一次快照发布）
+            with self._batch_publish():
+                if 'service' in config:
+                    if not self.save_service_config(config['service']):
+                        success = False
+                        logger.error("保存服务配置失败")
+                
+                if 'emby' in config:
+                    if not self.save_emby_config(config['emby']):
+                        success = False
+                        logger.error("保存Emby配置失败")
+                
+                if '123' in config:
+                    if not self.save_pan123_config(config['123']):
+                        success = False
+                        logger.error("保存123网盘配置失败")
+
+                if 'stream' in config:
+                    if not self.save_stream_config(config['stream']):
+                        success = False
+                        logger.error("保存流传输配置失败")
             
             if success:
                 logger.info("所有配置保存成功")
@@ -527,6 +870,88 @@ class StandardConfigManager:
             logger.error(f"保存配置失败: {e}")
             return False
 
+    # ==================== 配置快照 ====================
+
+    def get_config_snapshot(self) -> ConfigSnapshot:
+        """
+        获取当前配置快照（只读，零数据库查询）
+
+        首次调用时从数据库加载，之后仅在保存配置时替换
+        """
+        snapshot = StandardConfigManager._snapshot
+        if snapshot is not None:
+            return snapshot
+        with StandardConfigManager._snapshot_lock:
+            if StandardConfigManager._snapshot is None:
+                self._swap_snapshot(notify=False)
+            return StandardConfigManager._snapshot
+
+    def invalidate_config_snapshot(self):
+        """强制从数据库重新加载配置快照（外部直接修改数据库后使用）"""
+        self._publish_snapshot()
+
+    def reload_config_snapshot(self):
+        """其他进程保存配置后重新加载本进程的快照（不再通知其他进程）"""
+        self._swap_snapshot(notify=True)
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot], None]):
+        """
+        订阅配置变更
+
+        :param callback: 回调函数，参数为新的 ConfigSnapshot
+        """
+        with StandardConfigManager._snapshot_lock:
+            if callback not in StandardConfigManager._subscribers:
+                StandardConfigManager._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[ConfigSnapshot], None]):
+        """取消订阅配置变更"""
+        with StandardConfigManager._snapshot_lock:
+            if callback in StandardConfigManager._subscribers:
+                StandardConfigManager._subscribers.remove(callback)
+
+    @contextmanager
+    def _batch_publish(self):
+        """批量保存期间推迟快照发布，结束后只发布一次"""
+        state = StandardConfigManager._batch_state
+        state.depth = getattr(state, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if state.depth == 0 and getattr(state, 'dirty', False):
+                state.dirty = False
+                self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        """配置写入数据库后重新加载并原子替换快照"""
+        state = StandardConfigManager._batch_state
+        if getattr(state, 'depth', 0) > 0:
+            state.dirty = True
+            return
+        self._swap_snapshot(notify=True)
+        # 多 worker 模式：通知其他进程重新加载
+        get_shared_state().bump(GEN_CONFIG)
+
+    def _swap_snapshot(self, notify: bool):
+        """从数据库构建新快照并替换，按需通知订阅者"""
+        with StandardConfigManager._snapshot_lock:
+            raw = self._load_config_from_db()
+            StandardConfigManager._snapshot_version += 1
+            snapshot = ConfigSnapshot(StandardConfigManager._snapshot_version, raw)
+            StandardConfigManager._snapshot = snapshot
+            subscribers = list(StandardConfigManager._subscribers)
+
+        logger.debug(f"配置快照已更新: v{snapshot.version}")
+
+        if notify:
+            for callback in subscribers:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error(f"❌ 配置变更回调失败: {e}")
+        return snapshot
+
     def get_safe_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """获取安全配置（隐藏敏感信息）"""
         import copy
@@ -598,8 +1023,11 @@ class StandardConfigManager:
                 cursor.execute("DELETE FROM service_config WHERE id = 1")
                 cursor.execute("DELETE FROM emby_config WHERE id = 1") 
                 cursor.execute("DELETE FROM pan123_config WHERE id = 1")
+                cursor.execute("DELETE FROM stream_config WHERE id = 1")
+                cursor.execute("DELETE FROM path_mapping_rules")
             
             logger.info("所有配置已清除")
+            self._publish_snapshot()
             return True
         except Exception as e:
             logger.error(f"清除配置失败: {e}")
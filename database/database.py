@@ -137,6 +137,18 @@ class DatabaseManager:
             logger.error(f"❌ 设置直链缓存失败: {e}")
             return False
 
+    def delete_direct_links(self, paths: List[str]) -> int:
+        """删除指定的直链缓存"""
+        if not paths:
+            return 0
+        try:
+            with self.get_cursor() as cursor:
+                cursor.executemany("DELETE FROM direct_link_cache WHERE path = ?", [(p,) for p in paths])
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"❌ 删除直链缓存失败: {e}")
+            return 0
+
     def clear_expired_direct_links(self) -> int:
         """清理过期的直链缓存"""
         try:
@@ -212,6 +224,53 @@ class DatabaseManager:
             logger.error(f"❌ 设置Item路径失败: {e}")
             return False
 
+    def set_item_paths(self, items: List[Tuple[str, str]]) -> bool:
+        """批量设置Item路径（单个事务）"""
+        if not items:
+            return True
+        try:
+            now = int(time.time())
+            with self.get_cursor() as cursor:
+                cursor.executemany(
+                    """INSERT OR REPLACE INTO item_path_mapping 
+                       (item_id, file_path, updated_at) VALUES (?, ?, ?)""",
+                    [(str(item_id), file_path, now) for item_id, file_path in items]
+                )
+                return True
+        except Exception as e:
+            logger.error(f"❌ 批量设置Item路径失败: {e}")
+            return False
+
+    def get_item_paths(self, item_ids: List[str]) -> Dict[str, str]:
+        """批量获取Item对应的文件路径"""
+        result = {}
+        item_ids = [str(i) for i in item_ids]
+        try:
+            with self.get_cursor() as cursor:
+                # SQLite 单条语句参数数量有限，分块查询
+                for start in range(0, len(item_ids), 500):
+                    chunk = item_ids[start:start + 500]
+                    cursor.execute(
+                        f"SELECT item_id, file_path FROM item_path_mapping WHERE item_id IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    result.update({row['item_id']: row['file_path'] for row in cursor.fetchall()})
+        except Exception as e:
+            logger.error(f"❌ 批量获取Item路径失败: {e}")
+        return result
+
+    def remove_item_paths(self, item_ids: List[str]) -> int:
+        """批量删除Item路径映射（单个事务）"""
+        if not item_ids:
+            return 0
+        try:
+            with self.get_cursor() as cursor:
+                cursor.executemany("DELETE FROM item_path_mapping WHERE item_id = ?", [(str(i),) for i in item_ids])
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"❌ 批量删除Item路径失败: {e}")
+            return 0
+
     def has_item_path(self, item_id: str) -> bool:
         """检查Item路径是否存在"""
         try:
@@ -375,6 +434,43 @@ class DatabaseManager:
             logger.error(f"❌ 获取活跃连接失败: {e}")
             return {}
 
+    def find_client_connection(self, device_id: str = None, ip_address: str = None,
+                               timeout_seconds: int = 3600) -> Optional[Dict[str, Any]]:
+        """
+        查找活跃的客户端连接（优先按设备ID，没有时取该IP最近活动的连接）
+
+        :return: 连接记录；找不到时返回 None
+        """
+        try:
+            cutoff_time = int(time.time()) - timeout_seconds
+            with self.get_cursor() as cursor:
+                if device_id:
+                    cursor.execute(
+                        """SELECT connection_id, user_id, device_id, device_name, client_name, ip_address
+                           FROM client_connections
+                           WHERE device_id = ? AND status = 'active' AND last_activity > ?
+                           ORDER BY last_activity DESC LIMIT 1""",
+                        (device_id, cutoff_time)
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        return dict(row)
+                if ip_address:
+                    cursor.execute(
+                        """SELECT connection_id, user_id, device_id, device_name, client_name, ip_address
+                           FROM client_connections
+                           WHERE ip_address = ? AND status = 'active' AND last_activity > ?
+                           ORDER BY last_activity DESC LIMIT 1""",
+                        (ip_address, cutoff_time)
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        return dict(row)
+                return None
+        except Exception as e:
+            logger.error(f"❌ 查找客户端连接失败: {e}")
+            return None
+
     def cleanup_expired_connections(self, timeout_seconds: int = 3600) -> int:
         """清理过期的连接"""
         try:
@@ -425,6 +521,178 @@ class DatabaseManager:
             logger.error(f"❌ 设置文件搜索缓存失败: {e}")
             return False
 
+    # ==================== 代理下载分块缓存 ====================
+
+    def get_block_cache_file(self, file_key: str) -> Optional[Dict[str, Any]]:
+        """获取分块缓存的文件信息（总大小、Content-Type）"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "SELECT total_size, content_type FROM block_cache_files WHERE file_key = ?",
+                    (file_key,)
+                )
+                row = cursor.fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ 获取分块缓存文件信息失败: {e}")
+            return None
+
+    def set_block_cache_file(self, file_key: str, total_size: int, content_type: str = None) -> bool:
+        """记录分块缓存的文件信息"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """INSERT OR REPLACE INTO block_cache_files (file_key, total_size, content_type, updated_at)
+                       VALUES (?, ?, ?, unixepoch())""",
+                    (file_key, total_size, content_type)
+                )
+                return True
+        except Exception as e:
+            logger.error(f"❌ 记录分块缓存文件信息失败: {e}")
+            return False
+
+    def get_cached_blocks(self, file_key: str, block_size: int, first: int, last: int) -> Dict[int, int]:
+        """
+        查询文件在 [first, last] 范围内已缓存的块
+
+        :return: 块序号 → 块大小
+        """
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """SELECT block_index, size FROM block_cache_blocks
+                       WHERE file_key = ? AND block_size = ? AND block_index BETWEEN ? AND ?""",
+                    (file_key, block_size, first, last)
+                )
+                return {row['block_index']: row['size'] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ 查询分块缓存失败: {e}")
+            return {}
+
+    def add_cached_block(self, file_key: str, block_size: int, block_index: int, size: int) -> bool:
+        """登记已写入磁盘的块"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """INSERT OR REPLACE INTO block_cache_blocks
+                       (file_key, block_size, block_index, size, hits, last_access)
+                       VALUES (?, ?, ?, ?, 0, ?)""",
+                    (file_key, block_size, block_index, size, time.time())
+                )
+                return True
+        except Exception as e:
+            logger.error(f"❌ 登记缓存块失败: {e}")
+            return False
+
+    def touch_cached_block(self, file_key: str, block_size: int, block_index: int) -> bool:
+        """记录一次块命中（LRU 访问时间 / LFU 命中次数）"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """UPDATE block_cache_blocks SET hits = hits + 1, last_access = ?
+                       WHERE file_key = ? AND block_size = ? AND block_index = ?""",
+                    (time.time(), file_key, block_size, block_index)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ 更新缓存块访问记录失败: {e}")
+            return False
+
+    def get_block_cache_usage(self) -> Dict[str, int]:
+        """分块缓存占用（字节数、块数、文件数）"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """SELECT COALESCE(SUM(size), 0) AS bytes, COUNT(*) AS blocks,
+                              COUNT(DISTINCT file_key) AS files
+                       FROM block_cache_blocks"""
+                )
+                return dict(cursor.fetchone())
+        except Exception as e:
+            logger.error(f"❌ 获取分块缓存占用失败: {e}")
+            return {'bytes': 0, 'blocks': 0, 'files': 0}
+
+    def pop_block_cache_victims(self, bytes_to_free: int, policy: str = 'lru',
+                                protect_since: float = None) -> List[Dict[str, Any]]:
+        """
+        选出并删除需要淘汰的块（调用方负责删除块文件）
+
+        :param bytes_to_free: 至少释放的字节数
+        :param policy: lru（最久未访问）/ lfu（命中最少，其次最久未访问）
+        :param protect_since: 不淘汰该时间之后访问过的块（正在播放的文件、刚写入的块）
+        :return: 被淘汰块的 file_key / block_size / block_index / size
+        """
+        order = 'hits ASC, last_access ASC' if policy == 'lfu' else 'last_access ASC'
+        victims = []
+        freed = 0
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    f"""SELECT file_key, block_size, block_index, size FROM block_cache_blocks
+                        WHERE last_access < ? ORDER BY {order}""",
+                    (protect_since if protect_since is not None else time.time(),)
+                )
+                for row in cursor:
+                    victims.append(dict(row))
+                    freed += row['size']
+                    if freed >= bytes_to_free:
+                        break
+                cursor.executemany(
+                    "DELETE FROM block_cache_blocks WHERE file_key = ? AND block_size = ? AND block_index = ?",
+                    [(v['file_key'], v['block_size'], v['block_index']) for v in victims]
+                )
+                # 没有剩余块的文件信息一并删除
+                cursor.execute(
+                    """DELETE FROM block_cache_files
+                       WHERE file_key NOT IN (SELECT DISTINCT file_key FROM block_cache_blocks)"""
+                )
+            return victims
+        except Exception as e:
+            logger.error(f"❌ 淘汰缓存块失败: {e}")
+            return []
+
+    def remove_cached_block(self, file_key: str, block_size: int, block_index: int) -> bool:
+        """删除一个块的索引（块文件丢失时）"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM block_cache_blocks WHERE file_key = ? AND block_size = ? AND block_index = ?",
+                    (file_key, block_size, block_index)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ 删除缓存块索引失败: {e}")
+            return False
+
+    def remove_block_cache_file(self, file_key: str) -> List[Dict[str, Any]]:
+        """删除一个文件的全部缓存块（文件内容变化时），返回被删除的块"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "SELECT file_key, block_size, block_index, size FROM block_cache_blocks WHERE file_key = ?",
+                    (file_key,)
+                )
+                blocks = [dict(row) for row in cursor.fetchall()]
+                cursor.execute("DELETE FROM block_cache_blocks WHERE file_key = ?", (file_key,))
+                cursor.execute("DELETE FROM block_cache_files WHERE file_key = ?", (file_key,))
+                return blocks
+        except Exception as e:
+            logger.error(f"❌ 删除文件缓存块失败: {e}")
+            return []
+
+    def clear_block_cache(self) -> int:
+        """清空分块缓存索引"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) AS count FROM block_cache_blocks")
+                count = cursor.fetchone()['count']
+                cursor.execute("DELETE FROM block_cache_blocks")
+                cursor.execute("DELETE FROM block_cache_files")
+                return count
+        except Exception as e:
+            logger.error(f"❌ 清空分块缓存失败: {e}")
+            return 0
+
     # ==================== 配置存储操作 ====================
 
     def get_config_section(self, section_name: str) -> Optional[Dict[str, Any]]:
@@ -521,6 +789,60 @@ class DatabaseManager:
             logger.error(f"❌ 设置配置值失败: {config_key}, {e}")
             return False
 
+    def increment_config_value(self, config_key: str, description: str = None) -> Optional[int]:
+        """
+        原子地将整数配置值 +1（不存在时从 1 开始）
+
+        :return: 新值，失败时返回 None
+        """
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """INSERT INTO config_store (config_key, config_value, config_type, description, updated_at)
+                       VALUES (?, '1', 'int', ?, ?)
+                       ON CONFLICT(config_key) DO UPDATE SET
+                           config_value = CAST(config_value AS INTEGER) + 1,
+                           updated_at = excluded.updated_at""",
+                    (config_key, description, int(time.time()))
+                )
+                cursor.execute(
+                    "SELECT config_value FROM config_store WHERE config_key = ?",
+                    (config_key,)
+                )
+                row = cursor.fetchone()
+                return int(row['config_value']) if row else None
+        except Exception as e:
+            logger.error(f"❌ 递增配置值失败: {config_key}, {e}")
+            return None
+
+    def get_config_values_by_prefix(self, prefix: str) -> List[Dict[str, Any]]:
+        """
+        获取键以 prefix 开头的配置值
+
+        :return: [{'config_key', 'config_value', 'updated_at'}]
+        """
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    """SELECT config_key, config_value, updated_at FROM config_store
+                       WHERE substr(config_key, 1, ?) = ?""",
+                    (len(prefix), prefix)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ 获取配置值失败: {prefix}*, {e}")
+            return []
+
+    def delete_config_value(self, config_key: str) -> bool:
+        """删除单个配置值"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("DELETE FROM config_store WHERE config_key = ?", (config_key,))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ 删除配置值失败: {config_key}, {e}")
+            return False
+
     def list_config_keys(self) -> List[str]:
         """列出所有配置键"""
         try:
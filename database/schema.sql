@@ -151,6 +151,29 @@ CREATE INDEX IF NOT EXISTS idx_api_stats_endpoint ON api_stats(api_endpoint);
 CREATE INDEX IF NOT EXISTS idx_api_stats_created ON api_stats(created_at);
 CREATE INDEX IF NOT EXISTS idx_api_stats_user ON api_stats(user_id);
 
+-- 10. 代理下载分块缓存：文件表（文件标识 → 总大小）
+CREATE TABLE IF NOT EXISTS block_cache_files (
+    file_key TEXT PRIMARY KEY,              -- 文件标识（123:FileId）
+    total_size INTEGER NOT NULL,            -- 文件总大小
+    content_type TEXT,                      -- 上游 Content-Type
+    updated_at INTEGER DEFAULT (unixepoch())
+);
+
+-- 11. 代理下载分块缓存：块索引（块数据在 config/block_cache 下）
+CREATE TABLE IF NOT EXISTS block_cache_blocks (
+    file_key TEXT NOT NULL,                 -- 文件标识
+    block_size INTEGER NOT NULL,            -- 块大小（修改配置后旧块逐步淘汰）
+    block_index INTEGER NOT NULL,           -- 块序号
+    size INTEGER NOT NULL,                  -- 块实际大小（最后一块可能不足 block_size）
+    hits INTEGER DEFAULT 0,                 -- 命中次数（LFU）
+    last_access REAL NOT NULL,              -- 最后访问时间（LRU）
+    created_at INTEGER DEFAULT (unixepoch()),
+    PRIMARY KEY (file_key, block_size, block_index)
+);
+
+-- 分块缓存索引
+CREATE INDEX IF NOT EXISTS idx_block_cache_access ON block_cache_blocks(last_access);
+
 -- 数据清理触发器（自动删除过期数据）
 
 -- 清理过期的直链缓存
@@ -82,10 +82,11 @@ class ClientManager:
                 self.clients['123'] = None
 
     def get_client_for_path(self, path, config):
-        """根据路径获取对应的客户端"""
-        mount_path = config.get('123', {}).get('mount_path', '/123')
-        if path.startswith(mount_path):
-            return self.clients['123'], '123', path[len(mount_path):]
+        """根据路径获取对应的客户端（支持路径映射规则指定的多个挂载前缀）"""
+        from utils.path_mapping import PathMappingEngine
+        for mount_path in PathMappingEngine.mount_paths_from_config(config):
+            if path.startswith(mount_path):
+                return self.clients['123'], '123', path[len(mount_path):]
         
         logger.warning(f"❌ 未匹配任何网盘: {path}")
         return None, None, path
@@ -146,7 +147,7 @@ class ClientManager:
             try:
                 # 使用 p123client 的 Open API 方法
                 # 注意：需要使用 P123OpenClient 或确保客户端初始化时使用了 client_id/client_secret
-                import requests
+                from utils.upstream_client import get_upstream_pool
                 
                 # 获取 access_token
                 token = None
@@ -168,7 +169,7 @@ class ClientManager:
                     'Authorization': f'Bearer {token}'
                 }
                 
-                resp = requests.get(url, headers=headers, timeout=10)
+                resp = get_upstream_pool().request('GET', url, headers=headers, timeout=10)
                 direct_link_result = resp.json()
                 
                 logger.info(f"Open API 响应: code={direct_link_result.get('code')}, message={direct_link_result.get('message')}")
@@ -6,6 +6,8 @@ import json
 from flask import request, jsonify
 from models.config import ConfigManager
 from utils.cache import CacheManager
+from utils.path_mapping import PathMappingEngine
+from utils.routing_plan import get_routing_plan
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +86,7 @@ class AlistApiService:
             logger.debug(f"请求获取文件直链: {file_path}")
 
             # 应用路径映射
-            config = self.config_manager.load_config()
+            config = self.config_manager.get_config_snapshot().config
             mapped_url = self.apply_path_mapping(file_path, config)
 
             if mapped_url:
@@ -125,7 +127,7 @@ class AlistApiService:
             username = data.get('username', '')
             password = data.get('password', '')
 
-            config = self.config_manager.load_config()
+            config = self.config_manager.get_config_snapshot().config
 
             # 验证管理员账号
             if (username == config['service']['username'] and
@@ -162,31 +164,22 @@ class AlistApiService:
                 logger.info(f"路径映射未启用，所有资源走本地代理")
                 return 'LOCAL_PROXY'
 
-            from_prefix = config['emby']['path_mapping']['from']
-            to_prefix = config['emby']['path_mapping']['to']
-
-            # 检查缓存
-            cache_key = f"link:{file_path}"
-            if self.cache_manager.is_direct_link_valid(cache_key):
-                cached = self.cache_manager.get_direct_link(cache_key)
-                logger.debug(f"缓存命中: {file_path}")
-                return cached['url']
+            # 当前配置快照复用已编译的路由计划，其他配置临时构建映射引擎
+            snapshot = self.config_manager.get_config_snapshot()
+            if config is snapshot.config:
+                engine = get_routing_plan(snapshot).path_mapping
+            else:
+                engine = PathMappingEngine.from_config(config)
 
-            # 执行路径映射
-            if not file_path.startswith(from_prefix):
-                logger.info(f"路径不匹配网盘前缀，走本地代理: {file_path[:50]}... (前缀: {from_prefix})")
+            # 执行路径映射（多规则最长前缀匹配，内存中完成，无需缓存）
+            match = engine.match(file_path)
+            if match is None:
+                logger.info(f"路径不匹配任何网盘规则，走本地代理: {file_path[:50]}...")
                 return 'LOCAL_PROXY'
 
-            # 替换路径前缀 - 这是网盘资源
-            mapped_path = file_path.replace(from_prefix, to_prefix, 1)
-            logger.debug(f"网盘路径映射: {file_path} -> {mapped_path}")
-
-            # 缓存结果
-            expire_time = config['emby'].get('cache_expire_time', 3600)
-            self.cache_manager.set_direct_link(cache_key, mapped_path, expire_time)
-            logger.debug(f"已缓存直链，过期: {expire_time}s")
-
-            return mapped_path
+            # 这是网盘资源
+            logger.debug(f"网盘路径映射({match.rule.describe()}): {file_path} -> {match.mapped_path}")
+            return match.mapped_path
 
         except Exception as e:
             logger.error(f"❌ 路径映射异常: {e}")
@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理流量的带宽调度（按用户 / 设备限速与加权公平分配）
+
+代理模式下载（/proxy/download）和本地资源的 Emby 代理流共用服务器的上行带宽：
+一个用户经代理下载 80Mbps 的原盘，就能把另一个用户的 1080p 播放挤到卡顿。
+所有经过代理的媒体流都在调度器中登记（关闭限速时也登记，用于显示实时速率），
+开启 stream.bandwidth_enable 后每个数据块发送前按令牌桶等待：
+
+- 限速：bandwidth_user_mbps（每个用户）、bandwidth_device_mbps（每台设备）为令牌桶，
+  同一用户 / 设备的多个流共享；识别不到用户时按 IP 计
+- 总带宽 bandwidth_global_mbps 按权重在活跃流之间公平分配（水位填充）：实际用不满
+  份额的流（如播放器缓冲已满、客户端自己限速）只分配它的实测速率加余量，剩余带宽
+  分给其他流；权重来自 bandwidth_user_weights（用户名 → 权重，默认 1）
+- 缓冲加速：流被调度器限速（而不是客户端读得慢）且最近速率明显低于它自己的长期平均速率时，
+  认为播放器缓冲在下降（正在缓冲），权重临时乘以 BOOST_FACTOR；刚开始的流播放器缓冲为空，
+  同样按正在缓冲处理
+
+0 表示不限制。限速只在数据块之间等待，不改变转发方式（splice / 直写 socket 仍然可用）。
+
+多 worker 模式（EMBY_PROXY_WORKERS > 1）下每个进程只看到自己的流：各进程每秒把本进程的
+负载（活跃流的权重合计、每个用户 / 设备的流数）写入 config_store，并读取其他进程的负载，
+总带宽按权重比例、用户 / 设备限速按流数比例分到各进程，所有进程合计不超过配置的限额。
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from itertools import count
+from urllib.parse import urlsplit, unquote
+
+from models.config import ConfigManager
+from database.database import get_db_manager
+from utils.bounded_cache import BoundedCache
+from utils.routing_plan import get_routing_plan
+from utils.shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+MBPS = 1000 * 1000 / 8          # 1 Mbps 对应的字节/秒
+
+REBALANCE_INTERVAL = 0.5        # 公平份额的重新计算间隔（秒）
+RATE_WINDOW = 1.0               # 实时速率的采样窗口（秒）
+RECENT_SECONDS = 3.0            # 近期速率的时间常数（秒，平滑客户端读取的突发）
+AVERAGE_SECONDS = 20.0          # 长期平均速率的时间常数（秒）
+BURST_SECONDS = 0.25            # 令牌桶容量：0.25 秒的流量
+MIN_BURST = 256 * 1024          # 令牌桶容量下限（不小于一个转发数据块）
+MIN_SHARE = 256 * 1024          # 用不满份额的流至少保留的速率（字节/秒）
+HEADROOM = 1.5                  # 用不满份额的流在实测速率之上保留的余量
+LIMITED_RATIO = 0.9             # 近期速率达到公平份额的 90% 视为被份额限住
+WAIT_RATIO = 0.5                # 窗口内一半以上时间在等令牌视为被限速（含用户 / 设备限速）
+BUFFERING_RATIO = 0.7           # 被限速且速率低于长期平均的 70% 视为正在缓冲
+BOOST_FACTOR = 2.0
+BOOST_SECONDS = 10.0
+SYNC_INTERVAL = 1.0             # 多 worker 模式下交换各进程负载的间隔（秒）
+LOAD_TTL = 5.0                  # 超过该时间未更新的进程负载视为进程已退出
+LOAD_EXPIRE = 60.0              # 超过该时间未更新的负载记录删除
+LOAD_KEY_PREFIX = 'bandwidth_load:'
+
+# 需要调度的 Emby 媒体流（视频 / 音频流和下载）
+MEDIA_PATH_PATTERN = re.compile(r'/(videos|audio)/[^/]+/|/items/[^/]+/download', re.IGNORECASE)
+
+
+def is_media_path(path):
+    """请求路径是否为 Emby 媒体流"""
+    return bool(path and MEDIA_PATH_PATTERN.search(path))
+
+
+class TokenBucket:
+    """令牌桶（可透支：先取走令牌，返回补足欠额需要等待的时间）"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', '_lock')
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = MIN_BURST
+        self.tokens = MIN_BURST
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        """
+        :param rate: 字节/秒，0 表示不限制
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(0, rate)
+            self.burst = max(self.rate * BURST_SECONDS, MIN_BURST)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, size, now):
+        """取走 size 个令牌，返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(now)
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BandwidthStream:
+    """调度器中的一个流（一个代理响应）"""
+
+    def __init__(self, scheduler, stream_id, kind, user, device, ip, label, user_key, device_key):
+        self.scheduler = scheduler
+        self.id = stream_id
+        self.kind = kind
+        self.user = user
+        self.device = device
+        self.ip = ip
+        self.label = label
+        self.user_key = user_key
+        self.device_key = device_key
+        self.bucket = TokenBucket()
+        self.started = time.monotonic()
+        self.closed = False
+
+        self.bytes = 0
+        self.rate = 0.0             # 最近一个采样窗口的速率（字节/秒）
+        self.recent = 0.0           # 近期速率
+        self.average = 0.0          # 长期平均速率
+        self.limited = False        # 近期速率是否顶到公平份额
+        self.throttled = False      # 是否被调度器限速（公平份额或用户 / 设备限速）
+        self.weight = 1.0
+        self.boosted_until = self.started + BOOST_SECONDS     # 开播时缓冲为空
+        self.allocated = 0.0        # 当前公平份额（字节/秒，0 表示不限制）
+        self.waited = 0.0           # 累计等待时间（秒）
+
+        self._samples = 0
+        self._window_start = self.started
+        self._window_bytes = 0
+        self._window_wait = 0.0
+
+    def reserve(self, size):
+        """
+        记录即将发送的 size 字节，返回发送前需要等待的秒数（异步数据面自行 await）
+        """
+        now = time.monotonic()
+        self.bytes += size
+        self._window_bytes += size
+        if now - self._window_start >= RATE_WINDOW:
+            self._sample(now)
+        scheduler = self.scheduler
+        scheduler.maybe_rebalance(now)
+        if not scheduler.enabled:
+            return 0.0
+        wait = max(self.bucket.reserve(size, now),
+                   scheduler.bucket_reserve(self.user_key, size, now, user=True),
+                   scheduler.bucket_reserve(self.device_key, size, now, user=False))
+        self._window_wait += wait
+        self.waited += wait
+        return wait
+
+    def throttle(self, size):
+        """发送 size 字节前按限速等待（同步数据面）"""
+        wait = self.reserve(size)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def athrottle(self, size):
+        wait = self.reserve(size)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def wrap(self, iterable):
+        """包装 WSGI 可迭代对象：每个数据块发送前限速，响应关闭时关闭流和原可迭代对象"""
+        return ThrottledBody(self, iterable)
+
+    async def awrap(self, chunks):
+        """包装异步数据块迭代器（ASGI 数据面）"""
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await self.athrottle(len(chunk))
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.scheduler._remove(self)
+
+    def _sample(self, now):
+        elapsed = now - self._window_start
+        rate = self._window_bytes / elapsed
+        if self._samples:
+            self.recent += min(1.0, elapsed / RECENT_SECONDS) * (rate - self.recent)
+        else:
+            self.recent = rate
+        self.limited = self.allocated > 0 and self.recent >= self.allocated * LIMITED_RATIO
+        self.throttled = self.limited or self._window_wait >= elapsed * WAIT_RATIO
+        # 被限速而近期速率掉到长期平均之下：客户端读得动，是我们给得不够，播放器缓冲在下降
+        if self.throttled and self.average > 0 and self.recent < self.average * BUFFERING_RATIO:
+            if self.boosted_until <= now:
+                self.scheduler.boosts += 1
+                logger.debug(f"⏫ 流 {self.id} 正在缓冲，临时提高权重: {self.label}")
+            self.boosted_until = now + BOOST_SECONDS
+        # 第一个窗口包含填满 socket 缓冲区的突发，不计入长期平均
+        self._samples += 1
+        if self._samples == 2:
+            self.average = rate
+        elif self._samples > 2:
+            self.average += min(1.0, elapsed / AVERAGE_SECONDS) * (rate - self.average)
+        self.rate = rate
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_wait = 0.0
+
+    def current_rate(self, now):
+        """实时速率（长时间没有数据块时按空闲时间衰减）"""
+        idle = now - self._window_start
+        if idle >= 2 * RATE_WINDOW:
+            return self._window_bytes / idle
+        return self.rate
+
+    def demand(self, now):
+        """用不满份额时的需求估计（需求上升时速率会顶到份额，下一次分配即按完整份额计）"""
+        idle = now - self._window_start
+        if idle >= 2 * RATE_WINDOW:
+            return self._window_bytes / idle
+        return self.recent
+
+    def boosted(self, now):
+        return self.boosted_until > now
+
+    def to_dict(self, now):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'user': self.user,
+            'device': self.device,
+            'ip': self.ip,
+            'label': self.label,
+            'rate_mbps': round(self.current_rate(now) / MBPS, 2),
+            'average_mbps': round(self.average / MBPS, 2),
+            'allocated_mbps': round(self.allocated / MBPS, 2) if self.allocated else None,
+            'weight': self.weight,
+            'buffering': self.scheduler.enabled and self.boosted(now),
+            'limited': self.throttled,
+            'bytes': self.bytes,
+            'waited_seconds': round(self.waited, 1),
+            'duration': int(now - self.started)
+        }
+
+
+class ThrottledBody:
+    """限速的 WSGI 响应体（服务器在响应结束时调用 close，未开始迭代时也会调用）"""
+
+    def __init__(self, stream, iterable):
+        self.stream = stream
+        self.iterable = iterable
+
+    def __iter__(self):
+        throttle = self.stream.throttle
+        for chunk in self.iterable:
+            if chunk:
+                throttle(len(chunk))
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+        close = getattr(self.iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+class BandwidthScheduler:
+    """代理流量的带宽调度器"""
+
+    def __init__(self):
+        self.db = get_db_manager()
+        self.config_manager = ConfigManager()
+        self._streams = {}              # id → BandwidthStream
+        self._buckets = {}              # ('user' | 'device', key) → [TokenBucket, 引用数]
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._rebalance_lock = threading.Lock()
+        self._last_rebalance = 0.0
+        # 设备ID / IP → (用户名, 设备名)
+        self._identities = BoundedCache('bandwidth_identity', max_size=2000, ttl=30)
+
+        self.plan_version = None
+        self.enabled = False
+        self.global_rate = 0.0
+        self.user_rate = 0.0
+        self.device_rate = 0.0
+        self.user_weights = {}
+        # 其他 worker 进程的负载：权重合计、每个用户 / 设备的流数
+        self._remote = {'weight': 0.0, 'user': {}, 'device': {}}
+        self._sync_thread = None
+        self._published = False
+        self.workers = 1
+
+        self.opened = 0
+        self.boosts = 0
+
+        self._apply_plan(self.get_plan())
+        self.config_manager.subscribe(lambda snapshot: self._apply_plan(get_routing_plan(snapshot)))
+
+    def get_plan(self):
+        return get_routing_plan(self.config_manager.get_config_snapshot())
+
+    def _apply_plan(self, plan):
+        with self._lock:
+            if plan.version == self.plan_version:
+                return
+            self.plan_version = plan.version
+            self.enabled = plan.bandwidth_enable
+            self.global_rate = plan.bandwidth_global_mbps * MBPS
+            self.user_rate = plan.bandwidth_user_mbps * MBPS
+            self.device_rate = plan.bandwidth_device_mbps * MBPS
+            self.user_weights = plan.bandwidth_user_weights
+            self._update_buckets()
+        self._last_rebalance = 0.0
+
+    def _local_rate(self, key, local_count):
+        """用户 / 设备限速中本进程的部分（按各进程的流数比例分配，调用方持有 _lock）"""
+        kind, name = key
+        rate = self.user_rate if kind == 'user' else self.device_rate
+        if rate <= 0 or local_count <= 0:
+            return rate
+        remote = self._remote[kind].get(name, 0)
+        return rate * local_count / (local_count + remote)
+
+    def _update_buckets(self):
+        for key, entry in self._buckets.items():
+            entry[0].set_rate(self._local_rate(key, entry[1]))
+
+    # ==================== 流登记 ====================
+
+    def resolve_identity(self, device_id=None, ip=None):
+        """
+        按客户端跟踪记录识别用户
+
+        :return: (用户名, 设备名)，识别不到时为 None
+        """
+        key = device_id or ip
+        if not key:
+            return None, None
+        identity = self._identities.get(key)
+        if identity is None:
+            connection = self.db.find_client_connection(device_id=device_id, ip_address=ip)
+            identity = ((connection.get('user_id'), connection.get('device_name'))
+                        if connection else (None, None))
+            self._identities.set(key, identity)
+        return identity
+
+    def open_stream(self, kind, ip=None, device_id=None, user=None, device=None, label=''):
+        """
+        登记一个流（调用方在响应结束时 close，或使用 wrap / 交给 UpstreamRelay 关闭）
+
+        :param kind: 'emby'（Emby 代理流）或 'download'（代理模式下载）
+        :param ip: 客户端 IP
+        :param device_id: Emby 设备ID（有时按设备限速，否则按 IP）
+        :param user: 用户名（不传时按设备ID / IP 从客户端跟踪记录查找）
+        :param device: 设备名
+        :param label: 显示用的名称（文件名 / 请求路径）
+        """
+        if user is None:
+            user, found_device = self.resolve_identity(device_id, ip)
+            device = device or found_device
+        user_key = ('user', user or f"ip:{ip}")
+        device_key = ('device', device_id or f"ip:{ip}")
+        with self._lock:
+            stream = BandwidthStream(self, next(self._ids), kind, user, device or device_id, ip, label,
+                                     user_key, device_key)
+            for key in (user_key, device_key):
+                entry = self._buckets.get(key)
+                if entry is None:
+                    entry = self._buckets[key] = [TokenBucket(), 0]
+                entry[1] += 1
+                entry[0].set_rate(self._local_rate(key, entry[1]))
+            self._streams[stream.id] = stream
+            self.opened += 1
+        # 新流加入后立即重新分配份额
+        self._last_rebalance = 0.0
+        self._ensure_sync()
+        return stream
+
+    def open_download(self, ip, download_url, file_key=None):
+        """登记一个代理模式下载（/proxy/download），按 IP 识别用户"""
+        label = file_key or unquote(urlsplit(download_url).path.rsplit('/', 1)[-1])
+        return self.open_stream('download', ip=ip, label=label)
+
+    def _remove(self, stream):
+        with self._lock:
+            if self._streams.pop(stream.id, None) is None:
+                return
+            for key in (stream.user_key, stream.device_key):
+                entry = self._buckets.get(key)
+                if entry is not None:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del self._buckets[key]
+                    else:
+                        entry[0].set_rate(self._local_rate(key, entry[1]))
+        self._last_rebalance = 0.0
+
+    def bucket_reserve(self, key, size, now, user):
+        if (self.user_rate if user else self.device_rate) <= 0:
+            return 0.0
+        entry = self._buckets.get(key)
+        return entry[0].reserve(size, now) if entry is not None else 0.0
+
+    # ==================== 公平分配 ====================
+
+    def maybe_rebalance(self, now):
+        if now - self._last_rebalance < REBALANCE_INTERVAL or not self._rebalance_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_rebalance = now
+            self._rebalance(now)
+        finally:
+            self._rebalance_lock.release()
+
+    def _rebalance(self, now):
+        """按权重水位填充：用不满份额的流只分配实测速率加余量，剩余带宽在其余流之间按权重分"""
+        with self._lock:
+            streams = list(self._streams.values())
+            weights = self.user_weights
+            global_rate = self.global_rate if self.enabled else 0
+            remote_weight = self._remote['weight']
+        for stream in streams:
+            boosted = stream.boosted(now)
+            weight = float(weights.get(stream.user, 1) or 1) if stream.user else 1.0
+            stream.weight = weight * BOOST_FACTOR if boosted else weight
+        if global_rate > 0 and remote_weight > 0 and streams:
+            # 多 worker：总带宽按各进程活跃流的权重合计分配
+            local_weight = sum(stream.weight for stream in streams)
+            global_rate *= local_weight / (local_weight + remote_weight)
+
+        if global_rate <= 0:
+            for stream in streams:
+                if stream.allocated:
+                    stream.allocated = 0.0
+                    stream.bucket.set_rate(0)
+            return
+
+        remaining = global_rate
+        pending = streams
+        allocations = {}
+        while pending:
+            unit = remaining / sum(stream.weight for stream in pending)
+            satisfied = []
+            for stream in pending:
+                # 刚开始的流和被份额限住的流需求未知，按完整份额计
+                if stream.limited or now - stream.started < RATE_WINDOW:
+                    continue
+                demand = max(stream.demand(now) * HEADROOM, MIN_SHARE)
+                if demand < unit * stream.weight:
+                    satisfied.append((stream, demand))
+            if not satisfied:
+                for stream in pending:
+                    allocations[stream.id] = unit * stream.weight
+                break
+            for stream, demand in satisfied:
+                allocations[stream.id] = demand
+                remaining -= demand
+            done = {stream.id for stream, _ in satisfied}
+            pending = [stream for stream in pending if stream.id not in done]
+
+        for stream in streams:
+            rate = max(allocations.get(stream.id, MIN_SHARE), 1.0)
+            if abs(rate - stream.allocated) > stream.allocated * 0.02:
+                stream.allocated = rate
+                stream.bucket.set_rate(rate)
+
+    # ==================== 多 worker 同步 ====================
+
+    def _ensure_sync(self):
+        """多 worker 模式下启动负载同步线程（单进程模式不访问数据库）"""
+        if self._sync_thread is not None or not get_shared_state().enabled:
+            return
+        with self._lock:
+            if self._sync_thread is not None:
+                return
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True, name='BandwidthSync')
+        self._sync_thread.start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(SYNC_INTERVAL)
+            try:
+                self.sync_workers()
+            except Exception as e:
+                logger.debug(f"⚠️ 带宽负载同步失败: {e}")
+
+    def sync_workers(self):
+        """发布本进程的负载并汇总其他进程的负载（没有活跃流或未开启限速时只清理自己的记录）"""
+        own_key = f"{LOAD_KEY_PREFIX}{os.getpid()}"
+        with self._lock:
+            streams = list(self._streams.values())
+            limited = self.enabled and (self.global_rate > 0 or self.user_rate > 0 or self.device_rate > 0)
+        if not streams or not limited:
+            if self._published:
+                self.db.delete_config_value(own_key)
+                self._published = False
+            return
+
+        load = {'weight': sum(stream.weight for stream in streams), 'user': {}, 'device': {}}
+        for stream in streams:
+            for kind, name in (stream.user_key, stream.device_key):
+                load[kind][name] = load[kind].get(name, 0) + 1
+        self.db.set_config_value(own_key, json.dumps(load), '带宽调度进程负载')
+        self._published = True
+
+        remote = {'weight': 0.0, 'user': {}, 'device': {}}
+        workers = 1
+        wall_now = time.time()
+        for row in self.db.get_config_values_by_prefix(LOAD_KEY_PREFIX):
+            if row['config_key'] == own_key:
+                continue
+            age = wall_now - (row['updated_at'] or 0)
+            if age > LOAD_TTL:
+                if age > LOAD_EXPIRE:
+                    self.db.delete_config_value(row['config_key'])
+                continue
+            try:
+                other = json.loads(row['config_value'])
+            except (TypeError, ValueError):
+                continue
+            workers += 1
+            remote['weight'] += float(other.get('weight') or 0)
+            for kind in ('user', 'device'):
+                for name, streams_count in (other.get(kind) or {}).items():
+                    remote[kind][name] = remote[kind].get(name, 0) + streams_count
+
+        with self._lock:
+            changed = remote != self._remote
+            self._remote = remote
+            self.workers = workers
+            if changed:
+                self._update_buckets()
+        if changed:
+            self._last_rebalance = 0.0
+
+    # ==================== 统计 ====================
+
+    def streams(self):
+        """活跃流的实时速率"""
+        now = time.monotonic()
+        with self._lock:
+            streams = list(self._streams.values())
+        return [stream.to_dict(now) for stream in sorted(streams, key=lambda s: s.started)]
+
+    def stats(self):
+        streams = self.streams()
+        users = {}
+        for item in streams:
+            name = item['user'] or item['ip'] or 'Unknown'
+            entry = users.setdefault(name, {'user': name, 'streams': 0, 'rate_mbps': 0.0})
+            entry['streams'] += 1
+            entry['rate_mbps'] = round(entry['rate_mbps'] + item['rate_mbps'], 2)
+        return {
+            'enabled': self.enabled,
+            'workers': self.workers,
+            'limits': {
+                'global_mbps': round(self.global_rate / MBPS, 2),
+                'user_mbps': round(self.user_rate / MBPS, 2),
+                'device_mbps': round(self.device_rate / MBPS, 2)
+            },
+            'active': len(streams),
+            'total_mbps': round(sum(item['rate_mbps'] for item in streams), 2),
+            'buffering': sum(1 for item in streams if item['buffering']),
+            'opened': self.opened,
+            'boosts': self.boosts,
+            'users': sorted(users.values(), key=lambda u: -u['rate_mbps']),
+            'streams': streams
+        }
+
+
+# 全局实例
+_bandwidth_scheduler = None
+_bandwidth_scheduler_lock = threading.Lock()
+
+
+def get_bandwidth_scheduler():
+    """获取全局带宽调度器"""
+    global _bandwidth_scheduler
+    if _bandwidth_scheduler is None:
+        with _bandwidth_scheduler_lock:
+            if _bandwidth_scheduler is None:
+                _bandwidth_scheduler = BandwidthScheduler()
+    return _bandwidth_scheduler
@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理模式下载的磁盘分块缓存
+
+download_mode = 'proxy' 时每次播放、重看、拖动都要从 123 CDN 重新拉取全部字节，
+两个人看同一部电影就要消耗两倍上游带宽。分块缓存按文件标识（123:FileId，由
+/proxy/download?file=...&url=... 传入）把文件切成固定大小的块（默认 4MB），
+存放在 config/block_cache 下：
+- 任意客户端 Range 请求按块读取：已缓存的块直接从磁盘返回，连续缺失的块合并为
+  一次上游 Range 请求，边转发边写入缓存
+- 块索引（大小、命中次数、最后访问时间）在 SQLite 中，多 worker 进程共享
+- 超出磁盘预算时按 LRU / LFU 淘汰（最近访问过的块不淘汰）
+- 上游报告的文件总大小与记录不一致时（同一标识的内容已变）丢弃该文件的全部块
+
+块数据先写临时文件再原子替换，之后才登记到索引：索引中存在的块一定完整。
+配置见 stream.block_cache_enable / block_cache_size_mb / block_size_mb / block_cache_policy。
+
+开启顺序预读或并行分段拉取（stream.read_ahead_enable / parallel_fetch_enable，见
+services/read_ahead.py）时，缺失块的上游拉取交给分段读取器；只开预读 / 并行拉取、
+不开缓存（或没有文件标识）时同样经过 CachedDownload，只是不读写磁盘。
+开启上游共享（stream.fanout_enable，见 services/fanout.py）时，同一文件的并发请求
+订阅同一个上游拉取，块由拉取线程写入缓存。
+"""
+
+import os
+import re
+import time
+import hmac
+import shutil
+import hashlib
+import logging
+import threading
+from functools import partial
+from urllib.parse import quote, unquote, parse_qs
+
+from werkzeug.http import parse_range_header
+
+from database.database import get_db_manager
+from models.config import ConfigManager
+from utils.routing_plan import get_routing_plan
+from utils.upstream_client import get_upstream_pool
+from services.read_ahead import ReadAheadReader, read_ahead_enabled
+from services.fanout import get_fanout_hub
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                       '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+SIGNING_KEY_PATH = os.path.join('config', 'proxy_download.key')
+
+_signing_key = None
+_signing_key_lock = threading.Lock()
+
+
+def _get_signing_key():
+    """
+    获取 /proxy/download 文件标识的签名密钥
+
+    首次使用时随机生成并保存到 config/proxy_download.key；先写临时文件再 link，
+    多个 worker 同时启动时只有一个密钥生效，其余进程读取同一个文件
+    """
+    global _signing_key
+    if _signing_key is None:
+        with _signing_key_lock:
+            if _signing_key is None:
+                try:
+                    with open(SIGNING_KEY_PATH, 'rb') as f:
+                        key = f.read()
+                except FileNotFoundError:
+                    key = b''
+                if len(key) < 32:
+                    os.makedirs(os.path.dirname(SIGNING_KEY_PATH), exist_ok=True)
+                    tmp_path = f"{SIGNING_KEY_PATH}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(os.urandom(32))
+                    try:
+                        os.link(tmp_path, SIGNING_KEY_PATH)
+                    except FileExistsError:
+                        pass
+                    finally:
+                        os.remove(tmp_path)
+                    with open(SIGNING_KEY_PATH, 'rb') as f:
+                        key = f.read()
+                _signing_key = key
+    return _signing_key
+
+
+def sign_file_key(download_url, file_key):
+    """文件标识与下载地址一起签名，客户端无法为任意地址伪造标识"""
+    message = f"{file_key}\n{download_url}".encode('utf-8')
+    return hmac.new(_get_signing_key(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def build_proxy_download_query(download_url, file_key=None):
+    """
+    构建 /proxy/download 的查询字符串
+
+    url 必须是最后一个参数：旧链接的 url 可能未编码，解析时把 url= 之后的内容整体视为下载地址。
+    file 参数附带 sig（文件标识 + 下载地址的 HMAC），解析时校验
+    """
+    query = f"url={quote(download_url, safe='')}"
+    if file_key:
+        signature = sign_file_key(download_url, file_key)
+        query = f"file={quote(file_key, safe='')}&sig={signature}&{query}"
+    return query
+
+
+def parse_proxy_download_query(query_string):
+    """
+    解析 /proxy/download 的查询字符串
+
+    file_key 决定分块缓存和上游共享的归属，只有签名校验通过才返回：客户端自行拼接
+    或篡改的 file 参数被忽略（按无标识处理，走不缓存的路径），无法污染 / 清空别的文件的缓存
+
+    :return: (download_url, file_key)；缺少 url 参数时 download_url 为 None
+    """
+    if query_string.startswith('url='):
+        prefix, raw_url = '', query_string[4:]
+    else:
+        prefix, sep, raw_url = query_string.partition('&url=')
+        if not sep:
+            return None, None
+    download_url = unquote(raw_url)
+    params = parse_qs(prefix) if prefix else {}
+    file_key = params.get('file', [None])[0]
+    if file_key:
+        signature = params.get('sig', [''])[0]
+        if not hmac.compare_digest(signature.encode('utf-8'), sign_file_key(download_url, file_key).encode('ascii')):
+            logger.warning(f"⚠️ 文件标识签名无效，不使用分块缓存: {file_key}")
+            file_key = None
+    return download_url, file_key
+
+
+def parse_content_range(value):
+    """
+    解析 Content-Range: bytes start-end/total
+
+    :return: (start, end, total)，total 未知时为 None；格式错误返回 None
+    """
+    match = _CONTENT_RANGE_RE.match(value or '')
+    if not match:
+        return None
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), None if total == '*' else int(total)
+
+
+class UpstreamChanged(Exception):
+    """上游文件与缓存记录不一致（总大小变化或不支持 Range）"""
+
+
+class BlockCache:
+    """磁盘分块缓存（块数据在文件系统，索引在 SQLite）"""
+
+    EVICT_TARGET = 0.95       # 超出预算时淘汰到预算的 95%，避免每写一块都淘汰
+    PROTECT_SECONDS = 60      # 最近 1 分钟访问过的块不淘汰（正在播放）
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join('config', 'block_cache')
+        self.db = get_db_manager()
+        self.config_manager = ConfigManager()
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+        self.hit_blocks = 0
+        self.hit_bytes = 0          # 从缓存返回给客户端的字节（节省的上游流量）
+        self.miss_bytes = 0         # 从上游返回给客户端的字节
+        self.upstream_bytes = 0     # 从上游拉取的字节（含按块对齐多读的部分）
+        self.stored_blocks = 0
+        self.evicted_blocks = 0
+        self.evicted_bytes = 0
+        self.invalidated_files = 0
+        self.errors = 0
+
+        # 调小磁盘预算后立即淘汰，不必等下一次写入
+        self.config_manager.subscribe(self._on_config_changed)
+
+    def _on_config_changed(self, snapshot):
+        plan = get_routing_plan(snapshot)
+        if self.is_enabled(plan):
+            self.evict(plan)
+
+    def get_plan(self):
+        return get_routing_plan(self.config_manager.get_config_snapshot())
+
+    def is_enabled(self, plan=None):
+        plan = plan or self.get_plan()
+        return plan.block_cache_enable and plan.block_cache_bytes > 0
+
+    def count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    # ==================== 文件信息 ====================
+
+    def get_file_info(self, file_key):
+        """:return: {'total_size', 'content_type'}，未记录时为 None"""
+        return self.db.get_block_cache_file(file_key)
+
+    def record_file(self, file_key, total_size, content_type=None):
+        """记录文件总大小；与已有记录不一致时丢弃该文件的全部缓存块"""
+        info = self.db.get_block_cache_file(file_key)
+        if info is not None and info['total_size'] != total_size:
+            logger.info(f"🗑️ 文件大小变化，丢弃分块缓存: {file_key} ({info['total_size']} → {total_size})")
+            self.invalidate_file(file_key)
+            info = None
+        if info is None or (content_type and info.get('content_type') != content_type):
+            self.db.set_block_cache_file(file_key, total_size, content_type)
+
+    def invalidate_file(self, file_key):
+        self._remove_block_files(self.db.remove_block_cache_file(file_key))
+        self.count(invalidated_files=1)
+
+    # ==================== 块读写 ====================
+
+    def block_path(self, file_key, block_size, block_index):
+        digest = hashlib.sha1(file_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, f"{block_size // (1024 * 1024)}M", digest[:2], digest,
+                            f"{block_index}.blk")
+
+    def cached_blocks(self, file_key, block_size, first, last):
+        """:return: [first, last] 内已缓存的块序号 → 块大小"""
+        return self.db.get_cached_blocks(file_key, block_size, first, last)
+
+    def read_block(self, file_key, block_size, block_index, expected_size):
+        """
+        读取一个缓存块
+
+        :return: 块数据；块文件丢失或不完整时删除索引并返回 None
+        """
+        path = self.block_path(file_key, block_size, block_index)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None  # 读取前刚被淘汰
+        except OSError as e:
+            logger.warning(f"⚠️ 读取缓存块失败: {e}")
+            data = None
+            self.count(errors=1)
+        if data is None or len(data) != expected_size:
+            if data is not None:
+                logger.warning(f"⚠️ 缓存块不完整: {path}")
+                self.count(errors=1)
+            self.db.remove_cached_block(file_key, block_size, block_index)
+            return None
+        self.db.touch_cached_block(file_key, block_size, block_index)
+        self.count(hit_blocks=1)
+        return data
+
+    def store_block(self, file_key, block_size, block_index, data, plan=None):
+        """写入一个完整的块并登记索引，超出预算时淘汰旧块"""
+        path = self.block_path(file_key, block_size, block_index)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ 写入缓存块失败: {e}")
+            self.count(errors=1)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        self.db.add_cached_block(file_key, block_size, block_index, len(data))
+        self.count(stored_blocks=1)
+        self.evict(plan)
+        return True
+
+    def evict(self, plan=None):
+        """超出磁盘预算时按策略淘汰"""
+        plan = plan or self.get_plan()
+        if not self._evict_lock.acquire(blocking=False):
+            return  # 其他线程正在淘汰
+        try:
+            used = self.db.get_block_cache_usage()['bytes']
+            if used <= plan.block_cache_bytes:
+                return
+            victims = self.db.pop_block_cache_victims(
+                used - int(plan.block_cache_bytes * self.EVICT_TARGET),
+                plan.block_cache_policy,
+                protect_since=time.time() - self.PROTECT_SECONDS
+            )
+            self._remove_block_files(victims)
+            self.count(evicted_blocks=len(victims), evicted_bytes=sum(v['size'] for v in victims))
+            if victims:
+                logger.debug(f"🧹 分块缓存淘汰 {len(victims)} 块")
+        finally:
+            self._evict_lock.release()
+
+    def _remove_block_files(self, blocks):
+        for block in blocks:
+            path = self.block_path(block['file_key'], block['block_size'], block['block_index'])
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            try:
+                os.rmdir(os.path.dirname(path))  # 文件的最后一块被删除后清理目录
+            except OSError:
+                pass
+
+    def clear(self):
+        """清空分块缓存（索引和块文件）"""
+        count = self.db.clear_block_cache()
+        shutil.rmtree(self.root, ignore_errors=True)
+        return count
+
+    def stats(self):
+        usage = self.db.get_block_cache_usage()
+        plan = self.get_plan()
+        with self._lock:
+            served = self.hit_bytes + self.miss_bytes
+            return {
+                'enabled': self.is_enabled(plan),
+                'policy': plan.block_cache_policy,
+                'block_size': plan.block_size,
+                'budget_bytes': plan.block_cache_bytes,
+                'used_bytes': usage['bytes'],
+                'blocks': usage['blocks'],
+                'files': usage['files'],
+                'hit_ratio': round(self.hit_bytes / served, 3) if served else None,
+                'hit_blocks': self.hit_blocks,
+                'bytes_saved': self.hit_bytes,
+                'upstream_bytes': self.upstream_bytes,
+                'stored_blocks': self.stored_blocks,
+                'evicted_blocks': self.evicted_blocks,
+                'evicted_bytes': self.evicted_bytes,
+                'invalidated_files': self.invalidated_files,
+                'errors': self.errors
+            }
+
+    # ==================== 下载 ====================
+
+    def open_download(self, file_key, download_url, range_header=None, client=None):
+        """
+        为一次 /proxy/download 请求准备分块缓存 / 预读响应
+
+        :param file_key: 文件标识（须来自 parse_proxy_download_query 的签名校验；没有时不使用分块缓存，只做预读）
+        :param download_url: 上游签名直链
+        :param range_header: 客户端 Range 请求头
+        :param client: 客户端标识（IP，预读用来识别拖动）
+        :return: CachedDownload；缓存、预读、并行拉取和上游共享都未开启，或无法使用（多段 Range、上游不支持 Range）
+                 时返回 None，调用方回退到直接转发
+        """
+        plan = self.get_plan()
+        use_cache = self.is_enabled(plan) and bool(file_key)
+        if not use_cache and not (plan.read_ahead_enable or plan.parallel_fetch_enable or plan.fanout_enable):
+            return None
+        download = CachedDownload(self, plan, file_key, download_url, range_header,
+                                  use_cache=use_cache, client=client)
+        try:
+            if download.open():
+                return download
+        except Exception as e:
+            logger.warning(f"⚠️ 分块缓存 / 预读不可用，回退到直接转发: {e}")
+        download.close()
+        return None
+
+
+class CachedDownload:
+    """
+    一次 /proxy/download 请求的分块缓存响应（WSGI 可迭代对象）
+
+    用法：
+        download = get_block_cache().open_download(file_key, url, request.headers.get('Range'))
+        return Response(download, status=download.status, headers=download.response_headers())
+    """
+
+    def __init__(self, cache, plan, file_key, download_url, range_header=None, use_cache=True, client=None):
+        self.cache = cache
+        self.plan = plan
+        self.block_size = plan.block_size
+        self.file_key = file_key
+        self.download_url = download_url
+        self.range_header = range_header
+        self.use_cache = use_cache      # False：只预读，不读写磁盘缓存
+        self.client = client
+        # 预读按文件识别拖动：没有文件标识时用直链路径（签名参数每次不同）
+        self.stream_key = file_key or download_url.split('?', 1)[0]
+        # 上游共享只按签名校验过的文件标识合并；没有标识时要求完整直链相同，
+        # 不能凭相同路径加入别人的拉取（签名参数就是访问凭证）
+        self.fanout_key = file_key or download_url
+        self._file_info = None          # 不使用缓存时从上游响应得到的文件信息
+
+        self.total_size = None
+        self.content_type = None
+        self.status = 200
+        self.start = 0
+        self.end = 0              # 不含
+        self._pending = None      # (上游响应, 起始偏移)：首次请求读取文件大小时打开的上游响应
+
+    # ==================== 准备 ====================
+
+    def open(self):
+        """确定文件大小和响应范围，返回 False 表示需要回退到直接转发"""
+        client_range = parse_range_header(self.range_header) if self.range_header else None
+        if self.range_header and (client_range is None or len(client_range.ranges) != 1):
+            return False  # 多段或无法解析的 Range 不走缓存
+
+        if self.use_cache:
+            info = self.cache.get_file_info(self.file_key)
+        else:
+            # 不使用缓存时，同一文件正在共享拉取就直接沿用它的文件大小
+            info = get_fanout_hub().file_info(self.fanout_key) if self.plan.fanout_enable else None
+        if info is None:
+            # 首次请求：从客户端起点所在的块开始请求上游，顺便得到文件总大小
+            first, last = client_range.ranges[0] if client_range else (0, None)
+            if self.use_cache:
+                aligned = (first // self.block_size) * self.block_size if first >= 0 else 0
+                # 客户端范围有终点时只请求到终点所在块的末尾（超出文件大小时上游会截断）
+                stop = -(-last // self.block_size) * self.block_size if first >= 0 and last is not None else None
+            else:
+                aligned = max(first, 0)
+                stop = last if first >= 0 else None
+            if self.plan.read_ahead_enable or self.plan.parallel_fetch_enable:
+                # 预读 / 并行拉取按段请求上游，首个响应只作为第一段的数据源
+                segment_stop = (aligned // self.block_size + 1) * self.block_size
+                stop = segment_stop if stop is None else min(stop, segment_stop)
+            response = self._open_upstream(aligned, stop)
+            self._pending = (response, aligned)
+            info = self.cache.get_file_info(self.file_key) if self.use_cache else self._file_info
+            if info is None:
+                return False
+        self.total_size = info['total_size']
+        self.content_type = info.get('content_type')
+
+        if client_range is not None:
+            span = client_range.range_for_length(self.total_size)
+            if span is None:
+                self.status = 416
+                return True
+            self.start, self.end = span
+            self.status = 206
+        else:
+            self.start, self.end = 0, self.total_size
+        return True
+
+    def response_headers(self):
+        if self.status == 416:
+            return [('Content-Range', f"bytes */{self.total_size}"), ('Content-Length', '0')]
+        headers = [
+            ('Content-Type', self.content_type or 'application/octet-stream'),
+            ('Accept-Ranges', 'bytes'),
+            ('Cache-Control', 'no-cache'),
+            ('Content-Length', str(self.end - self.start))
+        ]
+        if self.status == 206:
+            headers.append(('Content-Range', f"bytes {self.start}-{self.end - 1}/{self.total_size}"))
+        return headers
+
+    def _open_upstream(self, start, stop, http1=False):
+        """
+        打开上游 Range 请求 [start, stop)（stop 为 None 表示到文件末尾）
+
+        :param http1: 只用 HTTP/1.1（并行分段拉取时每段独占一条 TCP 连接）
+        :raises UpstreamChanged: 上游不支持 Range 或文件大小与记录不一致
+        """
+        headers = {
+            'User-Agent': DOWNLOAD_USER_AGENT,
+            'Accept-Encoding': 'identity',
+            'Range': f"bytes={start}-" if stop is None else f"bytes={start}-{stop - 1}"
+        }
+        response = get_upstream_pool().stream('GET', self.download_url, headers=headers, timeout=30, http1=http1,
+                                              follow_redirects=True)
+        try:
+            if response.status_code == 206:
+                parsed = parse_content_range(response.headers.get('Content-Range'))
+                if parsed is None or parsed[0] != start or parsed[2] is None:
+                    raise UpstreamChanged(f"无法识别的 Content-Range: {response.headers.get('Content-Range')}")
+                total = parsed[2]
+            elif response.status_code == 200 and start == 0:
+                total = int(response.headers.get('Content-Length') or 0)
+                if not total:
+                    raise UpstreamChanged('上游未返回文件大小')
+            else:
+                raise UpstreamChanged(f"上游返回 HTTP {response.status_code}")
+
+            if self.total_size is not None:
+                if total != self.total_size:
+                    if self.use_cache:
+                        self.cache.invalidate_file(self.file_key)
+                    raise UpstreamChanged(f"文件大小变化: {self.total_size} → {total}")
+            elif self.use_cache:
+                self.cache.record_file(self.file_key, total, response.headers.get('Content-Type'))
+            else:
+                self._file_info = {'total_size': total, 'content_type': response.headers.get('Content-Type')}
+            return response
+        except Exception:
+            response.close()
+            raise
+
+    # ==================== 响应体 ====================
+
+    def __iter__(self):
+        if self.status == 416 or self.start >= self.end:
+            return
+        if not self.use_cache:
+            yield from self._fetch_run(self.start, self.end, self.start)
+            return
+        block_size = self.block_size
+        last = (self.end - 1) // block_size
+        cached = self.cache.cached_blocks(self.file_key, block_size, self.start // block_size, last)
+
+        position = self.start
+        while position < self.end:
+            index = position // block_size
+            block_start = index * block_size
+            size = cached.get(index)
+            if size is not None:
+                data = self.cache.read_block(self.file_key, block_size, index, size)
+                if data is not None:
+                    stop = min(self.end, block_start + size)
+                    chunk = data[position - block_start:stop - block_start]
+                    self.cache.count(hit_bytes=len(chunk))
+                    yield chunk
+                    position = stop
+                    continue
+                cached.pop(index, None)
+
+            # 连续缺失的块合并为一次上游请求
+            run_last = index
+            while run_last < last and (run_last + 1) not in cached:
+                run_last += 1
+            run_stop = min((run_last + 1) * block_size, self.total_size)
+            yield from self._fetch_run(block_start, run_stop, position)
+            position = min(self.end, run_stop)
+
+    def _fetch_run(self, run_start, run_stop, position):
+        """从上游拉取 [run_start, run_stop)，完整的块写入缓存，客户端需要的部分 yield"""
+        stop = min(run_stop, self.end)
+        if self.plan.fanout_enable:
+            # 同一文件的并发请求共享上游拉取，块由拉取线程写入缓存
+            chunks = get_fanout_hub().stream(
+                self.fanout_key, position, stop, self.total_size, self._open_source,
+                self.plan.fanout_buffer_bytes, fetch_start=run_start, fetch_stop=run_stop,
+                content_type=self.content_type, sink_factory=self._block_writer if self.use_cache else None
+            )
+            for chunk in chunks:
+                if self.use_cache:
+                    self.cache.count(miss_bytes=len(chunk))
+                yield chunk
+            return
+
+        chunks, close = self._open_source(run_start, run_stop)
+        writer = self._block_writer(run_start) if self.use_cache else None
+        offset = run_start
+        try:
+            for chunk in chunks:
+                if offset + len(chunk) > run_stop:
+                    chunk = chunk[:run_stop - offset]
+                chunk_start = offset
+                offset += len(chunk)
+                if writer is not None:
+                    writer.write(chunk)
+
+                # 转发：客户端请求范围内的部分
+                lo = max(chunk_start, position)
+                hi = min(offset, stop)
+                if hi > lo:
+                    if self.use_cache:
+                        self.cache.count(miss_bytes=hi - lo)
+                    yield chunk[lo - chunk_start:hi - chunk_start]
+                if offset >= run_stop:
+                    break
+            if offset < run_stop:
+                raise ConnectionError(f"上游提前结束: {offset}/{run_stop}")
+        finally:
+            close()
+
+    def _open_source(self, start, stop):
+        """
+        打开 [start, stop) 的上游数据源（优先使用 open() 中已打开的响应）
+
+        :return: (数据块迭代器, 关闭函数)
+        """
+        response = None
+        if self._pending is not None:
+            pending, offset = self._pending
+            self._pending = None
+            if offset == start:
+                response = pending
+            else:
+                pending.close()
+
+        if read_ahead_enabled(self.plan, start, stop, self.block_size):
+            # 按块边界分段，后台提前 / 并行拉取客户端前方的段
+            reader = ReadAheadReader(partial(self._open_upstream, http1=self.plan.parallel_fetch_enable),
+                                     start, stop, self.plan, self.block_size,
+                                     initial=response, key=self.stream_key, client=self.client)
+            return iter(reader), reader.close
+        response = response or self._open_upstream(start, stop)
+        return response.iter_raw(), response.close
+
+    def _block_writer(self, start):
+        return BlockWriter(self.cache, self.file_key, self.block_size, self.total_size, start, self.plan)
+
+    def close(self):
+        if self._pending is not None:
+            self._pending[0].close()
+            self._pending = None
+
+
+class BlockWriter:
+    """把按顺序到达的上游数据按块边界切分写入缓存（起点不在块边界时跳过第一个不完整的块）"""
+
+    def __init__(self, cache, file_key, block_size, total_size, start, plan=None):
+        self.cache = cache
+        self.file_key = file_key
+        self.block_size = block_size
+        self.total_size = total_size
+        self.plan = plan
+        self.offset = start
+        self.skip = -start % block_size
+        self.buffer = bytearray()
+
+    def write(self, chunk):
+        self.cache.count(upstream_bytes=len(chunk))
+        if self.skip:
+            skipped = min(self.skip, len(chunk))
+            chunk = chunk[skipped:]
+            self.skip -= skipped
+            self.offset += skipped
+        if not chunk:
+            return
+        self.buffer += chunk
+        self.offset += len(chunk)
+
+        block_start = self.offset - len(self.buffer)
+        block_len = min(self.block_size, self.total_size - block_start)
+        while len(self.buffer) >= block_len > 0:
+            self.cache.store_block(self.file_key, self.block_size, block_start // self.block_size,
+                                   bytes(self.buffer[:block_len]), self.plan)
+            del self.buffer[:block_len]
+            block_start += block_len
+            block_len = min(self.block_size, self.total_size - block_start)
+
+
+# 全局实例
+_block_cache = None
+_block_cache_lock = threading.Lock()
+
+
+def get_block_cache():
+    """获取全局分块缓存实例"""
+    global _block_cache
+    if _block_cache is None:
+        with _block_cache_lock:
+            if _block_cache is None:
+                _block_cache = BlockCache()
+    return _block_cache
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CDN 自定义域名健康监测
+
+后台线程定期探测所有自定义域名（直链后台验证的结果也会计入），在内存中
+维护延迟 EWMA、请求数、错误率和每个域名的熔断器。重定向热路径只读取内存
+状态选择域名，从不等待探测。
+
+选择策略（url_auth.domain_strategy）：
+- latency：延迟 EWMA 最低（默认）
+- priority：按配置顺序，第一个可用的域名
+- round_robin：轮询
+- weighted：按 url_auth.domain_weights 平滑加权轮询（未配置的域名权重为 1）
+- hash：按文件路径一致性哈希（同一文件固定走同一域名，利于 CDN 缓存）
+
+熔断器状态：
+- closed：正常，可用
+- open：连续失败达到阈值后打开，冷却期内不使用
+- half_open：冷却期结束，仅在没有正常域名时使用；下一次成功关闭，失败重新打开
+"""
+
+import time
+import hashlib
+import logging
+import threading
+
+import httpx
+
+from models.config import ConfigManager
+from utils.routing_plan import get_routing_plan
+from utils.upstream_client import get_upstream_pool
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+STRATEGIES = ('latency', 'priority', 'round_robin', 'weighted', 'hash')
+
+
+def domain_base_url(domain):
+    """自定义域名 → 基础URL（未写协议时使用 https）"""
+    domain = (domain or '').strip().rstrip('/')
+    if domain.startswith(('http://', 'https://')):
+        return domain
+    return f"https://{domain}"
+
+
+class DomainHealth:
+    """单个域名的健康状态"""
+
+    __slots__ = ('domain', 'base_url', 'ewma_ms', 'consecutive_failures', 'checks', 'failures',
+                 'requests', 'current_weight', 'state', 'opened_at', 'last_check_at', 'last_error')
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.base_url = domain_base_url(domain)
+        self.ewma_ms = None
+        self.consecutive_failures = 0
+        self.checks = 0
+        self.failures = 0
+        self.requests = 0          # 被选中的次数
+        self.current_weight = 0    # 平滑加权轮询的当前权重
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.last_check_at = 0.0
+        self.last_error = None
+
+    def to_dict(self):
+        return {
+            'domain': self.domain,
+            'state': self.state,
+            'ewma_ms': round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            'consecutive_failures': self.consecutive_failures,
+            'checks': self.checks,
+            'failures': self.failures,
+            'error_rate': round(self.failures / self.checks, 4) if self.checks else 0.0,
+            'requests': self.requests,
+            'last_check_at': int(self.last_check_at) if self.last_check_at else None,
+            'last_error': self.last_error
+        }
+
+
+class DomainHealthMonitor:
+    """域名健康监测 + 熔断 + 故障切换"""
+
+    PROBE_INTERVAL = 30       # 探测间隔（秒）
+    PROBE_TIMEOUT = 2.0       # 探测超时（秒）
+    FAILURE_THRESHOLD = 3     # 连续失败多少次打开熔断器
+    OPEN_DURATION = 60        # 熔断冷却时间（秒）
+    EWMA_ALPHA = 0.3          # 延迟 EWMA 平滑系数
+
+    def __init__(self):
+        self.config_manager = ConfigManager()
+        self._domains = {}
+        self._rr_counter = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ==================== 状态 ====================
+
+    def _get(self, domain):
+        """获取（必要时创建）域名状态（调用方持有锁）"""
+        health = self._domains.get(domain)
+        if health is None:
+            health = DomainHealth(domain)
+            self._domains[domain] = health
+        return health
+
+    def sync_domains(self, domains):
+        """同步监测的域名列表（移除已不再配置的域名）"""
+        domains = [d for d in domains if d]
+        with self._lock:
+            for domain in domains:
+                self._get(domain)
+            for domain in list(self._domains):
+                if domain not in domains:
+                    del self._domains[domain]
+
+    def record_success(self, domain, latency_ms):
+        with self._lock:
+            health = self._get(domain)
+            health.checks += 1
+            health.last_check_at = time.time()
+            health.consecutive_failures = 0
+            health.last_error = None
+            if health.ewma_ms is None:
+                health.ewma_ms = float(latency_ms)
+            else:
+                health.ewma_ms += self.EWMA_ALPHA * (latency_ms - health.ewma_ms)
+            if health.state != STATE_CLOSED:
+                logger.info(f"✅ 域名恢复: {domain} ({latency_ms:.0f}ms)")
+                health.state = STATE_CLOSED
+
+    def record_failure(self, domain, error=None):
+        with self._lock:
+            health = self._get(domain)
+            health.checks += 1
+            health.failures += 1
+            health.last_check_at = time.time()
+            health.consecutive_failures += 1
+            health.last_error = str(error) if error else 'error'
+            if health.state == STATE_HALF_OPEN or (
+                    health.state == STATE_CLOSED and health.consecutive_failures >= self.FAILURE_THRESHOLD):
+                health.state = STATE_OPEN
+                health.opened_at = time.time()
+                logger.warning(f"⛔ 域名熔断: {domain} (连续失败 {health.consecutive_failures} 次: {health.last_error})")
+
+    def record_url_result(self, url, ok, latency_ms=None, error=None):
+        """记录直链请求结果（被动检查），按 URL 前缀归属到域名"""
+        with self._lock:
+            domain = next((h.domain for h in self._domains.values()
+                           if url == h.base_url or url.startswith(h.base_url + '/')), None)
+        if domain is None:
+            return
+        if ok:
+            self.record_success(domain, latency_ms or 0)
+        else:
+            self.record_failure(domain, error)
+
+    def _current_state(self, health, now):
+        """读取状态时处理 open → half_open 的冷却到期（调用方持有锁）"""
+        if health.state == STATE_OPEN and now - health.opened_at >= self.OPEN_DURATION:
+            health.state = STATE_HALF_OPEN
+        return health.state
+
+    # ==================== 选择 ====================
+
+    def choose_domain(self, domains, strategy='latency', key=None, weights=None):
+        """
+        按策略选择域名（只读内存状态，不阻塞）
+
+        只在正常（closed）域名中选择；都不可用时使用冷却结束（half_open）的域名
+
+        :param domains: 配置的域名列表（顺序即优先级）
+        :param strategy: 选择策略，见 STRATEGIES
+        :param key: 一致性哈希的键（文件路径）
+        :param weights: 加权轮询的权重（域名 → 权重）
+        :return: 域名；全部熔断时返回 None
+        """
+        if not domains:
+            return None
+
+        now = time.time()
+        with self._lock:
+            closed, half_open = [], []
+            for domain in domains:
+                health = self._get(domain)
+                state = self._current_state(health, now)
+                if state == STATE_CLOSED:
+                    closed.append(health)
+                elif state == STATE_HALF_OPEN:
+                    half_open.append(health)
+
+            candidates = closed or half_open
+            if not candidates:
+                return None
+            chosen = self._select(candidates, strategy, key, weights)
+            chosen.requests += 1
+
+        if chosen.domain != domains[0] and strategy in ('latency', 'priority'):
+            logger.debug(f"🔀 域名切换: {domains[0]} → {chosen.domain}")
+        return chosen.domain
+
+    def _select(self, candidates, strategy, key, weights):
+        """在可用域名中按策略选择（调用方持有锁）"""
+        if len(candidates) == 1 or strategy == 'priority':
+            return candidates[0]
+
+        if strategy == 'round_robin':
+            self._rr_counter += 1
+            return candidates[self._rr_counter % len(candidates)]
+
+        if strategy == 'weighted':
+            # 平滑加权轮询：每轮加上权重，选当前权重最大者，再减去总权重
+            total = 0
+            best = None
+            for health in candidates:
+                weight = self._weight(weights, health.domain)
+                health.current_weight += weight
+                total += weight
+                if best is None or health.current_weight > best.current_weight:
+                    best = health
+            best.current_weight -= total
+            return best
+
+        if strategy == 'hash' and key:
+            # Rendezvous 哈希：域名增减时只有该域名上的文件会换域名
+            return max(candidates, key=lambda h: hashlib.md5(f"{h.domain}|{key}".encode('utf-8')).digest())
+
+        # latency（默认）：延迟 EWMA 最低，还没有数据的域名按配置顺序优先
+        return min(candidates, key=lambda h: h.ewma_ms or 0)
+
+    @staticmethod
+    def _weight(weights, domain):
+        try:
+            return max(1, int((weights or {}).get(domain, 1)))
+        except (TypeError, ValueError):
+            return 1
+
+    def is_available(self, domain):
+        with self._lock:
+            health = self._domains.get(domain)
+            return health is None or self._current_state(health, time.time()) != STATE_OPEN
+
+    # ==================== 探测 ====================
+
+    def probe(self, domain):
+        """探测一次（任意非 5xx 响应视为可达，经上游长连接池复用连接）"""
+        base_url = domain_base_url(domain)
+        start = time.perf_counter()
+        try:
+            response = get_upstream_pool().request('HEAD', f"{base_url}/", timeout=self.PROBE_TIMEOUT)
+            latency_ms = (time.perf_counter() - start) * 1000
+            if response.status_code >= 500:
+                self.record_failure(domain, f"HTTP {response.status_code}")
+                return False
+            self.record_success(domain, latency_ms)
+            return True
+        except httpx.HTTPError as e:
+            self.record_failure(domain, e.__class__.__name__)
+            return False
+
+    def probe_all(self):
+        """探测当前配置的所有自定义域名"""
+        plan = get_routing_plan(self.config_manager.get_config_snapshot())
+        domains = list(plan.custom_domains) if plan.url_auth_enable else []
+        self.sync_domains(domains)
+        for domain in domains:
+            if self._stop_event.is_set():
+                return
+            self.probe(domain)
+
+    def start(self):
+        """启动后台探测线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._probe_loop, daemon=True, name='DomainHealthMonitor')
+        self._thread.start()
+        logger.info("🩺 域名健康监测已启动")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _probe_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.warning(f"⚠️ 域名健康探测异常: {e}")
+            self._stop_event.wait(self.PROBE_INTERVAL)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            for health in self._domains.values():
+                self._current_state(health, now)
+            return [health.to_dict() for health in self._domains.values()]
+
+
+# 全局实例
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_domain_health_monitor():
+    """获取全局域名健康监测实例"""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = DomainHealthMonitor()
+    return _monitor
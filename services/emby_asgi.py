@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 反向代理的异步数据面（ASGI + httpx）
+
+Werkzeug 开发服务器每个请求占用一个线程，流式代理响应会长期占住线程和
+requests 连接池。ASGI 数据面中：
+- 控制面（客户端拦截、跟踪、PlaybackInfo 改写、302 重定向判断）复用
+  EmbyProxyService.prepare_proxy_request，在线程池中以 Flask 请求上下文执行，行为与同步版本一致
+- 转发到 Emby 的请求和 /proxy/download 使用 httpx.AsyncClient 异步流式传输，连接池有上限
+
+启动时通过环境变量 EMBY_PROXY_ENGINE=asgi 选择（需要安装 uvicorn），默认仍为 Flask。
+"""
+
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from services.emby_proxy import (UpstreamRequest, StreamingRequestBody, EXCLUDED_RESPONSE_HEADERS,
+                                 body_needs_buffering)
+from services.block_cache import get_block_cache, parse_proxy_download_query
+from services.bandwidth import get_bandwidth_scheduler
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CHUNK_SIZE = 64 * 1024
+
+# /proxy/download 使用的请求头（与 Flask 版本一致）
+DOWNLOAD_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                       '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+
+
+class EmbyAsgiApp:
+    """Emby 反向代理 ASGI 应用"""
+
+    def __init__(self, flask_app, proxy_service, max_connections=None, max_keepalive=None, control_workers=None):
+        """
+        :param flask_app: emby_app（控制面在其请求上下文中执行，CORS 等响应处理保持一致）
+        :param proxy_service: EmbyProxyService
+        :param max_connections: 每个 httpx 连接池的最大连接数（默认 EMBY_ASGI_MAX_CONNECTIONS 或 100）
+        :param max_keepalive: 保持的空闲连接数（默认 EMBY_ASGI_MAX_KEEPALIVE 或 20）
+        :param control_workers: 控制面线程数（默认 EMBY_ASGI_CONTROL_WORKERS 或 32）
+        """
+        self.flask_app = flask_app
+        self.proxy_service = proxy_service
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.environ.get('EMBY_ASGI_MAX_CONNECTIONS', 100)),
+            max_keepalive_connections=max_keepalive or int(os.environ.get('EMBY_ASGI_MAX_KEEPALIVE', 20))
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=control_workers or int(os.environ.get('EMBY_ASGI_CONTROL_WORKERS', 32)),
+            thread_name_prefix='EmbyAsgiControl'
+        )
+        # ssl_verify → AsyncClient（创建于事件循环内）
+        self._clients = {}
+
+    def _get_client(self, verify):
+        client = self._clients.get(verify)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                verify=verify,
+                limits=self.limits,
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                follow_redirects=False
+            )
+            self._clients[verify] = client
+        return client
+
+    async def aclose(self):
+        for client in list(self._clients.values()):
+            await client.aclose()
+        self._clients.clear()
+
+    # ==================== ASGI 入口 ====================
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        try:
+            if scope['path'] == '/proxy/download' and scope['method'] == 'GET':
+                await self._proxy_download(scope, send)
+                return
+
+            # 只有需要改写 / 读取的请求体才读入内存，其余在转发时流式透传
+            body = await self._read_body(receive) if body_needs_buffering(scope['path']) else None
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, self._prepare, scope, body)
+            if isinstance(result[0], UpstreamRequest):
+                upstream, cors_headers = result
+                await self._forward_upstream(upstream, cors_headers, send, receive)
+            else:
+                status, headers, content = result
+                await self._send_simple(send, status, headers, content)
+        except Exception as e:
+            logger.error(f"代理请求失败: {e}")
+            await self._send_json_error(send, 500, str(e))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                logger.info(f"⚡ Emby ASGI 数据面已启动 (HTTP/2: {'是' if HTTP2_AVAILABLE else '否'})")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.aclose()
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _iter_body(receive):
+        """逐块读取客户端请求体"""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            if chunk:
+                yield chunk
+            if not message.get('more_body'):
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    # ==================== 控制面（线程池） ====================
+
+    def _prepare(self, scope, body):
+        """
+        在 Flask 请求上下文中执行控制面
+
+        :param body: 已读取的请求体；None 表示请求体留在 receive 中，转发时流式读取
+        :return: (status, headers, body) 完整响应；或 (UpstreamRequest, CORS 响应头) 需要转发
+        """
+        headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']]
+        host = next((v for k, v in headers if k.lower() == 'host'), 'localhost')
+        if body is None:
+            # 请求体未读取：请求上下文中保留原始 Content-Length（控制面不读取请求体）
+            content_length = next((v for k, v in headers if k.lower() == 'content-length'), '')
+            body_args = {'environ_overrides': {'CONTENT_LENGTH': content_length}}
+        else:
+            body_args = {'data': body}
+        raw_path = scope.get('raw_path')
+        path = raw_path.decode('latin-1') if raw_path else scope['path']
+        client = scope.get('client') or ('127.0.0.1', 0)
+
+        with self.flask_app.test_request_context(
+            path=path,
+            base_url=f"{scope.get('scheme', 'http')}://{host}",
+            method=scope['method'],
+            query_string=scope.get('query_string', b'').decode('latin-1'),
+            headers=headers,
+            environ_base={'REMOTE_ADDR': client[0]},
+            **body_args
+        ):
+            result = self.proxy_service.prepare_proxy_request(scope['path'].lstrip('/'))
+
+            if isinstance(result, UpstreamRequest):
+                # 只取 CORS 等 after_request 添加的头（上游已有的头优先）
+                extra = self.flask_app.process_response(self.flask_app.response_class())
+                cors_headers = [(k, v) for k, v in extra.headers.items() if k.lower().startswith('access-control-')]
+                return result, cors_headers
+
+            response = self.flask_app.process_response(self.flask_app.make_response(result))
+            return response.status_code, list(response.headers.items()), response.get_data()
+
+    # ==================== 数据面（异步） ====================
+
+    async def _forward_upstream(self, upstream, cors_headers, send, receive):
+        """异步转发到 Emby 并流式返回（与同步版本相同的超时和响应头处理）"""
+        try:
+            await self._forward_upstream_stream(upstream, cors_headers, send, receive)
+        finally:
+            if upstream.bandwidth is not None:
+                upstream.bandwidth.close()
+
+    async def _forward_upstream_stream(self, upstream, cors_headers, send, receive):
+        client = self._get_client(upstream.ssl_verify)
+        if isinstance(upstream.body, StreamingRequestBody):
+            content = self._iter_body(receive)
+        else:
+            content = upstream.body or None
+        request = client.build_request(upstream.method, upstream.url, headers=upstream.headers, content=content)
+        try:
+            resp = await client.send(request, stream=True)
+        except httpx.TimeoutException:
+            logger.error(f"代理请求超时: {upstream.url[:100]}")
+            await self._send_json_error(send, 504, 'Request timeout')
+            return
+        except httpx.ConnectError:
+            logger.error(f"代理请求连接失败: {upstream.url[:100]}")
+            await self._send_json_error(send, 503, 'Connection failed')
+            return
+
+        try:
+            headers = [(k, v) for k, v in resp.headers.multi_items() if k.lower() not in EXCLUDED_RESPONSE_HEADERS]
+            present = {k.lower() for k, _ in headers}
+            headers.extend((k, v) for k, v in cors_headers if k.lower() not in present)
+            chunks = resp.aiter_bytes(CHUNK_SIZE)
+            if upstream.bandwidth is not None:
+                # 媒体流按带宽调度限速
+                chunks = upstream.bandwidth.awrap(chunks)
+            await self._stream_response(send, resp.status_code, headers, chunks)
+        finally:
+            await resp.aclose()
+
+    async def _proxy_download(self, scope, send):
+        """代理下载（与 Flask 版本 /proxy/download 行为一致）"""
+        query_string = scope.get('query_string', b'').decode('utf-8')
+        download_url, file_key = parse_proxy_download_query(query_string)
+        if not download_url:
+            await self._send_json_error(send, 400, '缺少url参数')
+            return
+
+        # 登记到带宽调度器（识别用户需要查询数据库，在线程池中执行）
+        client_ip = (scope.get('client') or ('127.0.0.1', 0))[0]
+        loop = asyncio.get_running_loop()
+        bandwidth = await loop.run_in_executor(
+            self._executor, get_bandwidth_scheduler().open_download, client_ip, download_url, file_key
+        )
+        try:
+            await self._proxy_download_stream(scope, send, download_url, file_key, client_ip, bandwidth)
+        finally:
+            bandwidth.close()
+
+    async def _proxy_download_stream(self, scope, send, download_url, file_key, client_ip, bandwidth):
+        # 原样转发字节，Content-Length 与响应体一致
+        headers = {'User-Agent': DOWNLOAD_USER_AGENT, 'Accept-Encoding': 'identity'}
+        range_header = next((v.decode('latin-1') for k, v in scope['headers'] if k.lower() == b'range'), None)
+
+        # 分块缓存 / 顺序预读（磁盘读写和上游请求为同步实现，在线程池中执行）
+        loop = asyncio.get_running_loop()
+        download = await loop.run_in_executor(
+            self._executor, get_block_cache().open_download, file_key, download_url, range_header, client_ip
+        )
+        if download is not None:
+            await self._stream_response(send, download.status, download.response_headers(),
+                                        bandwidth.awrap(self._iterate_in_executor(download)))
+            return
+
+        if range_header:
+            headers['Range'] = range_header
+
+        client = self._get_client(True)
+        try:
+            # 直链 / 下载网关可能 302 到 CDN 节点（转发 Emby 的请求则需要原样返回 3xx）
+            resp = await client.send(client.build_request('GET', download_url, headers=headers), stream=True,
+                                     follow_redirects=True)
+        except Exception as e:
+            logger.error(f"❌ 代理下载异常: {e}")
+            await self._send_json_error(send, 500, '服务器错误')
+            return
+
+        try:
+            if resp.status_code not in (200, 206):
+                logger.error(f"❌ 代理下载失败: {resp.status_code}")
+                await self._send_json_error(send, 500, f'下载失败: {resp.status_code}')
+                return
+
+            response_headers = [
+                ('Content-Type', resp.headers.get('Content-Type', 'application/octet-stream')),
+                ('Accept-Ranges', 'bytes'),
+                ('Cache-Control', 'no-cache'),
+                ('Content-Length', resp.headers.get('Content-Length', ''))
+            ]
+            if resp.status_code == 206:
+                response_headers.append(('Content-Range', resp.headers.get('Content-Range', '')))
+            response_headers = [(k, v) for k, v in response_headers if v]
+            await self._stream_response(send, resp.status_code, response_headers,
+                                        bandwidth.awrap(resp.aiter_raw(CHUNK_SIZE)))
+        finally:
+            await resp.aclose()
+
+    async def _iterate_in_executor(self, iterable):
+        """在线程池中逐块迭代同步可迭代对象"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(iterable)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await loop.run_in_executor(self._executor, iterator.close)
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    # ==================== 响应 ====================
+
+    @staticmethod
+    def _encode_headers(headers):
+        return [(str(k).encode('latin-1'), str(v).encode('latin-1')) for k, v in headers]
+
+    async def _stream_response(self, send, status, headers, chunks):
+        await send({'type': 'http.response.start', 'status': status, 'headers': self._encode_headers(headers)})
+        # 响应头已发送，之后的错误（上游中断 / 客户端断开）只能结束响应
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except Exception as e:
+            logger.debug(f"流式响应中断: {e}")
+
+    async def _send_simple(self, send, status, headers, content):
+        headers = [(k, v) for k, v in headers if k.lower() != 'content-length']
+        headers.append(('Content-Length', str(len(content))))
+        await send({'type': 'http.response.start', 'status': status, 'headers': self._encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _send_json_error(self, send, status, message):
+        content = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        await self._send_simple(send, status, [('Content-Type', 'application/json')], content)
+
+
+def run_asgi_server(flask_app, proxy_service, host, port, sock=None, limit_max_requests=None,
+                    install_signal_handlers=False):
+    """
+    使用 uvicorn 运行 ASGI 数据面（可在非主线程中调用）
+
+    :param sock: 已绑定的监听 socket（多 worker 模式），默认由 uvicorn 绑定 host:port
+    :param limit_max_requests: 处理多少请求后退出（worker 回收）
+    :param install_signal_handlers: 是否处理 SIGTERM / SIGINT（只能在主线程中启用）
+    :return: False 表示 uvicorn 未安装，调用方应回退到 Flask
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        logger.warning("⚠️ 未安装 uvicorn，无法启用 ASGI 数据面，回退到 Flask")
+        return False
+
+    config = uvicorn.Config(
+        EmbyAsgiApp(flask_app, proxy_service),
+        host=host,
+        port=port,
+        lifespan='on',
+        log_level='warning',
+        access_log=False,
+        limit_max_requests=limit_max_requests
+    )
+    server = uvicorn.Server(config)
+    if not install_signal_handlers:
+        # 在独立线程中运行，不安装信号处理器
+        server.install_signal_handlers = lambda: None
+    server.run(sockets=[sock] if sock is not None else None)
+    return True
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby Items 批量查询
+
+并发的缓存未命中（不同 item）在一个很短的窗口内合并为一次
+Items?Ids=a,b,c 查询，结果分发给各个等待线程，解析出的文件路径
+在一个事务中写入 item_path_mapping。
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def select_media_path(item_data, media_source_id=None, query_item_id=None):
+    """
+    从 Item 数据中选择文件路径
+
+    优先 MediaSources（多版本时选择与 mediaSourceId 对应的源），其次 Item.Path
+    """
+    media_sources = item_data.get('MediaSources') or []
+    if media_sources:
+        media_source = media_sources[0]
+
+        # 如果有指定的 mediaSourceId，找到对应的源
+        if media_source_id and len(media_sources) > 1:
+            for ms in media_sources:
+                if ms.get('Id') == media_source_id or str(ms.get('Id')) == str(query_item_id):
+                    media_source = ms
+                    break
+
+        if media_source.get('Path'):
+            return media_source['Path']
+
+    return item_data.get('Path') or None
+
+
+class _PendingBatch:
+    """收集中的一批 item 查询"""
+
+    __slots__ = ('ids', 'results', 'error', 'full', 'done')
+
+    def __init__(self):
+        self.ids = {}               # 有序去重的 item_id
+        self.results = {}           # item_id → Item 数据
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class EmbyItemsBatchResolver:
+    """Emby Items 批量查询器（第一个请求的线程负责发起查询）"""
+
+    # 等待批量查询结果的最长时间（秒），与 Items 查询超时一致
+    WAIT_TIMEOUT = 45
+
+    def __init__(self, session_getter, item_path_db=None):
+        """
+        :param session_getter: 返回 requests.Session 的函数
+        :param item_path_db: ItemPathDatabase，查询到的路径批量写入
+        """
+        self._session_getter = session_getter
+        self._item_path_db = item_path_db
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.items_requested = 0
+
+    def resolve(self, item_id, plan):
+        """
+        查询单个 item（与同一窗口内的其他 item 合并查询）
+
+        :return: Item 数据；Emby 没有返回该 item 时为 None
+        :raises: 查询失败时抛出异常（同批次的所有等待者都会收到）
+        """
+        item_id = str(item_id)
+        window = max(0, plan.items_batch_window_ms) / 1000.0
+        batch_size = max(1, plan.items_batch_size)
+
+        if window <= 0 or batch_size <= 1:
+            return self._fetch([item_id], plan).get(item_id)
+
+        # 不同 Emby 服务器 / API Key 的请求不能合并
+        batch_key = (plan.emby_server, plan.api_key)
+        with self._lock:
+            batch = self._pending.get(batch_key)
+            leader = batch is None
+            if leader:
+                batch = _PendingBatch()
+                self._pending[batch_key] = batch
+            batch.ids[item_id] = None
+            if len(batch.ids) >= batch_size:
+                # 批次已满：关闭批次，立即唤醒 leader
+                self._pending.pop(batch_key, None)
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(window)
+            with self._lock:
+                if self._pending.get(batch_key) is batch:
+                    del self._pending[batch_key]
+            try:
+                batch.results = self._fetch(list(batch.ids), plan)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        elif not batch.done.wait(self.WAIT_TIMEOUT):
+            raise TimeoutError(f"等待 Emby Items 批量查询超时: {item_id}")
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(item_id)
+
+    def _fetch(self, item_ids, plan):
+        """执行一次 Items?Ids=... 查询，并批量记录文件路径"""
+        emby_server = plan.emby_server
+        # 判断服务器地址是否以 /emby 结尾
+        if emby_server.endswith('/emby'):
+            item_url = f"{emby_server}/Items"
+        else:
+            item_url = f"{emby_server}/emby/Items"
+
+        params = {
+            'Ids': ','.join(item_ids),
+            'Fields': 'Path,MediaSources',
+            'Limit': len(item_ids),
+            'api_key': plan.api_key
+        }
+
+        logger.debug(f"查询 Emby 项目: {item_url}?Ids={params['Ids']}")
+        with self._lock:
+            self.batches += 1
+            self.items_requested += len(item_ids)
+
+        session = self._session_getter()
+        resp = session.get(item_url, params=params, timeout=(10, 30), verify=plan.ssl_verify)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Emby API 请求失败: {resp.status_code}")
+
+        items = (resp.json() or {}).get('Items') or []
+        by_id = {str(item.get('Id')): item for item in items}
+
+        results = {}
+        for item_id in item_ids:
+            item = by_id.get(item_id)
+            if item is None:
+                # 请求的可能是媒体源ID（多版本），在返回的 MediaSources 中查找
+                item = next((i for i in items
+                             if any(str(ms.get('Id')) == item_id for ms in i.get('MediaSources') or ())), None)
+            if item is None and len(item_ids) == 1 and items:
+                item = items[0]
+            if item is not None:
+                results[item_id] = item
+
+        if len(item_ids) > 1:
+            logger.info(f"📦 Emby Items 批量查询: {len(item_ids)} 个, 返回 {len(results)} 个")
+
+        self._record_paths(results)
+        return results
+
+    def _record_paths(self, results):
+        """查询到的本地文件路径一次性写入永久路径数据库"""
+        if self._item_path_db is None or not results:
+            return
+        paths = {}
+        for item_id, item in results.items():
+            file_path = select_media_path(item, item_id, item_id)
+            if file_path and not file_path.startswith(('http://', 'https://')):
+                paths[item_id] = file_path
+        if paths:
+            self._item_path_db.set_many(paths)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'items_requested': self.items_requested,
+                'avg_batch_size': round(self.items_requested / self.batches, 2) if self.batches else 0
+            }
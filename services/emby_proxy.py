@@ -3,42 +3,184 @@
 
 import json
 import os
+import re
+import time
 import logging
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
-from flask import request, jsonify, Response, redirect
+from flask import request, jsonify, Response, redirect, has_request_context
 from models.config import ConfigManager
 from services.strm_parser import StrmParserService
 from services.alist_api import AlistApiService
+from services.emby_items_resolver import EmbyItemsBatchResolver, select_media_path
+from services.domain_health import get_domain_health_monitor, domain_base_url
+from services.link_validator import get_link_validator
+from services.speculative_resolver import SpeculativeResolver
+from services.bandwidth import get_bandwidth_scheduler, is_media_path
+from utils.routing_plan import get_routing_plan
+from utils.url_auth import URLAuthManager
+from utils.bounded_cache import BoundedCache
+from utils.singleflight import SingleFlight
+from utils.shared_state import get_shared_state, GEN_ITEM_PATHS
+from utils.relay import UpstreamRelay
 
 # 禁用 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# 冷路径 item 解析的请求合并（所有服务实例共享）
+_item_flight = SingleFlight('emby_item_resolve', share_window=2.0)
+
+# 视频路径中的 item_id（如 videos/50/stream.mkv 中的 50）
+_ITEM_ID_RE = re.compile(r'^(\d+)')
+
+
+class RedirectContext:
+    """
+    单次重定向请求的解析结果
+
+    item_id / MediaSourceId / 数据库路径 / 映射结果只解析一次，
+    在预检查和直链获取之间传递，避免重复解析路径和重复查询数据库
+    """
+
+    __slots__ = ('path', 'item_id', 'media_source_id', 'db_path', 'match')
+
+    def __init__(self, path, item_id, media_source_id=None, db_path=None, match=None):
+        self.path = path
+        self.item_id = item_id
+        self.media_source_id = media_source_id
+        self.db_path = db_path      # 永久数据库中的 Emby 文件路径（未命中为 None）
+        self.match = match          # db_path 的映射结果（本地资源为 None）
+
+    @property
+    def mapped_path(self):
+        return self.match.mapped_path if self.match else None
+
+
+# ASGI 数据面转发 Emby 响应时不透传的响应头（httpx 已解码响应体、由服务器重新分块）
+EXCLUDED_RESPONSE_HEADERS = frozenset({'content-encoding', 'content-length', 'transfer-encoding', 'connection'})
+
+
+# 需要读取请求体的请求（PlaybackInfo 改写、播放上报的客户端跟踪和预解析），其余请求体流式透传
+BUFFERED_BODY_PATHS = ('/playbackinfo', '/sessions/playing')
+
+
+def body_needs_buffering(path):
+    """该路径的请求体是否需要完整读入内存"""
+    path_lower = path.lower()
+    return any(keyword in path_lower for keyword in BUFFERED_BODY_PATHS)
+
+
+class StreamingRequestBody:
+    """
+    流式透传的客户端请求体（上传、大请求体不在内存中缓冲）
+
+    有 Content-Length 时 requests 据 __len__ 原样发送 Content-Length；
+    分块传输（长度未知）时按块迭代，上游同样使用 chunked
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, stream, content_length=None):
+        self.stream = stream
+        self.content_length = content_length
+
+    def __len__(self):
+        return self.content_length or 0
+
+    def read(self, size=-1):
+        return self.stream.read(self.CHUNK_SIZE if size is None or size < 0 else size)
+
+    def __iter__(self):
+        while True:
+            chunk = self.stream.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class UpstreamRequest:
+    """
+    需要转发到 Emby 的请求（同步 / 异步数据面共用）
+
+    body 为 bytes（已读取的请求体）或 StreamingRequestBody（转发时流式读取）；
+    媒体流带有带宽调度的流 bandwidth（数据面负责关闭）
+    """
+
+    __slots__ = ('method', 'url', 'headers', 'body', 'cookies', 'ssl_verify', 'bandwidth')
+
+    def __init__(self, method, url, headers, body, cookies, ssl_verify, bandwidth=None):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.cookies = cookies
+        self.ssl_verify = ssl_verify
+        self.bandwidth = bandwidth
+
+
 class EmbyProxyService:
     """Emby 反向代理服务"""
 
+    # 重定向负缓存的有效期（秒）：临时错误短，确定性结果长
+    NEGATIVE_TTLS = {
+        'emby_error': 10,         # Emby 查询异常 / 超时
+        'link_failed': 30,        # 网盘直链获取失败
+        'no_item': 60,            # Emby 没有返回该条目
+        'no_path': 300,           # 条目没有文件路径
+        'no_media_source': 300,   # 请求没有 MediaSourceId，无法查询
+        'local': 600,             # 本地资源（LOCAL_PROXY），不匹配任何映射规则
+    }
+
     def __init__(self, client_manager):
         self.client_manager = client_manager
         self.config_manager = ConfigManager()
         self.strm_parser_service = StrmParserService()
         self.alist_api_service = AlistApiService()
         self.emby_session = None
+        self.emby_stream_session = None
         
         # itemId 热路径缓存：减少重复 Items 查询
-        self.item_path_cache = {}
         self.item_path_cache_ttl = 60  # 秒
+        self.item_path_cache = BoundedCache('emby_item_path', max_size=5000, ttl=self.item_path_cache_ttl)
+
+        # 用户名缓存（5分钟有效）
+        self._user_cache = BoundedCache('emby_user_name', max_size=1000, ttl=300)
+
+        # 重定向负缓存：解析失败的 item 在短时间内直接走代理，不再重复慢路径
+        # (配置版本, item_id, MediaSourceId) → 失败原因
+        self.redirect_negative_cache = BoundedCache('emby_redirect_negative', max_size=5000)
+        self.negative_hits_by_reason = {}
+
+        # 请求日志限频：request_key → 上次输出时间
+        self._last_log_time = BoundedCache('emby_log_throttle', max_size=2000)
         
-        # 🚀 永久路径数据库：完全跳过Emby API查询
-        from utils.item_path_db import ItemPathDatabase
-        self.item_path_db = ItemPathDatabase()
+        # 🚀 永久路径数据库：完全跳过Emby API查询（全局共享 LRU）
+        from utils.item_path_db import get_item_path_db
+        self.item_path_db = get_item_path_db()
         
         # 🚀 SQLite 数据库管理器：高性能数据存储
         from database.database import get_db_manager
         self.db = get_db_manager()
+
+        # 📦 Emby Items 批量查询（并发未命中合并为一次请求）
+        self.items_resolver = EmbyItemsBatchResolver(self.get_emby_session, self.item_path_db)
+
+        # 🔄 Item 路径变更 / 删除时清理派生缓存
+        self.item_path_db.add_change_listener(self._on_item_paths_changed)
+        get_shared_state().subscribe(GEN_ITEM_PATHS, self._on_remote_item_paths_changed)
+
+        # 🩺 自定义域名健康监测（后台探测 + 熔断，直链构建时选择最健康的域名）
+        self.domain_monitor = get_domain_health_monitor()
+
+        # 🔍 直链被动验证（后台验证 + 重复请求信号）
+        self.link_validator = get_link_validator()
+
+        # 🔮 预解析：根据详情页 / PlaybackInfo / 播放停止提前解析后续播放
+        self.speculative_resolver = SpeculativeResolver(self)
         
         # 兼容性：从旧的JSON文件迁移数据
         self.history_file = os.path.join(os.path.dirname(__file__), '..', 'config', 'user_history.json')
@@ -73,10 +215,55 @@ class EmbyProxyService:
 
         return self.emby_session
 
+    def get_emby_stream_session(self):
+        """获取流式请求体专用会话（请求体只能读取一次，不能重试）"""
+        if self.emby_stream_session is None:
+            self.emby_stream_session = requests.Session()
+            adapter = HTTPAdapter(max_retries=0, pool_connections=20, pool_maxsize=20, pool_block=False)
+            self.emby_stream_session.mount("http://", adapter)
+            self.emby_stream_session.mount("https://", adapter)
+        return self.emby_stream_session
+
+    def get_routing_plan(self):
+        """获取当前配置版本对应的路由计划"""
+        return get_routing_plan(self.config_manager.get_config_snapshot())
+
+    def _on_item_paths_changed(self, changes):
+        """
+        Item 路径变更 / 删除：清理由旧路径派生的 Item 直链缓存和网盘直链缓存
+
+        :param changes: {item_id: (old_path, new_path)}
+        """
+        from services.pan123_service import Pan123Service
+
+        plan = self.get_routing_plan()
+        old_paths = set()
+        stale_links = []
+        for item_id, (old_path, _) in changes.items():
+            self.item_path_cache.pop(item_id)
+            if not old_path:
+                continue
+            old_paths.add(old_path)
+            match = plan.match_path(old_path)
+            if match is not None:
+                stale_links.append(Pan123Service.direct_link_cache_key(match.mapped_path, match.download_mode))
+
+        # 以其他 item_id（如 URL 中的ID）缓存、但指向旧文件的直链
+        purged = self.item_path_cache.discard_if(lambda _, v: v.get('emby_file_path') in old_paths)
+        # 路径有变化的条目重新解析
+        self.redirect_negative_cache.discard_if(lambda k, _: k[1] in changes)
+        self.db.delete_direct_links(stale_links)
+        logger.info(f"🧹 路径变更清理缓存: {len(changes)} 个item, {purged} 条额外直链缓存")
+
+    def _on_remote_item_paths_changed(self):
+        """其他 worker 进程修改了 Item 路径：不知道具体条目，清空本进程的 Item 缓存和负缓存"""
+        self.item_path_cache.clear()
+        self.redirect_negative_cache.clear()
+
     def handle_playback_info(self, path, target_url):
         """处理 PlaybackInfo 请求，解析 .strm 文件并改写 MediaSource"""
         try:
-            config = self.config_manager.load_config()
+            config = self.config_manager.get_config_snapshot().config
 
             logger.debug(f"🎵 拦截 PlaybackInfo 请求: {target_url}")
 
@@ -352,277 +539,286 @@ class EmbyProxyService:
         except Exception as e:
             logger.error(f"填充 MediaStreams 异常: {e}")
 
-    def handle_emby_video_redirect(self, path):
-        """处理 Emby 视频请求的 302 重定向"""
-        try:
-            config = self.config_manager.load_config()
-
-            # 从 URL 中提取 item id
-            # 典型路径:
-            # - videos/{itemId}/stream.mkv
-            # - videos/{itemId}/original.strm
-            # - Items/{itemId}/Download
-            parts = [p for p in path.split('/') if p]  # 过滤空字符串
-
-            item_id = None
-            for i, part in enumerate(parts):
-                if part.lower() in ['videos', 'items'] and i + 1 < len(parts):
-                    # 下一个部分应该是数字 ID 或 stream.xxx
-                    potential_id = parts[i + 1]
-
-                    # 如果是 stream.mkv 这种格式，直接提取数字
-                    if potential_id.isdigit():
-                        item_id = potential_id
-                        break
+    def handle_emby_video_redirect(self, path, plan=None, ctx=None):
+        """
+        处理 Emby 视频请求的 302 重定向
 
-                    # 如果包含 stream. 或 original.，可能是文件名，尝试从之前获取
-                    # 例如：videos/50/stream.mkv
-                    import re
-                    match = re.match(r'^(\d+)', potential_id)
-                    if match:
-                        item_id = match.group(1)
-                        break
+        :param ctx: 预检查阶段得到的 RedirectContext（为空时在此解析）
+        """
+        try:
+            if plan is None:
+                plan = self.get_routing_plan()
+            config = plan.config
 
-            # 如果还没找到，尝试从 MediaSourceId 参数获取
-            if not item_id:
-                media_source_id = request.args.get('MediaSourceId') or request.args.get('mediaSourceId')
-                if media_source_id:
-                    if media_source_id.startswith('mediasource_'):
-                        item_id = media_source_id.replace('mediasource_', '')
-                    elif media_source_id.isdigit():
-                        item_id = media_source_id
-
-            if not item_id:
+            if ctx is None:
+                ctx = self._resolve_redirect_context(path, plan)
+            if ctx is None:
                 logger.warning(f"无法从路径提取 item_id: {path}")
                 return None
 
+            item_id = ctx.item_id
             logger.debug(f"提取到媒体项 ID: {item_id}")
 
-            # 🚀 超级极速模式：检查永久路径数据库（完全跳过Emby API查询）
-            if self.item_path_db.has(item_id):
-                db_path = self.item_path_db.get(item_id)
+            cached = self.item_path_cache.get(item_id)
+
+            # 🔁 重复请求信号：同一客户端几秒内再次请求同一条目，上一个直链可能无法播放
+            # （播放器的 HEAD 探测和 Range 请求属于正常播放，不计入）
+            if not has_request_context() or (request.method != 'HEAD' and not request.headers.get('Range')):
+                self.link_validator.note_request(
+                    self._request_client_key(), item_id,
+                    ctx.mapped_path or (cached or {}).get('mapped_path'),
+                    (cached or {}).get('direct_url')
+                )
+
+            # 🚀 超级极速模式：永久路径数据库命中（完全跳过Emby API查询）
+            if ctx.db_path:
+                db_path = ctx.db_path
                 logger.info(f"⚡ 数据库命中: {item_id} → {os.path.basename(db_path)}")
                 
-                # 应用路径映射
-                mapped_path = self.apply_path_mapping(db_path, config)
-                if mapped_path == 'LOCAL_PROXY':
+                match = ctx.match
+                if match is None:
                     logger.info(f"📁 本地资源(数据库)，走代理播放: {os.path.basename(db_path)}")
                     return None  # 本地资源走代理
-                elif mapped_path:
+                else:
                     # 快速构建直链
-                    direct_url = self._fast_build_direct_url(mapped_path, config)
+                    mapped_path = match.mapped_path
+                    direct_url = self._fast_build_direct_url(
+                        mapped_path, plan, match.mount_path, match.download_mode
+                    )
                     if direct_url:
                         logger.info(f"✅ 302重定向(数据库): {os.path.basename(mapped_path)}")
                         return direct_url
             
             # 优先命中缓存，避免重复查询 Items 和网盘API
             cache_hit = False
-            if item_id in self.item_path_cache:
-                cached = self.item_path_cache[item_id]
-                if cached and cached.get('expire', 0) > __import__('time').time():
-                    cache_hit = True
-                    # 直接从缓存返回最终直链，无需重新查询
-                    direct_url = cached.get('direct_url')
-                    file_name = cached.get('file_name')
-                    if direct_url and file_name:
-                        logger.info(f"✅ 302重定向(缓存): {file_name}")
+            if cached and not self.link_validator.is_bad(cached.get('mapped_path')):
+                cache_hit = True
+                # 直接从缓存返回最终直链，无需重新查询
+                direct_url = cached.get('direct_url')
+                file_name = cached.get('file_name')
+                if direct_url and file_name:
+                    # 预解析写入的直链没有验证过，第一次播放时提交（最近验证过的路径自动跳过）
+                    self.link_validator.submit(cached.get('mapped_path'), direct_url)
+                    logger.info(f"✅ 302重定向(缓存): {file_name}")
+                    return direct_url
+                
+                # 兼容旧缓存格式（没有direct_url字段）
+                emby_file_path = cached.get('emby_file_path')
+                mapped_path = cached.get('mapped_path')
+                if emby_file_path and mapped_path and file_name:
+                    logger.debug(f"🗄️ Item缓存命中(旧格式): {item_id}")
+                    # 若是网络直链直接返回
+                    if emby_file_path.startswith(('http://', 'https://')):
+                        logger.debug(f"检测到网络直链，直接返回: {emby_file_path[:100]}...")
+                        return emby_file_path
+                    # 快速获取直链（域名+路径，无API查询）
+                    direct_url = self._fast_build_direct_url(
+                        mapped_path, plan, cached.get('mount_path'), cached.get('download_mode')
+                    )
+                    if direct_url:
+                        # 更新缓存为新格式
+                        cached['direct_url'] = direct_url
+                        logger.info(f"✅ 302重定向(快速): {file_name}")
                         return direct_url
-                    
-                    # 兼容旧缓存格式（没有direct_url字段）
-                    emby_file_path = cached.get('emby_file_path')
-                    mapped_path = cached.get('mapped_path')
-                    if emby_file_path and mapped_path and file_name:
-                        logger.debug(f"🗄️ Item缓存命中(旧格式): {item_id}")
-                        # 若是网络直链直接返回
-                        if emby_file_path.startswith(('http://', 'https://')):
-                            logger.debug(f"检测到网络直链，直接返回: {emby_file_path[:100]}...")
-                            return emby_file_path
-                        # 快速获取直链（域名+路径，无API查询）
-                        direct_url = self._fast_build_direct_url(mapped_path, config)
-                        if direct_url:
-                            # 更新缓存为新格式
-                            cached['direct_url'] = direct_url
-                            logger.info(f"✅ 302重定向(快速): {file_name}")
-                            return direct_url
             
             # 没有缓存命中，需要查询 Emby API（这是最慢的路径）
-            # 直接查询 Emby API 获取文件路径（绕过读取 .strm 文件，因为总是失败）
-            emby_server = config['emby']['server'].rstrip('/')
-            api_key = config['emby']['api_key']
-
-            if not api_key:
-                logger.error("Emby API Key 未配置")
-                return None
+            # 🔀 同一 item 的并发冷请求合并为一次 Emby/网盘 查询
+            flight_key = f"{plan.version}:{item_id}:{ctx.media_source_id or ''}"
+            return _item_flight.do(flight_key, self._resolve_cold_redirect, ctx, plan)
 
-            # 处理 MediaSourceId（可能包含 "mediasource_" 前缀）
-            media_source_id = request.args.get('MediaSourceId') or request.args.get('mediaSourceId')
-            query_item_id = item_id
-
-            if media_source_id:
-                logger.info(f"检测到 MediaSourceId: {media_source_id}")
-                # 如果是 "mediasource_xxx" 格式，提取实际 ID
-                if media_source_id.startswith("mediasource_"):
-                    query_item_id = media_source_id.replace("mediasource_", "")
-                    logger.info(f"从 MediaSourceId 提取 ID: {query_item_id}")
-
-                # 使用 Items 查询接口（emby2Alist 的方法）
-                # 正确格式：Items?Ids=xxx&Fields=Path,MediaSources&Limit=1&api_key=xxx
-                # 判断服务器地址是否以 /emby 结尾
-                if emby_server.endswith('/emby'):
-                    item_url = f"{emby_server}/Items"
-                else:
-                    item_url = f"{emby_server}/emby/Items"
+        except Exception as e:
+            logger.error(f"❌ 处理302重定向异常: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return None
 
-                params = {
-                    'Ids': query_item_id,
-                    'Fields': 'Path,MediaSources',
-                    'Limit': 1,
-                    'api_key': api_key
-                }
+    def _resolve_cold_redirect(self, ctx, plan):
+        """
+        缓存未命中时的慢路径：查询 Emby Items 获取文件路径 → 路径映射 → 获取直链
 
-                logger.debug(f"查询 Emby 项目: {item_url}?Ids={query_item_id}")
+        同一 item 的并发请求通过 SingleFlight 合并，只执行一次
+        """
+        config = plan.config
+        item_id = ctx.item_id
 
-                # 使用会话
-                session = self.get_emby_session()
-                ssl_verify = config['emby'].get('ssl_verify', False)
+        # 直接查询 Emby API 获取文件路径（绕过读取 .strm 文件，因为总是失败）
+        if not plan.api_key:
+            logger.error("Emby API Key 未配置")
+            return None
 
-                resp = session.get(item_url, params=params, timeout=(10, 30), verify=ssl_verify)
+        # 处理 MediaSourceId（可能包含 "mediasource_" 前缀）
+        media_source_id = ctx.media_source_id
+        query_item_id = item_id
 
-                if resp.status_code != 200:
-                    logger.error(f"Emby API 请求失败: {resp.status_code}")
-                    return None
+        if media_source_id:
+            logger.info(f"检测到 MediaSourceId: {media_source_id}")
+            # 如果是 "mediasource_xxx" 格式，提取实际 ID
+            if media_source_id.startswith("mediasource_"):
+                query_item_id = media_source_id.replace("mediasource_", "")
+                logger.info(f"从 MediaSourceId 提取 ID: {query_item_id}")
 
-                result = resp.json()
+            # 使用 Items 查询接口（emby2Alist 的方法），并发的不同 item 合并为一次 Ids=a,b,c 查询
+            try:
+                item_data = self.items_resolver.resolve(query_item_id, plan)
+            except Exception as e:
+                logger.error(f"❌ Emby Items 查询失败: {e}")
+                self._remember_redirect_failure(ctx, plan, 'emby_error')
+                return None
 
-                if not result or not result.get('Items') or len(result['Items']) == 0:
-                    logger.error(f"Emby API 返回空结果")
-                    return None
+            if not item_data:
+                logger.error(f"Emby API 返回空结果")
+                self._remember_redirect_failure(ctx, plan, 'no_item')
+                return None
 
-                item_data = result['Items'][0]
-                logger.debug(f"✅ 成功获取 Item 数据: {item_data.get('Name', 'Unknown')}")
+            logger.debug(f"✅ 成功获取 Item 数据: {item_data.get('Name', 'Unknown')}")
 
-                # 尝试多种方式获取文件路径
-                emby_file_path = None
+            # 尝试多种方式获取文件路径（优先 MediaSources，支持多版本）
+            emby_file_path = select_media_path(item_data, media_source_id, query_item_id)
 
-                # 优先从 MediaSources 中获取（支持多版本）
-                if 'MediaSources' in item_data and item_data['MediaSources']:
-                    media_source = item_data['MediaSources'][0]
+            if not emby_file_path:
+                logger.error(f"无法获取文件路径: {item_id}")
+                logger.debug(f"Item 数据: {item_data.get('Name', 'Unknown')} - Type: {item_data.get('Type')}")
+                self._remember_redirect_failure(ctx, plan, 'no_path')
+                return None
 
-                    # 如果有指定的 mediaSourceId，找到对应的源
-                    if media_source_id and len(item_data['MediaSources']) > 1:
-                        for ms in item_data['MediaSources']:
-                            if ms.get('Id') == media_source_id or str(ms.get('Id')) == str(query_item_id):
-                                media_source = ms
-                                break
+            logger.debug(f"Emby 文件路径: {emby_file_path}")
 
-                    emby_file_path = media_source.get('Path')
-                    logger.debug(f"从 MediaSources 获取路径")
+            # 如果是网络直链，直接返回
+            if emby_file_path.startswith(('http://', 'https://')):
+                logger.debug(f"检测到网络直链，直接返回: {emby_file_path[:100]}...")
+                return emby_file_path
 
-                # 备用：从 Item 本身获取
-                if not emby_file_path and 'Path' in item_data and item_data['Path']:
-                    emby_file_path = item_data['Path']
-                    logger.debug(f"从 Item.Path 获取路径")
+            # 应用路径映射
+            match = self.resolve_path_mapping(emby_file_path, plan)
+            
+            if match is None:
+                logger.info(f"📁 本地资源，走代理播放: {os.path.basename(emby_file_path)}")
+                self._remember_redirect_failure(ctx, plan, 'local')
+                return None  # 返回None让上层继续走代理播放
+            
+            mapped_path = match.mapped_path
+            logger.debug(f"映射后的网盘路径: {mapped_path}")
+            
+            # 🚀 极速路径：优先尝试快速构建直链（域名+路径，无API查询）
+            direct_url = self._fast_build_direct_url(
+                mapped_path, plan, match.mount_path, match.download_mode
+            )
+            
+            if not direct_url:
+                # 如果快速构建失败，降级到标准方法（可能需要API查询）
+                logger.warning(f"⚠️ 快速直连构建失败，降级到API查询模式")
+                direct_url = self.get_direct_url_from_pan(mapped_path, config, match)
+            
+            if direct_url:
+                # 只有当获取直链成功时才写入Item路径缓存
+                # 这样可以避免重复查询Emby API和网盘API
+                try:
+                    self.cache_item_link(item_id, emby_file_path, match, direct_url)
+                    
+                    # 🚀 保存到永久数据库，下次完全跳过Emby API查询
+                    # （批量查询已按查询ID记录，这里只补充URL中的 item_id）
+                    if item_id != query_item_id:
+                        self.item_path_db.set(item_id, emby_file_path)
+                except Exception:
+                    pass
+                
+                logger.info(f"✅ 302重定向成功: {os.path.basename(mapped_path)}")
+                return direct_url
+            else:
+                logger.error(f"❌ 无法获取直链: {mapped_path}")
+                # 失败时不缓存直链，只短时间记入负缓存，过期后重试
+                self._remember_redirect_failure(ctx, plan, 'link_failed')
+                return None
 
-                if not emby_file_path:
-                    logger.error(f"无法获取文件路径: {item_id}")
-                    logger.debug(f"Item 数据: {item_data.get('Name', 'Unknown')} - Type: {item_data.get('Type')}")
-                    return None
+        # 没有 MediaSourceId 时无法查询（数据库命中但直链构建失败时按直链失败处理）
+        self._remember_redirect_failure(ctx, plan, 'link_failed' if ctx.db_path else 'no_media_source')
+        return None
+
+    def cache_item_link(self, item_id, emby_file_path, match, direct_url):
+        """写入 Item 路径+直链缓存（下次请求无需重新查询）"""
+        file_name = os.path.basename(match.mapped_path)
+        self.item_path_cache.set(item_id, {
+            'emby_file_path': emby_file_path,
+            'mapped_path': match.mapped_path,
+            'mount_path': match.mount_path,
+            'download_mode': match.download_mode,
+            'file_name': file_name,
+            'direct_url': direct_url  # 缓存最终直链
+        })
+        logger.debug(f"📦 Item路径+直链已缓存: {file_name}")
+
+    @staticmethod
+    def _negative_key(ctx, plan):
+        return (plan.version, ctx.item_id, ctx.media_source_id or '')
+
+    def _remember_redirect_failure(self, ctx, plan, reason):
+        """记录重定向失败（负缓存，按原因设置有效期）"""
+        self.redirect_negative_cache.set(self._negative_key(ctx, plan), reason, ttl=self.NEGATIVE_TTLS[reason])
+
+    def _check_negative_cache(self, ctx, plan):
+        """
+        查询重定向负缓存
 
-                logger.debug(f"Emby 文件路径: {emby_file_path}")
+        :return: 失败原因；未命中返回 None
+        """
+        if ctx is None:
+            return None
+        reason = self.redirect_negative_cache.get(self._negative_key(ctx, plan))
+        if reason is not None:
+            self.negative_hits_by_reason[reason] = self.negative_hits_by_reason.get(reason, 0) + 1
+        return reason
+
+    def negative_cache_stats(self):
+        stats = self.redirect_negative_cache.stats()
+        stats['hits_by_reason'] = dict(self.negative_hits_by_reason)
+        stats['ttls'] = dict(self.NEGATIVE_TTLS)
+        return stats
+
+    def _resolve_redirect_context(self, path, plan):
+        """
+        解析重定向上下文：item_id、MediaSourceId、数据库路径和映射结果只计算一次
 
-                # 如果是网络直链，直接返回
-                if emby_file_path.startswith(('http://', 'https://')):
-                    logger.debug(f"检测到网络直链，直接返回: {emby_file_path[:100]}...")
-                    return emby_file_path
+        :return: RedirectContext；无法提取 item_id 时返回 None
+        """
+        media_source_id = request.args.get('MediaSourceId') or request.args.get('mediaSourceId')
+        item_id = self._extract_item_id_from_path(path, media_source_id)
+        if not item_id:
+            return None
 
-                # 应用路径映射
-                mapped_path = self.apply_path_mapping(emby_file_path, config)
-                
-                if mapped_path == 'LOCAL_PROXY':
-                    logger.info(f"📁 本地资源，走代理播放: {os.path.basename(emby_file_path)}")
-                    return None  # 返回None让上层继续走代理播放
-                elif not mapped_path:
-                    logger.warning(f"路径映射失败")
-                    return None
-                
-                logger.debug(f"映射后的网盘路径: {mapped_path}")
-                
-                # 🚀 极速路径：优先尝试快速构建直链（域名+路径，无API查询）
-                direct_url = self._fast_build_direct_url(mapped_path, config)
-                
-                if not direct_url:
-                    # 如果快速构建失败，降级到标准方法（可能需要API查询）
-                    logger.warning(f"⚠️ 快速直连构建失败，降级到API查询模式")
-                    direct_url = self.get_direct_url_from_pan(mapped_path, config)
-                
-                if direct_url:
-                    # 只有当获取直链成功时才写入Item路径缓存
-                    # 这样可以避免重复查询Emby API和网盘API
-                    try:
-                        file_name = os.path.basename(mapped_path)
-                        self.item_path_cache[item_id] = {
-                            'emby_file_path': emby_file_path,
-                            'mapped_path': mapped_path,
-                            'file_name': file_name,
-                            'direct_url': direct_url,  # 缓存最终直链
-                            'expire': __import__('time').time() + self.item_path_cache_ttl
-                        }
-                        logger.debug(f"📦 Item路径+直链已缓存: {file_name}")
-                        
-                        # 🚀 保存到永久数据库，下次完全跳过Emby API查询
-                        self.item_path_db.set(item_id, emby_file_path)
-                    except Exception:
-                        pass
-                    
-                    logger.info(f"✅ 302重定向成功: {os.path.basename(mapped_path)}")
-                    return direct_url
-                else:
-                    logger.error(f"❌ 无法获取直链: {mapped_path}")
-                    # 失败时不缓存，下次可以重试
-                    return None
+        ctx = RedirectContext(path, item_id, media_source_id)
 
-        except Exception as e:
-            logger.error(f"❌ 处理302重定向异常: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return None
+        # 🚀 永久路径数据库（LRU 读穿，热点 item 不访问 SQLite）
+        db_path = self.item_path_db.get(item_id)
+        if db_path:
+            ctx.db_path = db_path
+            ctx.match = self.resolve_path_mapping(db_path, plan)
+        return ctx
 
-    def _should_attempt_redirect(self, path, config):
+    def _should_attempt_redirect(self, ctx, plan):
         """
         快速判断是否应该尝试获取直链进行重定向
         避免对本地资源进行不必要的API查询
+
+        :param ctx: RedirectContext（None 表示无法提取 item_id）
         """
         try:
-            logger.info(f"🔍 预检查开始 - path: {path}")
-            
             # 检查路径映射是否启用
-            if not config['emby']['path_mapping']['enable']:
+            if not plan.path_mapping_enable:
                 logger.info(f"📍 路径映射未启用，所有资源走代理")
                 return False
             
-            # 从URL中快速提取item_id
-            item_id = self._extract_item_id_from_path(path)
-            logger.info(f"📍 提取item_id: {item_id}")
-            if not item_id:
+            if ctx is None:
                 logger.info(f"📍 无法提取item_id，走代理")
                 return False
+            logger.debug(f"📍 提取item_id: {ctx.item_id}")
             
             # 🚀 超快速检查：永久路径数据库
-            if self.item_path_db.has(item_id):
-                db_path = self.item_path_db.get(item_id)
-                logger.info(f"📍 数据库命中: {os.path.basename(db_path)}")
-                logger.info(f"📍 完整路径: {db_path}")
-                
-                # 快速路径匹配检查
-                from_prefix = config['emby']['path_mapping']['from']
-                normalized_path = db_path.replace('\\', '/')
-                normalized_prefix = from_prefix.replace('\\', '/')
-                
-                logger.info(f"📍 路径前缀: {from_prefix}")
-                logger.info(f"📍 标准化路径: {normalized_path}")
-                logger.info(f"📍 标准化前缀: {normalized_prefix}")
+            if ctx.db_path:
+                logger.info(f"📍 数据库命中: {os.path.basename(ctx.db_path)}")
+                logger.debug(f"📍 完整路径: {ctx.db_path}")
+                logger.debug(f"📍 映射规则: {plan.path_mapping.describe()}")
                 
-                if normalized_path.startswith(normalized_prefix):
+                if ctx.match is not None:
                     logger.info(f"📍 匹配网盘前缀，需要重定向")
                     return True
                 else:
@@ -638,8 +834,8 @@ class EmbyProxyService:
             logger.error(f"❌ 判断重定向异常: {e}")
             return False  # 异常时走代理，更安全
     
-    def _extract_item_id_from_path(self, path):
-        """从路径中快速提取item_id"""
+    def _extract_item_id_from_path(self, path, media_source_id=None):
+        """从路径中快速提取item_id（路径中没有时使用 MediaSourceId）"""
         try:
             # 从 URL 中提取 item id
             # 典型路径:
@@ -649,7 +845,7 @@ class EmbyProxyService:
             parts = [p for p in path.split('/') if p]  # 过滤空字符串
 
             for i, part in enumerate(parts):
-                if part.lower() in ['videos', 'items'] and i + 1 < len(parts):
+                if part.lower() in ('videos', 'items') and i + 1 < len(parts):
                     # 下一个部分应该是数字 ID 或 stream.xxx
                     potential_id = parts[i + 1]
 
@@ -659,13 +855,11 @@ class EmbyProxyService:
 
                     # 如果包含 stream. 或 original.，可能是文件名，尝试从之前获取
                     # 例如：videos/50/stream.mkv
-                    import re
-                    match = re.match(r'^(\d+)', potential_id)
+                    match = _ITEM_ID_RE.match(potential_id)
                     if match:
                         return match.group(1)
 
             # 如果还没找到，尝试从 MediaSourceId 参数获取
-            media_source_id = request.args.get('MediaSourceId') or request.args.get('mediaSourceId')
             if media_source_id:
                 if media_source_id.startswith('mediasource_'):
                     return media_source_id.replace('mediasource_', '')
@@ -678,59 +872,67 @@ class EmbyProxyService:
             logger.debug(f"提取item_id异常: {e}")
             return None
 
-    def apply_path_mapping(self, original_path, config):
-        """应用路径映射，将本地路径转换为网络URL"""
+    def resolve_path_mapping(self, original_path, plan):
+        """
+        匹配路径映射规则（多规则最长前缀匹配）
+
+        :return: PathMappingMatch；本地资源返回 None
+        """
         try:
-            if not config['emby']['path_mapping']['enable']:
+            if not plan.path_mapping_enable:
                 logger.info(f"路径映射未启用，所有资源走本地代理")
-                return 'LOCAL_PROXY'  # 特殊标识：本地代理播放
-
-            from_prefix = config['emby']['path_mapping']['from']
-            to_prefix = config['emby']['path_mapping']['to']
-
-            # 统一路径分隔符（支持 Windows 和 Linux）
-            emby_path_normalized = original_path.replace('\\', '/')
-            from_path_normalized = from_prefix.replace('\\', '/')
-
-            if not emby_path_normalized.startswith(from_path_normalized):
-                logger.info(f"路径不匹配网盘前缀，走本地代理: {original_path[:50]}... (前缀: {from_prefix})")
-                return 'LOCAL_PROXY'  # 特殊标识：本地代理播放
+                return None
 
-            # 替换路径前缀 - 这是网盘资源
-            mapped_path = emby_path_normalized.replace(from_path_normalized, to_prefix, 1)
-            logger.debug(f"✅ 网盘路径映射成功: {original_path[:50]}... => {mapped_path[:50]}...")
+            match = plan.match_path(original_path)
+            if match is None:
+                logger.info(f"路径不匹配任何网盘规则，走本地代理: {original_path[:50]}...")
+                return None
 
-            return mapped_path
+            # 这是网盘资源
+            logger.debug(f"✅ 网盘路径映射成功({match.rule.describe()}): {original_path[:50]}... => {match.mapped_path[:50]}...")
+            return match
 
         except Exception as e:
             logger.error(f"❌ 路径映射异常: {e}")
-            return 'LOCAL_PROXY'  # 异常时也走本地代理
+            return None  # 异常时也走本地代理
+
+    def apply_path_mapping(self, original_path, plan):
+        """应用路径映射，将本地路径转换为网盘路径；本地资源返回 'LOCAL_PROXY'"""
+        match = self.resolve_path_mapping(original_path, plan)
+        return match.mapped_path if match else 'LOCAL_PROXY'  # 特殊标识：本地代理播放
     
-    def _fast_build_direct_url(self, mapped_path, config):
+    def _fast_build_direct_url(self, mapped_path, plan, mount_path=None, download_mode=None, validate=True):
         """
         快速构建直链（域名+路径+鉴权），无API查询
         适用于直链模式，极速返回
+
+        :param mount_path: 映射规则指定的挂载前缀（默认 123.mount_path）
+        :param download_mode: 映射规则指定的下载模式（默认 123.download_mode）
+        :param validate: 是否提交后台验证（预解析时不验证，真正播放时再验证）
         """
         try:
             # 检查下载模式
-            download_mode = config.get('123', {}).get('download_mode', 'direct')
-            if download_mode != 'direct':
+            if (download_mode or plan.download_mode) != 'direct':
                 return None
             
             # 检查URL鉴权配置
-            auth_cfg = config.get('123', {}).get('url_auth', {})
-            if not auth_cfg.get('enable'):
+            if not plan.url_auth_enable or not plan.custom_domains:
                 return None
-            
-            custom_domains = auth_cfg.get('custom_domains', [])
-            if not custom_domains:
+
+            # 已知失败的直链交给标准方法（降级到代理下载）
+            if self.link_validator.is_bad(mapped_path):
                 return None
             
-            # 构建基础URL：自定义域名 + 文件路径
-            domain = custom_domains[0]  # 使用第一个自定义域名
+            # 按策略选择自定义域名（只读内存中的健康状态，不阻塞）
+            domain = self.domain_monitor.choose_domain(
+                plan.custom_domains, plan.domain_strategy, mapped_path, plan.domain_weights
+            )
+            if not domain:
+                logger.warning(f"⚠️ 自定义域名全部熔断，快速降级")
+                return None  # 返回None让上层降级到标准方法
             
             # 处理路径：去掉挂载前缀（如/123），保留实际文件路径
-            mount_path = config.get('123', {}).get('mount_path', '/123')
+            mount_path = mount_path or plan.mount_path
             if mapped_path.startswith(mount_path):
                 file_path = mapped_path[len(mount_path):]
             else:
@@ -744,25 +946,18 @@ class EmbyProxyService:
             from urllib.parse import quote
             # URL编码路径，保留斜杠
             encoded_path = quote(file_path, safe='/')
-            direct_url = f"https://{domain}{encoded_path}"
+            direct_url = f"{domain_base_url(domain)}{encoded_path}"
             
             # 添加URL鉴权
-            from utils.url_auth import URLAuthManager
-            auth_manager = URLAuthManager()
-            secret_key = auth_cfg.get('secret_key', '')
-            uid = auth_cfg.get('uid', '')
-            expire_time = auth_cfg.get('expire_time', 3600)
-            
-            if secret_key and uid:
-                authed_url = auth_manager.add_auth_to_url(direct_url, secret_key, uid, expire_time)
-                
-                # 🛡️ 智能域名健康检查（优化超时时间）
-                if self._check_domain_health(domain):
-                    logger.debug(f"⚡ 快速构建直链: {file_path[:50]}...")
-                    return authed_url
-                else:
-                    logger.warning(f"⚠️ 域名健康检查失败，快速降级")
-                    return None  # 返回None让上层降级到标准方法
+            if plan.secret_key and plan.uid:
+                authed_url = URLAuthManager.add_auth_to_url(
+                    direct_url, plan.secret_key, plan.uid, plan.expire_time, plan.auth_bucket_seconds
+                )
+                # 被动验证：立即返回，后台异步验证
+                if validate:
+                    self.link_validator.submit(mapped_path, authed_url)
+                logger.debug(f"⚡ 快速构建直链: {domain} {file_path[:50]}...")
+                return authed_url
             else:
                 logger.warning(f"⚠️ URL鉴权配置不完整")
                 return None
@@ -771,56 +966,12 @@ class EmbyProxyService:
             logger.error(f"❌ 快速构建直链失败: {e}")
             return None
     
-    def _check_domain_health(self, domain):
-        """智能域名健康检查（带缓存）"""
-        try:
-            import time
-            import requests
-            
-            # 检查域名健康状态缓存
-            cache_key = f"domain_health:{domain}"
-            health_cache = self.db.get_direct_link(cache_key)
-            
-            current_time = time.time()
-            
-            # 如果有缓存且未过期，直接使用缓存结果
-            if health_cache and health_cache['expire_time'] > current_time:
-                is_healthy = health_cache['url'] == 'healthy'
-                logger.debug(f"🎯 域名健康缓存命中: {domain} -> {'健康' if is_healthy else '不健康'}")
-                return is_healthy
-            
-            # 执行快速健康检查
-            try:
-                # 使用更短的超时时间和更简单的检查
-                test_url = f"https://{domain}/"
-                logger.debug(f"🧪 域名健康检查: {domain}")
-                
-                response = requests.head(test_url, timeout=0.5, allow_redirects=False)
-                # 任何响应（包括404）都说明域名可达
-                is_healthy = True
-                
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-                # 超时或连接失败说明域名不可达
-                is_healthy = False
-            except Exception:
-                # 其他异常也认为域名有问题
-                is_healthy = False
-            
-            # 缓存健康状态（健康缓存5分钟，不健康缓存30秒）
-            cache_duration = 300 if is_healthy else 30
-            cache_value = 'healthy' if is_healthy else 'unhealthy'
-            self.db.set_direct_link(cache_key, cache_value, cache_duration)
-            
-            logger.debug(f"📝 域名健康状态已缓存: {domain} -> {'健康' if is_healthy else '不健康'} ({cache_duration}s)")
-            
-            return is_healthy
-            
-        except Exception as e:
-            logger.warning(f"⚠️ 域名健康检查异常: {e}")
-            return False  # 异常时保守降级
-    
-    def get_direct_url_from_pan(self, alist_path, config):
-        """从网盘获取文件直链（优先使用搜索）"""
+    def get_direct_url_from_pan(self, alist_path, config, match=None):
+        """
+        从网盘获取文件直链（优先使用搜索）
+
+        :param match: 路径映射结果（携带规则指定的挂载前缀和下载模式）
+        """
         try:
             # 提取文件名
             import os
@@ -839,7 +990,11 @@ class EmbyProxyService:
                 from services.pan123_service import Pan123Service
                 pan123_service = Pan123Service(client, config)
                 
-                file_info = pan123_service.get_file_direct_link(file_name, alist_path)
+                file_info = pan123_service.get_file_direct_link(
+                    file_name, alist_path,
+                    mount_path=match.mount_path if match else None,
+                    download_mode=match.download_mode if match else None
+                )
                 
                 if file_info and file_info.get('raw_url'):
                     return file_info['raw_url']
@@ -857,6 +1012,14 @@ class EmbyProxyService:
             logger.error(traceback.format_exc())
             return None
 
+    @staticmethod
+    def _request_client_key():
+        """当前请求的客户端标识（设备ID，缺失时使用IP）"""
+        if not has_request_context():
+            return None
+        return (request.args.get('X-Emby-Device-Id') or request.headers.get('X-Emby-Device-Id')
+                or request.remote_addr)
+
     def extract_client_info(self, request):
         """从请求中提取客户端信息"""
         try:
@@ -912,77 +1075,24 @@ class EmbyProxyService:
             logger.error(f"❌ 提取客户端信息失败: {e}")
             return {}
 
-    def check_client_access(self, client_info, config):
-        """检查客户端访问权限"""
+    def check_client_access(self, client_info, plan):
+        """检查客户端访问权限（使用预编译的拦截名单）"""
         try:
-            # 获取客户端拦截配置
-            client_filter = config.get('emby', {}).get('client_filter', {})
-            
-            # 🔍 调试：记录拦截配置状态
-            logger.info(f"🛡️ 拦截检查 - enable: {client_filter.get('enable', False)}, mode: {client_filter.get('mode', 'none')}")
-            
-            if not client_filter.get('enable', False):
-                logger.debug(f"✅ 拦截未启用，允许所有客户端")
+            if not plan.filter_enable:
                 return True  # 未启用拦截，允许所有客户端
             
             client_name = client_info.get('client', '')
             device_name = client_info.get('device', '')
             ip_address = client_info.get('ip', '')
             
-            # 🔍 调试：记录被检查的客户端信息
-            logger.info(f"🔍 检查客户端 - Name: '{client_name}', Device: '{device_name}', IP: '{ip_address}'")
+            logger.debug(f"🔍 检查客户端 - Name: '{client_name}', Device: '{device_name}', IP: '{ip_address}'")
             
-            # 黑名单模式
-            if client_filter.get('mode') == 'blacklist':
-                blocked_clients = client_filter.get('blocked_clients', [])
-                blocked_devices = client_filter.get('blocked_devices', [])
-                blocked_ips = client_filter.get('blocked_ips', [])
-                
-                # 🔍 调试：记录黑名单内容
-                logger.info(f"📋 黑名单检查 - blocked_clients: {blocked_clients}, blocked_devices: {blocked_devices}, blocked_ips: {blocked_ips}")
-                
-                # 检查客户端名称
-                if client_name.lower() in [c.lower() for c in blocked_clients]:
-                    logger.warning(f"🚫 客户端被拦截: {client_name}")
-                    return False
-                
-                # 检查设备名称  
-                if device_name.lower() in [d.lower() for d in blocked_devices]:
-                    logger.warning(f"🚫 设备被拦截: {device_name}")
-                    return False
-                
-                # 检查IP地址
-                if ip_address in blocked_ips:
-                    logger.warning(f"🚫 IP被拦截: {ip_address}")
-                    return False
-                
-                logger.debug(f"✅ 客户端通过黑名单检查: {client_name}")
-                return True
-            
-            # 白名单模式
-            elif client_filter.get('mode') == 'whitelist':
-                allowed_clients = client_filter.get('allowed_clients', [])
-                allowed_devices = client_filter.get('allowed_devices', [])
-                allowed_ips = client_filter.get('allowed_ips', [])
-                
-                # 检查客户端名称
-                if allowed_clients and client_info.get('client', '').lower() not in [c.lower() for c in allowed_clients]:
-                    logger.warning(f"🚫 客户端不在白名单: {client_info.get('client')}")
-                    return False
-                
-                # 检查设备名称
-                if allowed_devices and client_info.get('device', '').lower() not in [d.lower() for d in allowed_devices]:
-                    logger.warning(f"🚫 设备不在白名单: {client_info.get('device')}")
-                    return False
-                
-                # 检查IP地址
-                if allowed_ips and client_info.get('ip') not in allowed_ips:
-                    logger.warning(f"🚫 IP不在白名单: {client_info.get('ip')}")
-                    return False
-                
-                return True
+            reason = plan.client_denied_reason(client_name, device_name, ip_address)
+            if reason:
+                logger.warning(f"🚫 {reason}")
+                return False
             
-            return True  # 默认允许
+            return True
             
         except Exception as e:
             logger.error(f"❌ 检查客户端权限失败: {e}")
@@ -1015,21 +1125,13 @@ class EmbyProxyService:
                     logger.debug(f"🔍 从路径提取UserId: {user_id} (路径: {request.path})")
             
             if user_id:
-                # 使用缓存避免重复查询
-                if not hasattr(self, '_user_cache'):
-                    self._user_cache = {}
-                    self._user_cache_time = {}
-                
-                import time
-                current_time = time.time()
-                
                 # 检查缓存（5分钟有效期）
-                if (user_id in self._user_cache and 
-                    current_time - self._user_cache_time.get(user_id, 0) < 300):
-                    return self._user_cache[user_id]
+                username = self._user_cache.get(user_id)
+                if username:
+                    return username
                 
                 # 查询用户信息
-                config = self.config_manager.load_config()
+                config = self.config_manager.get_config_snapshot().config
                 emby_server = config['emby']['server'].rstrip('/')
                 api_key = config['emby']['api_key']
                 
@@ -1044,8 +1146,7 @@ class EmbyProxyService:
                     user_info = response.json()
                     username = user_info.get('Name', 'Unknown User')
                     # 缓存结果
-                    self._user_cache[user_id] = username
-                    self._user_cache_time[user_id] = current_time
+                    self._user_cache.set(user_id, username)
                     logger.debug(f"✅ 获取到用户名: {user_id} -> {username}")
                     return username
                 else:
@@ -1060,7 +1161,7 @@ class EmbyProxyService:
     def _get_real_username_from_emby(self, user_id):
         """从Emby API获取真实用户名"""
         try:
-            config = self.config_manager.load_config()
+            config = self.config_manager.get_config_snapshot().config
             emby_server = config['emby']['server']
             api_key = config['emby']['api_key']
             
@@ -1088,7 +1189,7 @@ class EmbyProxyService:
     def _get_username_from_token(self, token):
         """从Token获取用户名"""
         try:
-            config = self.config_manager.load_config()
+            config = self.config_manager.get_config_snapshot().config
             emby_server = config['emby']['server']
             
             if not emby_server or not token:
@@ -1257,29 +1358,37 @@ class EmbyProxyService:
 
     def proxy_request(self, path=''):
         """Emby API 反向代理（独立端口，无需 /emby 前缀）"""
-        # 缓存配置，避免每次都加载（5秒缓存）
-        if not hasattr(self, '_config_cache') or not hasattr(self, '_config_cache_time'):
-            self._config_cache = None
-            self._config_cache_time = 0
-        
-        current_time = __import__('time').time()
-        if current_time - self._config_cache_time > 5:
-            self._config_cache = self.config_manager.load_config()
-            self._config_cache_time = current_time
-        
-        config = self._config_cache
+        result = self.prepare_proxy_request(path)
+        if not isinstance(result, UpstreamRequest):
+            return result
+        return self.forward_upstream(result)
+
+    def prepare_proxy_request(self, path=''):
+        """
+        代理请求的控制面：客户端拦截、跟踪、PlaybackInfo 改写、302 重定向判断
 
-        if not config['emby']['enable']:
+        同步（Flask）和异步（ASGI）数据面共用，需在请求上下文中调用
+
+        :return: 可直接返回的 Flask 响应；需要转发到 Emby 时返回 UpstreamRequest
+        """
+        # 🚀 路由计划：按配置版本预编译，请求期间只做 O(1) 判断
+        plan = self.get_routing_plan()
+        config = plan.config
+
+        if not plan.emby_enable:
             return jsonify({'error': 'Emby proxy is not enabled'}), 503
 
         # 提取客户端信息（对所有请求进行拦截检查）
         client_info = self.extract_client_info(request)
         
         # 🛡️ 对所有请求都进行客户端拦截检查
-        if not self.check_client_access(client_info, config):
+        if not self.check_client_access(client_info, plan):
             logger.warning(f"🚫 客户端访问被拒绝: {client_info.get('client', 'Unknown')} ({client_info.get('ip', 'Unknown IP')})")
             return jsonify({'error': 'Access denied'}), 403
         
+        # 🔮 预解析：根据流量预测下一次播放（只入队，不阻塞）
+        self.speculative_resolver.observe(plan, request.method, request.path, request.get_data)
+
         # 只对重要请求进行客户端跟踪（避免过多跟踪）
         path_lower = request.path.lower()
         is_critical_request = any(keyword in path_lower for keyword in 
@@ -1307,7 +1416,7 @@ class EmbyProxyService:
             else:
                 logger.debug(f"⏭️ 跳过跟踪: {request.path}")
 
-        emby_server = config['emby']['server'].rstrip('/')
+        emby_server = plan.emby_server
 
         # 构建目标 URL
         if path:
@@ -1320,24 +1429,19 @@ class EmbyProxyService:
             target_url += '?' + request.query_string.decode('utf-8')
 
         # 限制日志输出频率，避免刷屏
-        current_time = __import__('time').time()
-        if not hasattr(self, '_last_log_time'):
-            self._last_log_time = {}
-        
         # 为不同类型的请求设置不同的日志频率
         request_key = f"{request.method}_{request.path.split('?')[0]}"
-        last_time = self._last_log_time.get(request_key, 0)
         
-        # 图片请求：30秒输出一次，其他请求：10秒输出一次
+        # 图片请求：30秒输出一次，其他请求：10秒输出一次（条目在间隔到期后自动失效）
         log_interval = 30 if '/Images/' in request.path else 10
         
-        if current_time - last_time > log_interval:
+        if self._last_log_time.get(request_key) is None:
             # 只对重要请求输出日志
             if any(keyword in request.path.lower() for keyword in ['/playbackinfo', '/stream', '/download', '/videos/']):
                 logger.info(f"[Emby Proxy] {request.method} {target_url[:100]}...")
             else:
                 logger.debug(f"[Emby Proxy] {request.method} {target_url[:100]}...")
-            self._last_log_time[request_key] = current_time
+            self._last_log_time.set(request_key, time.time(), ttl=log_interval)
 
         # 路径小写（用于匹配）
         path_lower = request.path.lower()
@@ -1346,7 +1450,7 @@ class EmbyProxyService:
 
         # 特殊处理1: PlaybackInfo 请求 - 修改响应，让 strm 支持直接播放
         if '/playbackinfo' in path_lower and request.method == 'POST':
-            if config['emby'].get('modify_playback_info', False):
+            if plan.modify_playback_info:
                 try:
                     result = self.handle_playback_info(path, target_url)
                     if result:
@@ -1374,17 +1478,23 @@ class EmbyProxyService:
             )
         )
 
-        if config['emby']['redirect_enable'] and is_video_request:
+        if plan.redirect_enable and is_video_request:
             try:
                 # 🎯 核心优化：先快速判断是否需要重定向
                 logger.info(f"🚀 开始重定向预检查: {path}")
-                should_redirect = self._should_attempt_redirect(path, config)
+                ctx = self._resolve_redirect_context(path, plan) if plan.path_mapping_enable else None
+                negative_reason = self._check_negative_cache(ctx, plan)
+                if negative_reason:
+                    logger.info(f"⛔ 负缓存命中({negative_reason})，直接代理播放")
+                    should_redirect = False
+                else:
+                    should_redirect = self._should_attempt_redirect(ctx, plan)
                 logger.info(f"🚀 预检查结果: should_redirect={should_redirect}")
                 
                 if should_redirect:
                     # 只对匹配路径的资源尝试获取直链
                     logger.info(f"🌐 检测到网盘资源，尝试获取直链...")
-                    direct_url = self.handle_emby_video_redirect(path)
+                    direct_url = self.handle_emby_video_redirect(path, plan, ctx)
                     if direct_url:
                         return redirect(direct_url, code=302)
                     else:
@@ -1396,51 +1506,93 @@ class EmbyProxyService:
             except Exception as e:
                 logger.error(f"❌ 302 重定向失败: {e}, 回退到普通代理")
 
-        # 普通代理请求
-        try:
-            # 准备请求头
-            headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'connection']}
+        # 普通代理请求：准备请求头（是否验证 SSL 证书由配置决定）
+        headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'connection']}
+        return UpstreamRequest(request.method, target_url, headers, self._upstream_body(), request.cookies,
+                               plan.ssl_verify, self._open_bandwidth_stream(client_info))
 
-            # 获取会话
-            session = self.get_emby_session()
+    @staticmethod
+    def _open_bandwidth_stream(client_info):
+        """媒体流（本地资源的视频 / 音频流、下载）登记到带宽调度器"""
+        if request.method == 'HEAD' or not is_media_path(request.path):
+            return None
+        return get_bandwidth_scheduler().open_stream(
+            'emby',
+            ip=client_info.get('ip'),
+            device_id=client_info.get('device_id') or None,
+            device=client_info.get('device') or None,
+            label=request.path
+        )
 
-            # 是否验证 SSL 证书
-            ssl_verify = config['emby'].get('ssl_verify', False)
+    @staticmethod
+    def _upstream_body():
+        """转发的请求体：需要改写 / 读取的请求完整读取，其余流式透传"""
+        if body_needs_buffering(request.path):
+            return request.get_data()
+        content_length = request.content_length
+        chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+        if not content_length and not chunked:
+            return b''
+        return StreamingRequestBody(request.stream, content_length if not chunked else None)
+
+    def forward_upstream(self, upstream):
+        """同步数据面：通过 requests 会话转发到 Emby 并流式返回"""
+        target_url = upstream.url
+        try:
+            # 获取会话（流式请求体无法重放，使用不重试的会话）
+            body = upstream.body
+            if isinstance(body, StreamingRequestBody):
+                session = self.get_emby_stream_session()
+                if body.content_length is None:
+                    body = iter(body)
+            else:
+                session = self.get_emby_session()
 
             # 移除健康检查，提高响应速度
             # 让请求失败时自然报错，而不是提前检查
 
+            # 客户端未声明 Accept-Encoding 时要求 Emby 不压缩：响应体原样转发，不在代理中解码
+            headers = upstream.headers
+            if not any(name.lower() == 'accept-encoding' for name in headers):
+                headers = dict(headers, **{'Accept-Encoding': 'identity'})
+
             # 发起请求
             resp = session.request(
-                method=request.method,
+                method=upstream.method,
                 url=target_url,
                 headers=headers,
-                data=request.get_data(),
-                cookies=request.cookies,
+                data=body,
+                cookies=upstream.cookies,
                 allow_redirects=False,
                 stream=True,
                 timeout=(10, 30),  # 减少超时时间，避免长时间等待
-                verify=ssl_verify  # 根据配置决定是否验证 SSL 证书
+                verify=upstream.ssl_verify  # 根据配置决定是否验证 SSL 证书
             )
 
-            # 构建响应
-            excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-            response_headers = [(name, value) for name, value in resp.raw.headers.items()
-                               if name.lower() not in excluded_headers]
-
-            # 返回响应
-            return Response(resp.iter_content(chunk_size=8192),
+            # 返回响应（splice / 复用缓冲区直写客户端 socket，见 utils/relay.py）
+            # 媒体流按带宽调度限速，转发结束时由引擎关闭
+            relay = UpstreamRelay(resp, request.environ if has_request_context() else None,
+                                  bandwidth=upstream.bandwidth)
+            return Response(relay,
                            status=resp.status_code,
-                           headers=response_headers)
+                           headers=relay.response_headers())
 
         except requests.exceptions.Timeout as e:
             logger.error(f"代理请求超时: {target_url[:100]}")
+            self._close_bandwidth_stream(upstream)
             return jsonify({'error': 'Request timeout'}), 504
 
         except requests.exceptions.ConnectionError as e:
             logger.error(f"代理请求连接失败: {target_url[:100]}")
+            self._close_bandwidth_stream(upstream)
             return jsonify({'error': 'Connection failed'}), 503
 
         except Exception as e:
             logger.error(f"代理请求失败: {e}")
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            self._close_bandwidth_stream(upstream)
+            return jsonify({'error': str(e)}), 500
+
+    @staticmethod
+    def _close_bandwidth_stream(upstream):
+        if upstream.bandwidth is not None:
+            upstream.bandwidth.close()
\ No newline at end of file
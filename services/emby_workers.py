@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 反向代理多进程 worker 模式
+
+单个 Python 进程受 GIL 限制，302 重定向吞吐无法随 CPU 核数增长。设置
+EMBY_PROXY_WORKERS=N（N > 1）后，主进程只运行管理界面和后台任务，Emby 代理
+端口由 N 个 worker 进程共同监听：
+- Linux：每个 worker 以 SO_REUSEPORT 独立绑定端口，由内核分配连接
+- 其他平台：主进程绑定端口，把监听 socket 传给所有 worker（pre-fork）
+
+主进程监督 worker：异常退出的 worker 自动重启（连续快速退出时退避）；
+worker 处理 EMBY_PROXY_MAX_REQUESTS 个请求后平滑退出并由主进程替换；
+SIGHUP 触发滚动重启（先启动新 worker，再让旧 worker 停止接收连接、等待
+进行中的请求结束，最多 EMBY_PROXY_GRACEFUL_TIMEOUT 秒）。
+
+进程间共享模型见 utils/shared_state.py：SQLite 为唯一数据源，进程内缓存为 L1。
+"""
+
+import os
+import sys
+import random
+import time
+import signal
+import socket
+import logging
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Linux 的 SO_REUSEPORT 会在多个监听 socket 之间负载均衡（其他平台语义不同）
+REUSE_PORT_AVAILABLE = hasattr(socket, 'SO_REUSEPORT') and sys.platform.startswith('linux')
+
+
+def bind_listen_socket(host, port, reuse_port=False, backlog=1024):
+    """
+    创建监听 socket
+
+    :param reuse_port: 是否设置 SO_REUSEPORT（多个进程各自绑定同一端口）
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class _RequestTracker:
+    """WSGI 中间件：统计请求数和进行中的请求（流式响应直到关闭才算结束）"""
+
+    def __init__(self, app, requests_counter, active_counter, on_request_done=None):
+        self.app = app
+        self.requests_counter = requests_counter
+        self.active_counter = active_counter
+        self.on_request_done = on_request_done
+
+    def __call__(self, environ, start_response):
+        with self.active_counter.get_lock():
+            self.active_counter.value += 1
+        try:
+            iterable = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return _TrackedIterable(iterable, self._done)
+
+    def _done(self):
+        with self.active_counter.get_lock():
+            self.active_counter.value -= 1
+        with self.requests_counter.get_lock():
+            self.requests_counter.value += 1
+            total = self.requests_counter.value
+        if self.on_request_done is not None:
+            self.on_request_done(total)
+
+
+class _TrackedIterable:
+    """包装响应体，close() 时标记请求结束"""
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._on_close()
+
+
+def _worker_main(index, bootstrap, host, port, engine, listen_sock, requests_counter, active_counter,
+                 ready_flag, max_requests, graceful_timeout, parent_pid):
+    """worker 进程入口（spawn 启动，需要重新初始化所有服务）"""
+    flask_app, proxy_service = bootstrap()
+
+    from utils.shared_state import get_shared_state
+    get_shared_state().start()
+
+    sock = listen_sock or bind_listen_socket(host, port, reuse_port=True)
+    ready_flag.value = 1
+    logger.info(f"👷 Emby 代理 worker #{index} 已启动 (PID {os.getpid()}, 引擎: {engine})")
+
+    if engine == 'asgi':
+        from services.emby_asgi import run_asgi_server
+        # uvicorn 自行处理 SIGTERM 平滑退出和 limit_max_requests 回收
+        threading.Thread(target=_watch_parent, daemon=True, name='EmbyWorkerParentWatch',
+                         args=(parent_pid, lambda _: os.kill(os.getpid(), signal.SIGTERM))).start()
+        if run_asgi_server(flask_app, proxy_service, host, port, sock=sock,
+                           limit_max_requests=max_requests or None, install_signal_handlers=True):
+            return
+
+    from werkzeug.serving import make_server
+
+    stopping = threading.Event()
+
+    def begin_shutdown(reason):
+        if stopping.is_set():
+            return
+        stopping.set()
+        logger.info(f"👷 worker #{index} 停止接收新连接: {reason}")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def on_request_done(total):
+        if max_requests and total >= max_requests:
+            begin_shutdown(f"已处理 {total} 个请求")
+
+    server = make_server(
+        host, port,
+        _RequestTracker(flask_app, requests_counter, active_counter, on_request_done),
+        threaded=True,
+        fd=sock.fileno()
+    )
+    signal.signal(signal.SIGTERM, lambda *_: begin_shutdown('收到 SIGTERM'))
+    threading.Thread(target=_watch_parent, args=(parent_pid, begin_shutdown), daemon=True,
+                     name='EmbyWorkerParentWatch').start()
+
+    server.serve_forever()
+    server.server_close()
+    sock.close()
+
+    # 等待进行中的请求（流式代理）结束
+    deadline = time.time() + graceful_timeout
+    while active_counter.value > 0 and time.time() < deadline:
+        time.sleep(0.2)
+    if active_counter.value > 0:
+        logger.warning(f"⚠️ worker #{index} 平滑退出超时，仍有 {active_counter.value} 个请求进行中")
+    logger.info(f"👷 worker #{index} 已退出 (PID {os.getpid()})")
+
+
+def _watch_parent(parent_pid, begin_shutdown):
+    """主进程退出后 worker 随之退出"""
+    while True:
+        time.sleep(2)
+        if os.getppid() != parent_pid:
+            begin_shutdown('主进程已退出')
+            return
+
+
+class _WorkerSlot:
+    """一个 worker 位置（进程 + 共享计数器）"""
+
+    __slots__ = ('index', 'process', 'requests', 'active', 'ready', 'replacing', 'started_at', 'restarts',
+                 'backoff', 'next_start_at')
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.requests = None
+        self.active = None
+        self.ready = None
+        self.replacing = None     # 滚动重启中被替换的旧进程（新进程就绪后停止）
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.next_start_at = 0.0
+
+
+class EmbyWorkerPool:
+    """Emby 代理 worker 进程池（主进程中运行监督线程）"""
+
+    SUPERVISE_INTERVAL = 1.0   # 检查 worker 状态的间隔（秒）
+    FAST_EXIT_SECONDS = 5      # 启动后多久内退出视为启动失败（触发退避）
+    MAX_BACKOFF = 30           # 重启退避上限（秒）
+
+    def __init__(self, bootstrap, host, port, workers, engine='flask', max_requests=None, graceful_timeout=None):
+        """
+        :param bootstrap: worker 初始化函数（模块级，可被 pickle），返回 (emby_app, proxy_service)
+        :param workers: worker 进程数
+        :param engine: flask / asgi
+        :param max_requests: 每个 worker 处理多少请求后回收（默认 EMBY_PROXY_MAX_REQUESTS 或 0 不回收）
+        :param graceful_timeout: 平滑退出时等待进行中请求的时间（默认 EMBY_PROXY_GRACEFUL_TIMEOUT 或 30 秒）
+        """
+        self.bootstrap = bootstrap
+        self.host = host
+        self.port = port
+        self.engine = engine
+        self.max_requests = max_requests if max_requests is not None else \
+            int(os.environ.get('EMBY_PROXY_MAX_REQUESTS', 0))
+        self.graceful_timeout = graceful_timeout if graceful_timeout is not None else \
+            int(os.environ.get('EMBY_PROXY_GRACEFUL_TIMEOUT', 30))
+        self.reuse_port = REUSE_PORT_AVAILABLE
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._slots = [_WorkerSlot(i) for i in range(max(1, workers))]
+        self._retiring = []   # [(process, deadline)] 滚动重启中等待退出的旧 worker
+        self._listen_sock = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """绑定端口（pre-fork 模式）、启动所有 worker 和监督线程"""
+        if not self.reuse_port:
+            self._listen_sock = bind_listen_socket(self.host, self.port)
+        with self._lock:
+            for slot in self._slots:
+                self._spawn(slot)
+        self._thread = threading.Thread(target=self._supervise, daemon=True, name='EmbyWorkerSupervisor')
+        self._thread.start()
+        mode = 'SO_REUSEPORT' if self.reuse_port else '共享监听 socket'
+        logger.info(f"👷 Emby 代理多进程模式: {len(self._slots)} 个 worker ({mode}, 引擎: {self.engine})")
+
+    def reload(self):
+        """滚动重启所有 worker（先启动新进程，再平滑停止旧进程）"""
+        logger.info("🔄 滚动重启 Emby 代理 worker...")
+        with self._lock:
+            for slot in self._slots:
+                old = slot.process
+                if slot.replacing is not None:
+                    self._retire(slot.replacing)
+                self._spawn(slot)
+                slot.replacing = old if old is not None and old.is_alive() else None
+
+    def stop(self):
+        """停止监督并平滑停止所有 worker"""
+        self._stop_event.set()
+        with self._lock:
+            for slot in self._slots:
+                for process in (slot.process, slot.replacing):
+                    if process is not None and process.is_alive():
+                        self._retire(process)
+        deadline = time.time() + self.graceful_timeout + 5
+        for process, _ in list(self._retiring):
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.kill()
+        if self._listen_sock is not None:
+            self._listen_sock.close()
+
+    def install_signal_handlers(self):
+        """SIGHUP → 滚动重启（只能在主线程调用，Windows 不支持）"""
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=self.reload, daemon=True).start())
+
+    # ==================== 监督 ====================
+
+    def _spawn(self, slot):
+        """启动 slot 的 worker 进程（调用方持有锁）"""
+        slot.requests = self._ctx.Value('q', 0)
+        slot.active = self._ctx.Value('i', 0)
+        slot.ready = self._ctx.Value('b', 0)
+        # 回收阈值加随机抖动，避免所有 worker 同时回收
+        max_requests = self.max_requests + random.randint(0, self.max_requests // 10) if self.max_requests else 0
+        slot.process = self._ctx.Process(
+            target=_worker_main,
+            args=(slot.index, self.bootstrap, self.host, self.port, self.engine, self._listen_sock,
+                  slot.requests, slot.active, slot.ready, max_requests, self.graceful_timeout, os.getpid()),
+            name=f'EmbyWorker-{slot.index}',
+            daemon=True
+        )
+        # 共享计数器的内存在释放后会被新计数器复用：进程退出前必须保持引用
+        slot.process.counters = (slot.requests, slot.active, slot.ready)
+        slot.process.start()
+        slot.started_at = time.time()
+
+    def _retire(self, process):
+        """让旧 worker 停止接收连接并等待进行中的请求（调用方持有锁）"""
+        process.terminate()  # SIGTERM → 平滑退出
+        self._retiring.append((process, time.time() + self.graceful_timeout + 5))
+
+    def _supervise(self):
+        while not self._stop_event.wait(self.SUPERVISE_INTERVAL):
+            try:
+                self._check_workers()
+            except Exception as e:
+                logger.warning(f"⚠️ worker 监督异常: {e}")
+
+    def _check_workers(self):
+        now = time.time()
+        with self._lock:
+            for slot in self._slots:
+                # 新 worker 已开始监听，旧 worker 可以停止接收连接
+                if slot.replacing is not None and (slot.ready.value or not slot.process.is_alive()):
+                    self._retire(slot.replacing)
+                    slot.replacing = None
+
+                process = slot.process
+                if process is None or process.is_alive() or self._stop_event.is_set():
+                    continue
+                if slot.next_start_at == 0.0:
+                    # 刚发现退出：正常回收立即替换，启动即退出则退避
+                    if process.exitcode == 0 and now - slot.started_at >= self.FAST_EXIT_SECONDS:
+                        slot.backoff = 0.0
+                        logger.info(f"♻️ worker #{slot.index} 已回收，启动新 worker")
+                    else:
+                        fast_exit = now - slot.started_at < self.FAST_EXIT_SECONDS
+                        slot.backoff = min(self.MAX_BACKOFF, slot.backoff * 2 or 1) if fast_exit else 0.0
+                        logger.warning(f"⚠️ worker #{slot.index} 异常退出 (exitcode={process.exitcode})，"
+                                       f"{slot.backoff:.0f} 秒后重启")
+                    slot.next_start_at = now + slot.backoff
+                if now >= slot.next_start_at:
+                    slot.next_start_at = 0.0
+                    slot.restarts += 1
+                    self._spawn(slot)
+
+            still_retiring = []
+            for process, deadline in self._retiring:
+                if not process.is_alive():
+                    process.join(0)
+                elif now >= deadline:
+                    logger.warning(f"⚠️ 旧 worker 平滑退出超时，强制结束 (PID {process.pid})")
+                    process.kill()
+                else:
+                    still_retiring.append((process, deadline))
+            self._retiring = still_retiring
+
+    def stats(self):
+        with self._lock:
+            workers = []
+            for slot in self._slots:
+                process = slot.process
+                workers.append({
+                    'index': slot.index,
+                    'pid': process.pid if process is not None else None,
+                    'alive': bool(process is not None and process.is_alive()),
+                    'ready': bool(slot.ready.value) if slot.ready is not None else False,
+                    'requests': slot.requests.value if slot.requests is not None else 0,
+                    'active': slot.active.value if slot.active is not None else 0,
+                    'restarts': slot.restarts,
+                    'uptime': int(time.time() - slot.started_at) if slot.started_at else 0
+                })
+            return {
+                'workers': workers,
+                'mode': 'reuseport' if self.reuse_port else 'shared_socket',
+                'engine': self.engine,
+                'max_requests': self.max_requests,
+                'retiring': len(self._retiring)
+            }
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理模式下载的上游共享（多个客户端同时观看同一文件）
+
+一起看、投屏的同时在手机上预览时，多个 /proxy/download 请求在相近的位置读取同一文件，
+各自打开上游连接拉取完全相同的字节。开启 stream.fanout_enable 后：
+- 同一文件（签名校验过的文件标识，没有时为完整直链）的上游拉取在后台线程中进行，数据写入有界环形缓冲区
+- 新请求的起点落在某个进行中拉取的缓冲区范围内（或略超前于已拉取位置）时直接订阅它，
+  不再请求上游
+- 上游拉取速度跟随最快的订阅者，最多领先它 fanout_buffer_mb；落后超过缓冲区的订阅者
+  脱离共享，从自己的位置单独拉取（可能订阅其他落后者的拉取）
+- 所有订阅者离开后上游拉取立即停止
+- 开启分块缓存时块数据由拉取线程写入，不会被多个订阅者重复写入
+
+上游带宽随不同内容的数量而不是观看人数增长。
+"""
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOIN_AHEAD = 4 * 1024 * 1024    # 起点超前于已拉取位置不超过该值时订阅并等待（而不是另开连接）
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='Fanout')
+
+
+class _Subscriber:
+    __slots__ = ('position', 'index')
+
+    def __init__(self, position, index):
+        self.position = position
+        self.index = index          # 下一个要读取的数据块的绝对序号
+
+
+class SharedFetch:
+    """一次共享的上游拉取 [start, stop)，数据保存在有界环形缓冲区"""
+
+    def __init__(self, hub, key, start, stop, total_size, content_type, capacity):
+        self.hub = hub
+        self.key = key
+        self.start = start
+        self.stop = stop
+        self.total_size = total_size
+        self.content_type = content_type
+        self.capacity = capacity
+
+        self.base = start           # 缓冲区中最早的字节
+        self.head = start           # 已拉取到的位置
+        self._chunks = deque()      # (起始偏移, 数据)
+        self._popped = 0            # 已移出缓冲区的数据块数（_chunks[0] 的绝对序号）
+        self._subscribers = set()
+        self._cond = threading.Condition()
+        self._producer_waiting = False
+        self.cancelled = False
+        self.done = False
+        self.error = None
+
+    # ==================== 订阅 ====================
+
+    def can_join(self, position, total_size):
+        """position 在缓冲区范围内，或略超前于已拉取位置（不超过缓冲区容量）"""
+        return (not self.cancelled and not self.done and total_size == self.total_size
+                and self.base <= position < self.stop
+                and position <= self.head + min(JOIN_AHEAD, self.capacity))
+
+    def subscribe(self, position):
+        """（调用方持有 hub 锁）"""
+        with self._cond:
+            index = self._popped
+            for offset, data in self._chunks:
+                if offset + len(data) > position:
+                    break
+                index += 1
+            subscriber = _Subscriber(position, index)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def leave(self, subscriber):
+        with self._cond:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                # 最后一个订阅者离开：停止上游拉取
+                self.cancelled = True
+            self._cond.notify_all()
+        if self.cancelled:
+            self.hub._remove(self)
+
+    def read(self, subscriber, stop):
+        """
+        按顺序产出订阅者位置到 min(stop, 拉取终点) 的数据
+
+        :return: 生成器；订阅者落后到缓冲区之外时提前结束（subscriber.position < stop）
+        """
+        stop = min(stop, self.stop)
+        while subscriber.position < stop:
+            with self._cond:
+                while (subscriber.position >= self.head and not self.done and not self.cancelled):
+                    self._cond.wait()
+                if subscriber.position < self.base:
+                    return  # 落后太多，数据已被覆盖
+                if subscriber.position >= self.head:
+                    if self.error is not None:
+                        raise self.error
+                    return  # 拉取已停止
+                if subscriber.index < self._popped:
+                    # 超前订阅后等待期间，订阅时记录的数据块已移出缓冲区
+                    subscriber.index = self._popped
+                offset, data = self._chunks[subscriber.index - self._popped]
+                while offset + len(data) <= subscriber.position:
+                    # 订阅时起点超前于已拉取位置：跳过起点之前的数据块
+                    subscriber.index += 1
+                    offset, data = self._chunks[subscriber.index - self._popped]
+                lo = subscriber.position - offset
+                hi = min(len(data), stop - offset)
+                chunk = data[lo:hi] if lo or hi < len(data) else data
+                subscriber.position = offset + hi
+                if hi == len(data):
+                    subscriber.index += 1
+                if self._producer_waiting:
+                    self._cond.notify_all()
+            self.hub.count(delivered_bytes=len(chunk))
+            yield chunk
+
+    # ==================== 上游拉取 ====================
+
+    def run(self, chunks, close, sink=None):
+        """后台线程：拉取上游数据写入缓冲区"""
+        try:
+            for chunk in chunks:
+                if self.head + len(chunk) > self.stop:
+                    chunk = chunk[:self.stop - self.head]
+                with self._cond:
+                    # 最快的订阅者也落后于缓冲区容量时暂停，避免覆盖所有人都还没读的数据
+                    while not self.cancelled and self.head - self._leader() >= self.capacity:
+                        self._producer_waiting = True
+                        self._cond.wait()
+                    self._producer_waiting = False
+                    if self.cancelled:
+                        break
+                    self._chunks.append((self.head, chunk))
+                    self.head += len(chunk)
+                    while self._chunks and self._chunks[0][0] + len(self._chunks[0][1]) <= self.head - self.capacity:
+                        self._chunks.popleft()
+                        self._popped += 1
+                    self.base = self._chunks[0][0] if self._chunks else self.head
+                    self._cond.notify_all()
+                self.hub.count(upstream_bytes=len(chunk))
+                if sink is not None:
+                    sink.write(chunk)
+                if self.head >= self.stop:
+                    break
+            if not self.cancelled and self.head < self.stop:
+                raise ConnectionError(f"上游提前结束: {self.head}/{self.stop}")
+        except Exception as e:
+            self.error = e
+        finally:
+            close()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            self.hub._remove(self)
+
+    def _leader(self):
+        return max((s.position for s in self._subscribers), default=self.head)
+
+
+class FanoutHub:
+    """按文件共享进行中的上游拉取"""
+
+    def __init__(self):
+        self._fetches = {}          # 文件标识 → [SharedFetch]
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.created = 0
+        self.joined = 0
+        self.detached = 0
+        self.upstream_bytes = 0
+        self.delivered_bytes = 0
+
+    def count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def file_info(self, key):
+        """进行中拉取的文件信息（不使用分块缓存时省去读取文件大小的上游请求）"""
+        with self._lock:
+            for fetch in self._fetches.get(key, ()):
+                if not fetch.cancelled and fetch.error is None:
+                    return {'total_size': fetch.total_size, 'content_type': fetch.content_type}
+        return None
+
+    def _remove(self, fetch):
+        with self._lock:
+            fetches = self._fetches.get(fetch.key)
+            if fetches and fetch in fetches:
+                fetches.remove(fetch)
+                if not fetches:
+                    del self._fetches[fetch.key]
+
+    def _attach_or_create(self, key, position, fetch_start, fetch_stop, total_size, content_type, capacity):
+        with self._lock:
+            for fetch in self._fetches.get(key, ()):
+                if fetch.can_join(position, total_size):
+                    self.count(joined=1)
+                    return fetch, fetch.subscribe(position), False
+            fetch = SharedFetch(self, key, fetch_start, fetch_stop, total_size, content_type, capacity)
+            self._fetches.setdefault(key, []).append(fetch)
+            self.count(created=1)
+            return fetch, fetch.subscribe(position), True
+
+    def stream(self, key, start, stop, total_size, open_source, capacity,
+               fetch_start=None, fetch_stop=None, content_type=None, sink_factory=None):
+        """
+        产出文件 [start, stop) 的数据：能订阅进行中的拉取时共享，否则新建共享拉取
+
+        :param key: 文件标识
+        :param start: 客户端需要的起点
+        :param stop: 客户端需要的终点（不含）
+        :param total_size: 文件总大小（只共享同一大小的拉取）
+        :param open_source: open_source(start, stop) → (数据块迭代器, 关闭函数)
+        :param capacity: 环形缓冲区大小（字节）
+        :param fetch_start: 新建拉取的起点（默认 start；分块缓存按块边界对齐）
+        :param fetch_stop: 新建拉取的终点（默认 stop）
+        :param content_type: 文件类型
+        :param sink_factory: sink_factory(拉取起点) → 带 write(chunk) 的对象，拉取线程按顺序写入
+        """
+        position = start
+        while position < stop:
+            new_start = fetch_start if position == start and fetch_start is not None else position
+            new_stop = max(stop, fetch_stop or stop)
+            fetch, subscriber, created = self._attach_or_create(
+                key, position, new_start, new_stop, total_size, content_type, capacity
+            )
+            if created:
+                try:
+                    chunks, close = open_source(new_start, new_stop)
+                except Exception as e:
+                    fetch.error = e
+                    fetch.done = True
+                    fetch.leave(subscriber)
+                    raise
+                sink = sink_factory(new_start) if sink_factory else None
+                _executor.submit(fetch.run, chunks, close, sink)
+            try:
+                for chunk in fetch.read(subscriber, stop):
+                    position += len(chunk)
+                    yield chunk
+            finally:
+                fetch.leave(subscriber)
+            if position < stop and position < fetch.base:
+                # 落后到缓冲区之外：脱离共享，单独拉取
+                self.count(detached=1)
+            elif position < stop and fetch.error is not None:
+                raise fetch.error
+
+    def stats(self):
+        with self._lock:
+            fetches = [fetch for items in self._fetches.values() for fetch in items]
+            active = {
+                'fetches': len(fetches),
+                'subscribers': sum(len(fetch._subscribers) for fetch in fetches),
+                'buffered_bytes': sum(fetch.head - fetch.base for fetch in fetches)
+            }
+        with self._stats_lock:
+            return dict(active, **{
+                'created': self.created,
+                'joined': self.joined,
+                'detached': self.detached,
+                'upstream_bytes': self.upstream_bytes,
+                'delivered_bytes': self.delivered_bytes,
+                'bytes_saved': max(self.delivered_bytes - self.upstream_bytes, 0)
+            })
+
+
+# 全局实例
+_fanout_hub = None
+_fanout_hub_lock = threading.Lock()
+
+
+def get_fanout_hub():
+    """获取全局上游共享实例"""
+    global _fanout_hub
+    if _fanout_hub is None:
+        with _fanout_hub_lock:
+            if _fanout_hub is None:
+                _fanout_hub = FanoutHub()
+    return _fanout_hub
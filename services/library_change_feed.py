@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 媒体库变更同步
+
+让永久路径数据库（item_path_mapping）跟随 Emby 媒体库变化：
+1. Webhook：Emby Webhooks / Jellyfin Webhook 插件推送的新增、更新、删除事件
+2. 定时增量：按 emby.change_feed_interval 周期触发媒体库预热的增量运行
+   （Items?MinDateLastSaved=...，路径变化的条目会被覆盖）
+
+路径变更和删除由 ItemPathDatabase 通知监听者，清理派生的 Item 缓存和直链缓存。
+"""
+
+import json
+import logging
+import threading
+
+from models.config import ConfigManager
+from utils.routing_plan import get_routing_plan
+
+logger = logging.getLogger(__name__)
+
+# 删除事件（Emby: library.deleted；Jellyfin: ItemDeleted）
+DELETE_EVENTS = frozenset({'library.deleted', 'itemdeleted'})
+# 新增 / 更新事件
+UPDATE_EVENTS = frozenset({'library.new', 'library.updated', 'item.updated', 'itemadded', 'itemupdated'})
+
+
+class LibraryChangeFeed:
+    """媒体库变更同步（Webhook + 定时增量）"""
+
+    # 定时增量关闭时，重新检查配置的间隔（秒）
+    IDLE_CHECK_INTERVAL = 60
+
+    def __init__(self, library_crawler, items_resolver, item_path_db):
+        """
+        :param library_crawler: LibraryCrawler（定时增量复用其增量运行）
+        :param items_resolver: EmbyItemsBatchResolver（Webhook 事件没有路径时查询）
+        :param item_path_db: ItemPathDatabase
+        """
+        self.library_crawler = library_crawler
+        self.items_resolver = items_resolver
+        self.item_path_db = item_path_db
+        self.config_manager = ConfigManager()
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.webhook_events = 0
+        self.items_updated = 0
+        self.items_removed = 0
+
+    # ==================== Webhook ====================
+
+    @staticmethod
+    def parse_webhook_payload(raw_json=None, form=None):
+        """
+        解析 Webhook 请求体（JSON，或 multipart 表单的 data 字段）
+
+        :return: dict 或 None
+        """
+        if isinstance(raw_json, dict):
+            return raw_json
+        data = (form or {}).get('data')
+        if data:
+            try:
+                return json.loads(data)
+            except ValueError:
+                return None
+        return None
+
+    def handle_webhook(self, payload):
+        """
+        处理一个媒体库事件
+
+        :return: 处理结果摘要
+        """
+        event = str(payload.get('Event') or payload.get('NotificationType') or '').strip()
+        event_key = event.lower()
+        item = payload.get('Item') or {}
+        item_id = str(item.get('Id') or payload.get('ItemId') or '')
+
+        result = {'event': event, 'item_id': item_id, 'updated': 0, 'removed': 0}
+        if not item_id or (event_key not in DELETE_EVENTS and event_key not in UPDATE_EVENTS):
+            result['ignored'] = True
+            return result
+
+        self.webhook_events += 1
+
+        # 多版本：媒体源ID对应的记录一起处理
+        media_source_ids = [str(ms.get('Id')) for ms in item.get('MediaSources') or () if ms.get('Id')]
+
+        if event_key in DELETE_EVENTS:
+            removed = self.item_path_db.remove_many([item_id] + media_source_ids)
+            self.items_removed += removed
+            result['removed'] = removed
+            logger.info(f"🗑️ 媒体库删除事件: {item.get('Name', item_id)}, 删除 {removed} 条路径映射")
+            return result
+
+        # 新增 / 更新：事件中带路径时直接使用，否则查询 Emby
+        if item.get('Path'):
+            paths = {item_id: item['Path']}
+            for ms in item.get('MediaSources') or ():
+                if ms.get('Id') and ms.get('Path'):
+                    paths[str(ms['Id'])] = ms['Path']
+            paths = {k: v for k, v in paths.items() if not v.startswith(('http://', 'https://'))}
+            if paths:
+                self.item_path_db.set_many(paths)
+            result['updated'] = len(paths)
+        else:
+            plan = get_routing_plan(self.config_manager.get_config_snapshot())
+            if plan.emby_server and plan.api_key:
+                # 批量查询器会把查询到的路径写入数据库；Emby 已不存在的条目删除
+                if self.items_resolver.resolve(item_id, plan) is None:
+                    result['removed'] = self.item_path_db.remove_many([item_id])
+                else:
+                    result['updated'] = 1
+
+        self.items_updated += result['updated']
+        self.items_removed += result['removed']
+        logger.info(f"🔄 媒体库更新事件: {event} {item.get('Name', item_id)}")
+        return result
+
+    # ==================== 定时增量 ====================
+
+    def start(self):
+        """启动定时增量同步线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True, name='LibraryChangeFeed')
+        self._thread.start()
+        logger.info("🔄 媒体库变更同步已启动")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _get_interval(self):
+        emby = self.config_manager.get_config_snapshot().config.get('emby', {}) or {}
+        if not emby.get('enable') or not emby.get('server') or not emby.get('api_key'):
+            return 0
+        return int(emby.get('change_feed_interval', 600) or 0)
+
+    def _poll_loop(self):
+        while True:
+            interval = self._get_interval()
+            if self._stop_event.wait(interval if interval > 0 else self.IDLE_CHECK_INTERVAL):
+                return
+            if interval <= 0 or self._get_interval() <= 0:
+                continue
+            # 只在有过完整预热之后做增量，避免定时触发全量遍历
+            if not self.library_crawler.get_last_run().get('last_success_started_at'):
+                continue
+            if self.library_crawler.start(full=False):
+                logger.debug("🔄 定时增量同步已触发")
+
+    def stats(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval': self._get_interval(),
+            'webhook_events': self.webhook_events,
+            'items_updated': self.items_updated,
+            'items_removed': self.items_removed
+        }
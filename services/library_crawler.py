@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 媒体库预热
+
+后台分页遍历 Emby /Items（Movie / Episode / Audio），把 item → 文件路径
+（以及多版本的 mediaSource → 文件路径）批量写入 item_path_mapping，
+首次播放即可命中永久路径数据库，无需再查询 Emby。
+
+增量模式使用上次成功运行的开始时间作为 MinDateLastSaved，只拉取变更的条目。
+"""
+
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from database.database import get_db_manager
+from models.config import ConfigManager
+from services.emby_items_resolver import select_media_path
+from utils.routing_plan import get_routing_plan
+
+logger = logging.getLogger(__name__)
+
+# config_store 中保存上次运行信息的键
+CRAWL_STATE_KEY = 'library_crawl_state'
+
+
+class _RateLimiter:
+    """简单的请求间隔限速（每秒最多 rate 次）"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class LibraryCrawler:
+    """Emby 媒体库路径预热器（同一时间只运行一个任务）"""
+
+    ITEM_TYPES = 'Movie,Episode,Audio'
+    PAGE_SIZE = 200
+    DEFAULT_CONCURRENCY = 2
+    DEFAULT_RATE_LIMIT = 5.0  # 每秒请求数
+    # 增量起点往前多取一点，避免与上次运行交界处的条目漏掉
+    INCREMENTAL_SLACK = 300
+
+    def __init__(self, session_getter, item_path_db):
+        """
+        :param session_getter: 返回 requests.Session 的函数
+        :param item_path_db: ItemPathDatabase
+        """
+        self._session_getter = session_getter
+        self._item_path_db = item_path_db
+        self.config_manager = ConfigManager()
+        self.db = get_db_manager()
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._status = self._new_status('idle')
+
+    @staticmethod
+    def _new_status(state, **kwargs):
+        status = {
+            'state': state,
+            'mode': None,
+            'total': 0,
+            'processed': 0,
+            'written': 0,
+            'pages': 0,
+            'failed_pages': 0,
+            'started_at': None,
+            'finished_at': None,
+            'error': None
+        }
+        status.update(kwargs)
+        return status
+
+    # ==================== 控制 ====================
+
+    def start(self, full=False, concurrency=None, rate_limit=None):
+        """
+        启动预热任务
+
+        :param full: True 全量遍历；False 增量（从上次成功运行开始）
+        :param concurrency: 并发请求数
+        :param rate_limit: 每秒最多请求数
+        :return: 是否启动成功（已有任务运行时返回 False）
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+
+            last_run = self.get_last_run()
+            min_date = None
+            if not full and last_run.get('last_success_started_at'):
+                min_date = last_run['last_success_started_at'] - self.INCREMENTAL_SLACK
+
+            self._stop_event.clear()
+            self._status = self._new_status(
+                'running',
+                mode='incremental' if min_date else 'full',
+                started_at=int(time.time())
+            )
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(min_date, concurrency or self.DEFAULT_CONCURRENCY,
+                      rate_limit if rate_limit is not None else self.DEFAULT_RATE_LIMIT),
+                daemon=True,
+                name='LibraryCrawler'
+            )
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """请求停止当前任务"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return False
+            self._status['state'] = 'stopping'
+        self._stop_event.set()
+        return True
+
+    def get_status(self):
+        """当前任务进度 + 上次运行信息"""
+        with self._lock:
+            status = dict(self._status)
+        total = status['total']
+        status['progress'] = round(status['processed'] * 100.0 / total, 1) if total else 0.0
+        status['last_run'] = self.get_last_run()
+        return status
+
+    def get_last_run(self):
+        raw = self.db.get_config_value(CRAWL_STATE_KEY)
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    # ==================== 遍历 ====================
+
+    def _run(self, min_date, concurrency, rate_limit):
+        started_at = self._status['started_at']
+        limiter = _RateLimiter(rate_limit)
+        try:
+            plan = get_routing_plan(self.config_manager.get_config_snapshot())
+            if not plan.emby_server or not plan.api_key:
+                raise RuntimeError('Emby 服务器地址或 API Key 未配置')
+
+            logger.info(f"📚 媒体库预热开始: {self._status['mode']}, 并发={concurrency}, 限速={rate_limit}/s")
+
+            # 第一页同时获取总数
+            limiter.wait()
+            first_page = self._fetch_page(plan, 0, min_date)
+            total = first_page.get('TotalRecordCount', 0) or 0
+            self._update(total=total)
+            self._store_page(first_page.get('Items') or [])
+
+            offsets = range(self.PAGE_SIZE, total, self.PAGE_SIZE)
+
+            def crawl_page(start_index):
+                if self._stop_event.is_set():
+                    return
+                limiter.wait()
+                try:
+                    page = self._fetch_page(plan, start_index, min_date)
+                except Exception as e:
+                    logger.warning(f"⚠️ 媒体库预热分页失败: StartIndex={start_index}, {e}")
+                    with self._lock:
+                        self._status['failed_pages'] += 1
+                    return
+                self._store_page(page.get('Items') or [])
+
+            with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='LibraryCrawl') as pool:
+                list(pool.map(crawl_page, offsets))
+
+            stopped = self._stop_event.is_set()
+            failed = self._status['failed_pages']
+            state = 'stopped' if stopped else 'completed'
+            self._update(state=state, finished_at=int(time.time()))
+
+            last_run = self.get_last_run()
+            last_run.update({
+                'last_started_at': started_at,
+                'last_finished_at': int(time.time()),
+                'last_state': state,
+                'last_mode': self._status['mode'],
+                'last_written': self._status['written']
+            })
+            # 只有完整成功的运行才能作为下次增量的起点
+            if not stopped and not failed:
+                last_run['last_success_started_at'] = started_at
+            self.db.set_config_value(CRAWL_STATE_KEY, json.dumps(last_run), '媒体库预热运行记录')
+
+            logger.info(f"✅ 媒体库预热{('已停止' if stopped else '完成')}: "
+                        f"{self._status['processed']}/{total} 个条目, 写入 {self._status['written']} 条路径")
+
+        except Exception as e:
+            logger.error(f"❌ 媒体库预热失败: {e}")
+            self._update(state='failed', error=str(e), finished_at=int(time.time()))
+
+    def _fetch_page(self, plan, start_index, min_date):
+        emby_server = plan.emby_server
+        if emby_server.endswith('/emby'):
+            items_url = f"{emby_server}/Items"
+        else:
+            items_url = f"{emby_server}/emby/Items"
+
+        params = {
+            'Recursive': 'true',
+            'IncludeItemTypes': self.ITEM_TYPES,
+            'Fields': 'Path,MediaSources',
+            'StartIndex': start_index,
+            'Limit': self.PAGE_SIZE,
+            'EnableImages': 'false',
+            'EnableUserData': 'false',
+            'api_key': plan.api_key
+        }
+        if min_date:
+            params['MinDateLastSaved'] = datetime.fromtimestamp(min_date, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+
+        session = self._session_getter()
+        resp = session.get(items_url, params=params, timeout=(10, 60), verify=plan.ssl_verify)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Emby API 请求失败: {resp.status_code}")
+        return resp.json() or {}
+
+    def _store_page(self, items):
+        """一页条目的路径在一个事务中写入"""
+        paths = {}
+        for item in items:
+            item_id = str(item.get('Id', ''))
+            if not item_id:
+                continue
+            file_path = select_media_path(item)
+            if file_path:
+                paths[item_id] = file_path
+            # 多版本：媒体源ID单独记录对应文件
+            for ms in item.get('MediaSources') or ():
+                ms_id = str(ms.get('Id', ''))
+                if ms_id and ms_id != item_id and ms.get('Path'):
+                    paths[ms_id] = ms['Path']
+
+        paths = {k: v for k, v in paths.items() if not v.startswith(('http://', 'https://'))}
+        if paths:
+            self._item_path_db.set_many(paths)
+
+        with self._lock:
+            self._status['processed'] += len(items)
+            self._status['written'] += len(paths)
+            self._status['pages'] += 1
+
+    def _update(self, **kwargs):
+        with self._lock:
+            self._status.update(kwargs)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+直链被动验证
+
+直链构建后立即返回，不再同步 HEAD 验证。验证结果来自：
+1. 后台验证线程：直链进入有界队列，由连接池异步 HEAD 验证
+2. 重复请求信号：同一客户端在几秒内反复请求同一条目，说明上一个直链可能无法播放，
+   立即重新验证（拖动进度条也会重复请求，只触发验证，不直接记为失败）
+
+只有后台验证返回 4xx / 5xx 的网盘路径在一段时间内记为失败，只有这些路径才降级到代理下载。
+"""
+
+import time
+import queue
+import logging
+import threading
+
+import httpx
+
+from services.domain_health import get_domain_health_monitor
+from utils.bounded_cache import BoundedCache
+from utils.upstream_client import get_upstream_pool
+
+logger = logging.getLogger(__name__)
+
+
+class DirectLinkValidator:
+    """直链被动验证器"""
+
+    VALIDATE_TIMEOUT = 3.0       # 后台验证超时（秒）
+    VALIDATED_TTL = 600          # 验证通过后多久内不再重复验证（秒）
+    BAD_TTL = 600                # 直链失效（4xx）记忆时间（秒）
+    BAD_TTL_SERVER_ERROR = 60    # CDN 5xx 记忆时间（秒）
+    REREQUEST_WINDOW = 10        # 重复请求判定窗口（秒）
+    QUEUE_SIZE = 256
+
+    OK_STATUS = frozenset({200, 206, 301, 302, 303, 307, 308})
+    BAD_STATUS = frozenset({401, 403, 404, 410})
+
+    def __init__(self):
+        # 网盘路径 → 失败原因
+        self._bad_paths = BoundedCache('direct_link_bad_path', max_size=5000, ttl=self.BAD_TTL)
+        # 网盘路径 → 最近一次验证通过/入队的时间（去重）
+        self._validated = BoundedCache('direct_link_validated', max_size=10000, ttl=self.VALIDATED_TTL)
+        # (客户端, 条目) → 窗口内请求次数
+        self._recent_requests = BoundedCache('direct_link_rerequest', max_size=5000, ttl=self.REREQUEST_WINDOW)
+
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.validated = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rerequest_signals = 0
+
+    # ==================== 查询 ====================
+
+    def is_bad(self, mapped_path):
+        """网盘路径是否为已知失败的直链"""
+        return bool(mapped_path) and mapped_path in self._bad_paths
+
+    def mark_bad(self, mapped_path, reason, ttl=None):
+        if mapped_path not in self._bad_paths:
+            logger.warning(f"🚫 直链标记失败: {mapped_path} ({reason})，后续请求降级到代理下载")
+        self._bad_paths.set(mapped_path, reason, ttl=ttl)
+        self._validated.pop(mapped_path)
+
+    def mark_good(self, mapped_path):
+        if self._bad_paths.pop(mapped_path) is not None:
+            logger.info(f"✅ 直链恢复: {mapped_path}")
+        self._validated.set(mapped_path, time.time())
+
+    # ==================== 信号 ====================
+
+    def submit(self, mapped_path, direct_url, force=False):
+        """
+        提交后台验证（不阻塞；最近验证过的路径跳过，队列已满时丢弃）
+
+        :param force: 忽略去重立即验证（重复请求信号）
+        """
+        if not mapped_path or not direct_url:
+            return False
+        if not force and mapped_path in self._validated:
+            return False
+        self._validated.set(mapped_path, time.time())
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((mapped_path, direct_url))
+            return True
+        except queue.Full:
+            self._validated.pop(mapped_path)
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def note_request(self, client_key, item_id, mapped_path=None, direct_url=None):
+        """
+        记录一次播放请求，检测同一客户端的重复请求
+
+        窗口内再次请求时立即重新验证（是否失败以验证结果为准）
+
+        :return: 窗口内的请求次数
+        """
+        if not client_key or not item_id:
+            return 0
+        key = (client_key, item_id)
+        with self._lock:
+            count = (self._recent_requests.get(key) or 0) + 1
+            self._recent_requests.set(key, count)
+
+        if count >= 2 and mapped_path and not self.is_bad(mapped_path):
+            with self._lock:
+                self.rerequest_signals += 1
+            if direct_url:
+                logger.debug(f"🔁 重复请求，重新验证直链: {mapped_path}")
+                self.submit(mapped_path, direct_url, force=True)
+            else:
+                # 没有上一个直链：清除去重，本次构建的直链会重新验证
+                self._validated.pop(mapped_path)
+        return count
+
+    # ==================== 后台验证 ====================
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True, name='DirectLinkValidator')
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            mapped_path, direct_url = self._queue.get()
+            try:
+                self._validate(mapped_path, direct_url)
+            except Exception as e:
+                logger.debug(f"⚠️ 直链验证异常: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _validate(self, mapped_path, direct_url):
+        monitor = get_domain_health_monitor()
+        start = time.perf_counter()
+        try:
+            # 与代理下载共用 CDN 长连接
+            response = get_upstream_pool().request('HEAD', direct_url, timeout=self.VALIDATE_TIMEOUT)
+        except httpx.HTTPError as e:
+            # 连接类错误属于域名问题，计入域名健康状态，不记为路径失败
+            logger.debug(f"⚠️ 直链验证请求失败: {e.__class__.__name__}")
+            monitor.record_url_result(direct_url, False, error=e.__class__.__name__)
+            self._validated.pop(mapped_path)
+            return
+
+        status = response.status_code
+        if status >= 500:
+            monitor.record_url_result(direct_url, False, error=f"HTTP {status}")
+        else:
+            monitor.record_url_result(direct_url, True, (time.perf_counter() - start) * 1000)
+        with self._lock:
+            self.validated += 1
+        if status in self.OK_STATUS:
+            self.mark_good(mapped_path)
+        elif status in self.BAD_STATUS or status >= 500:
+            with self._lock:
+                self.failed += 1
+            ttl = self.BAD_TTL_SERVER_ERROR if status >= 500 else None
+            self.mark_bad(mapped_path, f"HTTP {status}", ttl=ttl)
+        else:
+            logger.debug(f"⚠️ 直链验证返回: HTTP {status}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'validated': self.validated,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'rerequest_signals': self.rerequest_signals,
+                'bad_paths': len(self._bad_paths)
+            }
+
+
+# 全局实例
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_link_validator():
+    """获取全局直链验证器实例"""
+    global _validator
+    if _validator is None:
+        with _validator_lock:
+            if _validator is None:
+                _validator = DirectLinkValidator()
+    return _validator
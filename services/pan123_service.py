@@ -26,6 +26,13 @@ if not logger.handlers:
 
 from utils.url_auth import URLAuthManager
 from utils.cache import CacheManager
+from utils.singleflight import SingleFlight
+from services.domain_health import get_domain_health_monitor, domain_base_url
+from services.link_validator import get_link_validator
+from services.block_cache import build_proxy_download_query
+
+# 同一网盘路径的并发直链解析合并（搜索/API 查询只执行一次）
+_direct_link_flight = SingleFlight('pan123_direct_link', share_window=2.0)
 
 
 class Pan123Service:
@@ -37,7 +44,27 @@ class Pan123Service:
         self.auth_manager = URLAuthManager()
         self.cache = CacheManager()
     
-    def get_file_direct_link(self, file_name, mapped_path=None):
+    @staticmethod
+    def direct_link_cache_key(mapped_path, download_mode):
+        """直链缓存键（按映射路径缓存，避免同名冲突；v2 为签名逻辑版本）"""
+        return f"123:{mapped_path}:{download_mode}:v2"
+
+    def get_file_direct_link(self, file_name, mapped_path=None, mount_path=None, download_mode=None):
+        """
+        获取文件直链（同一路径的并发请求合并为一次解析，共享结果）
+
+        参数见 _get_file_direct_link
+        """
+        if not mapped_path:
+            return None
+
+        download_mode = download_mode or self.config.get('123', {}).get('download_mode', 'direct')
+        flight_key = f"{mapped_path}:{download_mode}:{mount_path or ''}"
+        return _direct_link_flight.do(
+            flight_key, self._get_file_direct_link, file_name, mapped_path, mount_path, download_mode
+        )
+
+    def _get_file_direct_link(self, file_name, mapped_path=None, mount_path=None, download_mode=None):
         """
         获取文件直链（支持直链模式和代理模式切换）
         
@@ -48,6 +75,8 @@ class Pan123Service:
         
         :param file_name: 文件名
         :param mapped_path: 映射后的路径
+        :param mount_path: 映射规则指定的挂载前缀（默认 123.mount_path）
+        :param download_mode: 映射规则指定的下载模式（默认 123.download_mode）
         :return: 文件信息（包含raw_url）
         """
         
@@ -56,12 +85,12 @@ class Pan123Service:
             return None
 
         # 检查下载模式设置
-        download_mode = self.config.get('123', {}).get('download_mode', 'direct')
+        download_mode = download_mode or self.config.get('123', {}).get('download_mode', 'direct')
 
         # 第0步：命中直链短期缓存（按映射路径缓存，避免同名冲突）
         # 注意：直链模式（域名+路径）不缓存，代理模式才缓存（避免频繁API查询）
         # 添加版本标识，确保签名逻辑更新后不使用旧缓存
-        cache_key = f"123:{mapped_path}:{download_mode}:v2"
+        cache_key = self.direct_link_cache_key(mapped_path, download_mode)
         
         # 只有代理模式才使用缓存
         if download_mode == 'proxy' and self.cache.is_direct_link_valid(cache_key):
@@ -97,7 +126,7 @@ class Pan123Service:
                     logger.warning("⚠️ 未启用URL鉴权或未配置自定义域名，降级到代理下载")
                     return self._get_proxied_download_link(file_name, mapped_path)
                 
-                direct_url = self._build_url_from_domain_and_path(mapped_path)
+                direct_url = self._build_url_from_domain_and_path(mapped_path, mount_path)
                 if not direct_url:
                     logger.warning("⚠️ 域名直出失败，降级到代理下载")
                     return self._get_proxied_download_link(file_name, mapped_path)
@@ -105,12 +134,12 @@ class Pan123Service:
                 # 第二步：添加URL鉴权
                 direct_url = self._add_url_auth(direct_url)
                 
-                # 第三步：快速直链验证（优化超时时间）
-                if self._quick_validate_direct_url(direct_url):
-                    logger.info(f"✅ 直连验证成功: {file_name}")
-                else:
-                    logger.warning(f"⚠️ 直连验证失败，快速降级到代理下载")
+                # 第三步：被动验证（立即返回直链，后台异步验证；只有已知失败的路径才降级）
+                validator = get_link_validator()
+                if validator.is_bad(mapped_path):
+                    logger.warning(f"⚠️ 直链已知失败，快速降级到代理下载: {file_name}")
                     return self._get_fast_proxied_download_link(file_name, mapped_path)
+                validator.submit(mapped_path, direct_url)
 
                 # 第四步：直链模式不需要缓存（域名+路径构建很快）
                 # 只在上层Emby代理中缓存最终结果，避免重复查询Emby API
@@ -175,7 +204,7 @@ class Pan123Service:
                 return None
 
             # 通过代理方式处理下载链接
-            proxied_url = self._proxy_download_url(download_url)
+            proxied_url = self._proxy_download_url(download_url, file_id)
 
             # 不缓存代理链接，因为代理链接容易失效
             # 代理链接通过服务器转发，链接本身不会失效，但内容链接可能失效
@@ -196,18 +225,17 @@ class Pan123Service:
             logger.error(f"❌ 代理下载链接获取异常: {e}")
             return None
 
-    def _proxy_download_url(self, download_url):
+    def _proxy_download_url(self, download_url, file_id=None):
         """
         对下载链接进行代理处理 - 返回完整的代理URL
         
         :param download_url: 原始下载链接
+        :param file_id: 123网盘 FileId（作为分块缓存的文件标识，签名直链每次都会变化）
         :return: 代理后的下载链接（完整URL）
         """
         try:
-            from urllib.parse import quote
-            
             # ⚠️ 关键：对原始下载链接进行URL编码，避免参数混淆
-            encoded_url = quote(download_url, safe='')
+            query = build_proxy_download_query(download_url, f"123:{file_id}" if file_id else None)
             
             # 动态读取Emby反向代理端口配置
             emby_config = self.config.get('emby', {})
@@ -226,7 +254,7 @@ class Pan123Service:
                 # 使用配置的外部访问地址（推荐）
                 # 例如: http://your-server.com:5245 或 https://your-domain.com
                 base_url = external_url.rstrip('/')
-                proxied_url = f"{base_url}/proxy/download?url={encoded_url}"
+                proxied_url = f"{base_url}/proxy/download?{query}"
                 logger.info(f"🔄 使用外部地址生成代理URL: {proxied_url[:80]}...")
             else:
                 # 如果没有配置外部地址，使用请求头中的Host（自动检测）
@@ -239,15 +267,15 @@ class Pan123Service:
                         # 使用Emby代理端口
                         if ':' in host:
                             host = host.split(':')[0]
-                        proxied_url = f"{scheme}://{host}:{port}/proxy/download?url={encoded_url}"
+                        proxied_url = f"{scheme}://{host}:{port}/proxy/download?{query}"
                         logger.info(f"🔄 使用Emby代理端口生成代理URL: {proxied_url[:80]}...")
                     else:
                         # 回退：使用localhost的Emby代理端口
-                        proxied_url = f"http://localhost:{port}/proxy/download?url={encoded_url}"
+                        proxied_url = f"http://localhost:{port}/proxy/download?{query}"
                         logger.info(f"🔄 回退使用localhost Emby代理端口: {proxied_url[:80]}...")
                 except Exception as e:
                     # 回退：使用localhost的Emby代理端口
-                    proxied_url = f"http://localhost:{port}/proxy/download?url={encoded_url}"
+                    proxied_url = f"http://localhost:{port}/proxy/download?{query}"
                     logger.info(f"🔄 地址检测失败，使用localhost Emby代理端口: {e}")
             
             return proxied_url
@@ -256,30 +284,6 @@ class Pan123Service:
             logger.error(f"❌ 代理下载链接生成异常: {e}")
             return download_url
     
-    def _quick_validate_direct_url(self, direct_url):
-        """快速验证直连URL（0.8秒超时）"""
-        try:
-            import requests
-            logger.debug(f"🧪 快速验证直连: {direct_url[:60]}...")
-            
-            # 使用很短的超时时间进行快速验证
-            response = requests.head(direct_url, timeout=0.8, allow_redirects=False)
-            
-            # 200, 206, 302, 301都认为是成功
-            if response.status_code in [200, 206, 301, 302]:
-                logger.debug(f"✅ 直连验证通过: HTTP {response.status_code}")
-                return True
-            else:
-                logger.debug(f"⚠️ 直连返回: HTTP {response.status_code}")
-                return False
-                
-        except requests.exceptions.Timeout:
-            logger.debug(f"⚠️ 直连验证超时(0.8s)")
-            return False
-        except Exception as e:
-            logger.debug(f"⚠️ 直连验证异常: {e}")
-            return False
-    
     def _get_fast_proxied_download_link(self, file_name, mapped_path=None):
         """快速获取代理下载链接（优化版本）"""
         try:
@@ -294,7 +298,7 @@ class Pan123Service:
                 download_url = self.client.download_url({'FileID': file_id})
                 
                 if download_url:
-                    proxied_url = self._proxy_download_url(download_url)
+                    proxied_url = self._proxy_download_url(download_url, file_id)
                     
                     return {
                         'name': file_name,
@@ -336,7 +340,7 @@ class Pan123Service:
                         download_url = self.client.download_url({'FileID': file_id})
                         
                         if download_url:
-                            proxied_url = self._proxy_download_url(download_url)
+                            proxied_url = self._proxy_download_url(download_url, file_id)
                             
                             return {
                                 'name': file_name,
@@ -393,11 +397,11 @@ class Pan123Service:
         except Exception:
             return False
 
-    def _build_url_from_domain_and_path(self, mapped_path):
+    def _build_url_from_domain_and_path(self, mapped_path, mount_path=None):
         """使用自定义域名 + 网盘映射路径直接构造直链URL"""
         try:
             # mapped_path 形如: /123/dy/... 需去除挂载前缀
-            mount = (self.config.get('123', {}) or {}).get('mount_path', '/123')
+            mount = mount_path or (self.config.get('123', {}) or {}).get('mount_path', '/123')
             path_part = mapped_path
             if mount and mapped_path.startswith(mount):
                 path_part = mapped_path[len(mount):]
@@ -408,12 +412,13 @@ class Pan123Service:
             domains = auth_cfg.get('custom_domains', []) or []
             if not domains:
                 return None
-            domain = domains[0].strip().rstrip('/')
-            if domain.startswith('http://') or domain.startswith('https://'):
-                base = domain
-            else:
-                base = f"https://{domain}"
-            return f"{base}{path_part}"
+            # 按策略选择域名，跳过已熔断的域名
+            domain = get_domain_health_monitor().choose_domain(
+                domains, auth_cfg.get('domain_strategy') or 'latency', mapped_path, auth_cfg.get('domain_weights')
+            )
+            if not domain:
+                return None
+            return f"{domain_base_url(domain)}{path_part}"
         except Exception:
             return None
     
@@ -471,6 +476,7 @@ class Pan123Service:
         secret_key = auth_config.get('secret_key')
         uid = auth_config.get('uid')
         expire_time = auth_config.get('expire_time', 3600)
+        bucket_seconds = auth_config.get('bucket_seconds', 300)
         
         if not (secret_key and uid):
             logger.warning(f"⚠️ URL鉴权已启用但缺少配置")
@@ -478,7 +484,7 @@ class Pan123Service:
         
         # 添加签名
         logger.debug(f"🔐 添加URL鉴权签名...")
-        auth_url = self.auth_manager.add_auth_to_url(url, secret_key, uid, expire_time)
+        auth_url = self.auth_manager.add_auth_to_url(url, secret_key, uid, expire_time, bucket_seconds)
         
         return auth_url
     
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理模式下载的顺序预读与并行分段拉取
+
+不预读时 /proxy/download 只按客户端的消费速度从 CDN 读取，CDN 的任何抖动都会
+直接变成播放卡顿；而且 123 CDN 对单个连接限速，一条上游连接往往跑不满出口带宽。
+读取器把请求范围切成连续的段（段边界与分块缓存的块边界对齐），在后台线程中拉取：
+
+顺序预读（stream.read_ahead_enable）：
+- 顺序判定：本次请求已被顺序消费一段，或接续同一客户端上一次请求的结束位置，才开始预读
+  （播放器开播时的探测请求、跳到文件尾读索引的请求不会触发）
+- 预读窗口：read_ahead_seconds × 客户端实测消费速度，不超过 read_ahead_max_mb
+
+并行分段拉取（stream.parallel_fetch_enable）：
+- 同时对签名直链发起多个子范围请求，按顺序拼接后返回客户端
+- 连接数自适应：从 2 条开始，客户端在等数据时逐条增加；增加连接后总吞吐没有提升
+  （瓶颈不在单连接限速）就退回并停止增加，上限 parallel_max_connections
+- 段大小自适应：按单连接实测速度让每段约 SEGMENT_SECONDS 秒拉完（块大小的整数倍）
+- 同一文件所有请求的上游连接合计不超过 parallel_file_connections
+
+共同约束：
+- 全局内存上限：所有流已拉取未消费的段合计不超过 read_ahead_memory_mb，超出时暂停预读
+- 客户端断开时立即取消；拖动（同一客户端对同一文件发起不连续的新请求）时丢弃旧请求
+  已预读的段并停止其预读（旧请求本身继续按需读取），后台拉取在下一个数据块处停止
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.bounded_cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+READ_AHEAD_CONNECTIONS = 2      # 只开预读时每个流的并发段数
+PARALLEL_INITIAL_CONNECTIONS = 2
+SEGMENT_SECONDS = 1             # 并行拉取时每段的目标拉取时间
+MAX_SEGMENT_BLOCKS = 4          # 段大小上限（块数）
+SCALE_GAIN = 1.1                # 增加一条连接后总吞吐至少提升 10% 才保留
+
+# 后台拉取线程池（所有流共享）
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='ReadAhead')
+
+
+class PrefetchMemory:
+    """全局预读内存预算（已拉取、尚未被客户端消费的字节）"""
+
+    def __init__(self):
+        self._used = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def try_acquire(self, size, limit):
+        with self._lock:
+            if self._used + size > limit:
+                self.rejected += 1
+                return False
+            self._used += size
+            return True
+
+    def acquire(self, size):
+        """当前段（客户端正在等待）不受上限约束，但计入占用"""
+        with self._lock:
+            self._used += size
+
+    def release(self, size):
+        with self._lock:
+            self._used -= size
+
+    @property
+    def used(self):
+        return self._used
+
+
+_memory = PrefetchMemory()
+
+# 读取器注册表：(文件标识, 客户端) → 当前读取器（拖动时丢弃旧读取器的预读）
+_readers = {}
+_readers_lock = threading.Lock()
+# (文件标识, 客户端) → 上一次请求的结束位置（判断新请求是否接续）
+_positions = BoundedCache('read_ahead_positions', max_size=2000, ttl=120)
+# 文件标识 → 正在拉取的上游连接数（并行拉取的单文件上限）
+_file_connections = {}
+
+_stats = {'streams': 0, 'active': 0, 'prefetched_segments': 0, 'prefetched_bytes': 0,
+          'inline_segments': 0, 'stalls': 0, 'dropped_segments': 0, 'cancelled': 0,
+          'connections': 0, 'scale_ups': 0, 'scale_downs': 0, 'file_cap_waits': 0}
+_stats_lock = threading.Lock()
+_connection_rate = [None]       # 单连接速度 EWMA（字节/秒）
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for key, delta in deltas.items():
+            _stats[key] += delta
+
+
+def _record_connection_rate(rate):
+    with _stats_lock:
+        if _connection_rate[0] is None:
+            _connection_rate[0] = rate
+        else:
+            _connection_rate[0] += 0.2 * (rate - _connection_rate[0])
+
+
+def _acquire_file_connection(file_key, limit, force=False):
+    """占用文件的一条上游连接；force 用于客户端正在等待的段（不受上限约束）"""
+    with _readers_lock:
+        used = _file_connections.get(file_key, 0)
+        if used >= limit and not force:
+            return False
+        _file_connections[file_key] = used + 1
+        return True
+
+
+def _release_file_connection(file_key):
+    with _readers_lock:
+        used = _file_connections.get(file_key, 0) - 1
+        if used > 0:
+            _file_connections[file_key] = used
+        else:
+            _file_connections.pop(file_key, None)
+
+
+def get_read_ahead_stats():
+    """获取预读 / 并行拉取统计"""
+    with _stats_lock:
+        stats = dict(_stats)
+        rate = _connection_rate[0]
+    stats['memory_bytes'] = _memory.used
+    stats['memory_rejected'] = _memory.rejected
+    stats['connection_rate_mbps'] = round(rate * 8 / 1e6, 1) if rate is not None else None
+    return stats
+
+
+class _Segment:
+    """一段上游数据 [start, stop)"""
+
+    __slots__ = ('start', 'stop', 'buffer', 'consumed', 'done', 'error', 'reserved', 'prefetched',
+                 'cancelled')
+
+    def __init__(self, start, stop, reserved, prefetched):
+        self.start = start
+        self.stop = stop
+        self.buffer = bytearray()
+        self.consumed = 0
+        self.done = False
+        self.error = None
+        self.reserved = reserved
+        self.prefetched = prefetched
+        self.cancelled = False
+
+
+class ReadAheadReader:
+    """
+    分段读取器：后台拉取 [start, stop) 的上游数据，按顺序产出
+
+    用法：
+        reader = ReadAheadReader(open_range, start, stop, plan, segment_size, key=..., client=...)
+        for chunk in reader: ...
+        reader.close()
+    """
+
+    def __init__(self, open_range, start, stop, plan, segment_size, initial=None, key=None, client=None):
+        """
+        :param open_range: open_range(start, stop) → 流式上游响应（httpx，调用方负责 Range 头和校验）
+        :param start: 起始偏移
+        :param stop: 结束偏移（不含）
+        :param plan: RoutingPlan（预读窗口、并行连接数和内存上限）
+        :param segment_size: 基础段大小（与分块缓存的块大小一致，段边界与块边界对齐）
+        :param initial: 已打开的、从 start 开始的上游响应（用作第一段的数据源）
+        :param key: 文件标识（拖动检测、接续判断和单文件连接上限）
+        :param client: 客户端标识（IP）
+        """
+        self.open_range = open_range
+        self.start = start
+        self.stop = stop
+        self.plan = plan
+        self.base_size = segment_size
+        self.segment_size = segment_size    # 当前段大小（并行拉取时随单连接速度调整）
+        self._initial = initial
+        self._file_key = key or id(self)
+        self._reader_key = (key, client) if key else None
+
+        self.parallel = plan.parallel_fetch_enable
+        if self.parallel:
+            self.max_connections = plan.parallel_max_connections
+            self.connections = min(PARALLEL_INITIAL_CONNECTIONS, self.max_connections)
+        else:
+            self.max_connections = self.connections = READ_AHEAD_CONNECTIONS
+
+        self._segments = deque()   # 按顺序排列的段，队首包含当前位置
+        self._scheduled = start    # 已创建段的结束位置
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._cancelled = False
+        self._closed = False
+        self.position = start
+
+        self._started_at = None
+        self._consumed = 0
+        self._connection_rate = None
+        self._probe = None          # (增加连接前的连接数, 当时的总吞吐)
+        self._probe_frozen = False
+        self._reset_epoch()
+
+        # 并行拉取立即开始；只开预读时接续同一客户端上一次请求才立即开始
+        self.prefetching = self.parallel or (
+            self._reader_key is not None and self._continues(_positions.get(self._reader_key))
+        )
+        self._register()
+        _count(streams=1, active=1)
+
+    # ==================== 注册 / 取消 ====================
+
+    def _register(self):
+        if self._reader_key is None:
+            return
+        with _readers_lock:
+            previous = _readers.get(self._reader_key)
+            _readers[self._reader_key] = self
+        if previous is not None and not self._continues(previous.position):
+            # 同一客户端对同一文件发起了不连续的请求：拖动，旧读取器的预读作废
+            previous.drop_prefetch()
+
+    def _continues(self, position):
+        """position 是否在本次起点所在的段内（分块缓存的上游请求从块边界开始，可能早于上次的结束位置）"""
+        return position is not None and 0 <= position - self.start <= self.base_size
+
+    def drop_prefetch(self):
+        """停止预读并丢弃当前段之后的所有段"""
+        with self._cond:
+            self.prefetching = False
+            dropped = list(self._segments)[1:]
+            for segment in dropped:
+                segment.cancelled = True
+                self._segments.pop()
+                self._release(segment)
+            if dropped:
+                self._scheduled = self._segments[0].stop
+        if dropped:
+            _count(dropped_segments=len(dropped))
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.cancel()
+        with self._cond:
+            segments = list(self._segments)
+            self._segments.clear()
+        for segment in segments:
+            self._release(segment)
+        if self._initial is not None:
+            self._initial.close()
+            self._initial = None
+        if self._reader_key is not None:
+            with _readers_lock:
+                if _readers.get(self._reader_key) is self:
+                    del _readers[self._reader_key]
+            _positions.set(self._reader_key, self.position)
+        _count(active=-1, cancelled=1 if self.position < self.stop else 0)
+
+    # ==================== 调度 ====================
+
+    def _segment_stop(self, offset):
+        """从 offset 开始的新段的结束位置（对齐到块边界）"""
+        return min(self.stop, (offset // self.base_size) * self.base_size + self.segment_size)
+
+    def _window_bytes(self):
+        """拉取窗口：并行拉取至少让每条连接有一段；预读按 read_ahead_seconds × 实测消费速度"""
+        window = self.connections * self.segment_size if self.parallel else self.segment_size
+        if self.plan.read_ahead_enable:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0
+            rate = self._consumed / elapsed if elapsed > 1 else 0
+            window = max(window, min(rate * self.plan.read_ahead_seconds, self.plan.read_ahead_max_bytes))
+        return window
+
+    def _submit(self, seg_stop, prefetch):
+        """创建下一段并交给后台线程拉取（调用方持有 _cond）"""
+        seg_start = self._scheduled
+        size = seg_stop - seg_start
+        if prefetch:
+            if not _acquire_file_connection(self._file_key, self.plan.parallel_file_connections):
+                _count(file_cap_waits=1)
+                return None
+            if not _memory.try_acquire(size, self.plan.read_ahead_memory_bytes):
+                _release_file_connection(self._file_key)
+                return None
+        else:
+            _acquire_file_connection(self._file_key, self.plan.parallel_file_connections, force=True)
+            _memory.acquire(size)
+        segment = _Segment(seg_start, seg_stop, size, prefetch)
+        self._segments.append(segment)
+        self._scheduled = seg_stop
+        self._inflight += 1
+        source = None
+        if self._initial is not None and seg_start == self.start:
+            source, self._initial = self._initial, None
+        _executor.submit(self._fill, segment, source)
+        return segment
+
+    def _schedule_ahead(self):
+        """在连接数和窗口允许的范围内继续拉取后续段（调用方持有 _cond）"""
+        if not self.prefetching or self._cancelled:
+            return
+        limit = min(self.stop, self.position + self._window_bytes())
+        while self._scheduled < limit and self._inflight < self.connections:
+            if self._submit(self._segment_stop(self._scheduled), prefetch=True) is None:
+                return  # 单文件连接数或全局预读内存已满，等其他段完成后再继续
+
+    def _fill(self, segment, source=None):
+        """后台线程：拉取一段数据"""
+        response = source
+        started = time.monotonic()
+        size = segment.stop - segment.start
+        complete = False
+        _count(connections=1)
+        try:
+            if response is None:
+                response = self.open_range(segment.start, segment.stop)
+            for chunk in response.iter_raw():
+                if self._cancelled or segment.cancelled:
+                    break
+                with self._cond:
+                    take = min(len(chunk), size - len(segment.buffer))
+                    segment.buffer += chunk[:take]
+                    self._cond.notify_all()
+                if len(segment.buffer) >= size:
+                    break
+            if not (self._cancelled or segment.cancelled):
+                if len(segment.buffer) < size:
+                    raise ConnectionError(f"上游提前结束: {segment.start + len(segment.buffer)}/{segment.stop}")
+                complete = True
+                if segment.prefetched:
+                    _count(prefetched_segments=1, prefetched_bytes=size)
+        except Exception as e:
+            segment.error = e
+        finally:
+            if response is not None:
+                response.close()
+            _count(connections=-1)
+            _release_file_connection(self._file_key)
+            with self._cond:
+                segment.done = True
+                self._inflight -= 1
+                if complete:
+                    self._adapt(size, time.monotonic() - started)
+                self._schedule_ahead()
+                self._cond.notify_all()
+
+    def _release(self, segment):
+        if segment.reserved:
+            _memory.release(segment.reserved)
+            segment.reserved = 0
+
+    # ==================== 自适应 ====================
+
+    def _reset_epoch(self):
+        self._epoch_started = time.monotonic()
+        self._epoch_bytes = 0
+        self._epoch_segments = 0
+        self._epoch_waits = 0
+
+    def _adapt(self, size, elapsed):
+        """一段拉取完成后调整段大小和连接数（调用方持有 _cond）"""
+        rate = size / max(elapsed, 0.001)
+        _record_connection_rate(rate)
+        if self._connection_rate is None:
+            self._connection_rate = rate
+        else:
+            self._connection_rate += 0.3 * (rate - self._connection_rate)
+        if not self.parallel:
+            return
+
+        # 段大小：单连接约 SEGMENT_SECONDS 秒拉完一段，段越大请求开销占比越小
+        blocks = int(self._connection_rate * SEGMENT_SECONDS // self.base_size)
+        self.segment_size = self.base_size * min(max(blocks, 1), MAX_SEGMENT_BLOCKS)
+
+        # 连接数：每轮（每条连接约完成一段）比较一次总吞吐
+        self._epoch_bytes += size
+        self._epoch_segments += 1
+        if self._epoch_segments < self.connections:
+            return
+        aggregate = self._epoch_bytes / max(time.monotonic() - self._epoch_started, 0.001)
+        if self._probe is not None and self.connections > self._probe[0] and aggregate < self._probe[1] * SCALE_GAIN:
+            # 增加连接没有带来吞吐提升（瓶颈在 CDN 总带宽或本机出口），退回并停止增加
+            self.connections = self._probe[0]
+            self._probe_frozen = True
+            _count(scale_downs=1)
+        elif self._epoch_waits and not self._probe_frozen and self.connections < self.max_connections:
+            # 客户端在等数据：上游是瓶颈，再加一条连接
+            self._probe = (self.connections, aggregate)
+            self.connections += 1
+            _count(scale_ups=1)
+        self._reset_epoch()
+
+    # ==================== 消费 ====================
+
+    def __iter__(self):
+        self._started_at = time.monotonic()
+        try:
+            while self.position < self.stop:
+                with self._cond:
+                    if not self._segments:
+                        # 客户端追上了预读（或尚未开始预读）：当前段立即拉取
+                        self._scheduled = self.position
+                        self._submit(self._segment_stop(self.position), prefetch=False)
+                        _count(**{'stalls' if self.prefetching else 'inline_segments': 1})
+                    segment = self._segments[0]
+                    self._schedule_ahead()
+
+                    if segment.consumed >= len(segment.buffer) and not segment.done:
+                        self._epoch_waits += 1
+                    while (segment.consumed >= len(segment.buffer) and not segment.done
+                           and not self._cancelled):
+                        self._cond.wait()
+                    if self._cancelled:
+                        return
+                    if segment.consumed < len(segment.buffer):
+                        chunk = bytes(segment.buffer[segment.consumed:])
+                        segment.consumed += len(chunk)
+                    elif segment.error is not None:
+                        raise segment.error
+                    else:
+                        chunk = b''
+
+                    if segment.consumed >= segment.stop - segment.start:
+                        self._segments.popleft()
+                        segment.buffer = bytearray()
+                        self._release(segment)
+
+                if chunk:
+                    self.position += len(chunk)
+                    self._consumed += len(chunk)
+                    if not self.prefetching and self._consumed >= self.base_size:
+                        self.prefetching = True  # 已顺序消费一段，开始预读
+                    yield chunk
+        finally:
+            self.close()
+
+
+def read_ahead_enabled(plan, start, stop, segment_size):
+    """开启预读或并行拉取、且范围跨越段边界时才分段拉取（只在一段内的请求直接读取）"""
+    return ((plan.read_ahead_enable or plan.parallel_fetch_enable)
+            and (stop - 1) // segment_size > start // segment_size)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预解析（推测执行）
+
+根据代理流量预测下一次播放请求，在后台提前完成 Emby 查询、路径映射和直链签名，
+真正的 /videos/{id}/stream 请求直接命中永久路径数据库和 Item 直链缓存：
+1. 详情页 GET /Users/{uid}/Items/{id}：解析该条目 + 后续 N 集
+2. POST /Items/{id}/PlaybackInfo：解析后续 N 集（当前条目马上就会请求）
+3. POST /Sessions/Playing/Stopped：解析刚停止条目的后续 N 集
+
+工作队列有界，队列满时丢弃；开关和剧集数见 emby.speculative_enable / speculative_episodes。
+"""
+
+import os
+import re
+import json
+import queue
+import logging
+import threading
+
+from models.config import ConfigManager
+from services.emby_items_resolver import select_media_path
+from utils.bounded_cache import BoundedCache
+from utils.routing_plan import get_routing_plan
+
+logger = logging.getLogger(__name__)
+
+_DETAIL_RE = re.compile(r'/Users/[^/]+/Items/(\d+)/?$', re.IGNORECASE)
+_PLAYBACK_INFO_RE = re.compile(r'/Items/(\d+)/PlaybackInfo', re.IGNORECASE)
+
+# 任务类型
+TASK_ITEM = 'item'    # 解析条目本身 + 后续剧集
+TASK_NEXT = 'next'    # 只解析后续剧集
+
+
+class SpeculativeResolver:
+    """预解析器（单个后台线程 + 有界队列）"""
+
+    QUEUE_SIZE = 64
+    DEDUPE_TTL = 120  # 同一条目的同类任务多久内不重复入队（秒）
+
+    def __init__(self, proxy_service):
+        """
+        :param proxy_service: EmbyProxyService（复用其 Items 批量查询、路径映射、直链构建和缓存）
+        """
+        self.proxy_service = proxy_service
+        self.config_manager = ConfigManager()
+
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._recent = BoundedCache('speculative_recent', max_size=2000, ttl=self.DEDUPE_TTL)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.items_warmed = 0
+        self.errors = 0
+
+    # ==================== 观察流量 ====================
+
+    def observe(self, plan, method, path, get_body=None):
+        """
+        观察一个代理请求，命中预测规则时入队（只做字符串判断，不阻塞）
+
+        :param get_body: 返回请求体的函数（只在播放停止上报时调用）
+        """
+        if not plan.speculative_enable or not plan.api_key:
+            return
+
+        if method == 'GET' and '/Items/' in path:
+            match = _DETAIL_RE.search(path)
+            if match:
+                self.submit(TASK_ITEM, match.group(1))
+        elif method == 'POST':
+            if 'PlaybackInfo' in path:
+                match = _PLAYBACK_INFO_RE.search(path)
+                if match:
+                    self.submit(TASK_NEXT, match.group(1))
+            elif path.lower().endswith('/sessions/playing/stopped') and get_body is not None:
+                try:
+                    item_id = str((json.loads(get_body() or b'{}') or {}).get('ItemId') or '')
+                except (ValueError, AttributeError):
+                    item_id = ''
+                if item_id.isdigit():
+                    self.submit(TASK_NEXT, item_id)
+
+    def submit(self, kind, item_id):
+        """入队（重复任务跳过，队列满时丢弃）"""
+        key = (kind, item_id)
+        if key in self._recent:
+            return False
+        self._recent.set(key, True)
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(key)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    # ==================== 后台解析 ====================
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True, name='SpeculativeResolver')
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            kind, item_id = self._queue.get()
+            try:
+                plan = get_routing_plan(self.config_manager.get_config_snapshot())
+                if plan.speculative_enable and plan.api_key:
+                    self._run_task(kind, item_id, plan)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.debug(f"⚠️ 预解析失败: {kind}:{item_id} {e}")
+            finally:
+                self._queue.task_done()
+
+    def _run_task(self, kind, item_id, plan):
+        item_data = self.proxy_service.items_resolver.resolve(item_id, plan)
+        if not item_data:
+            return
+        if kind == TASK_ITEM:
+            self._warm_item(item_id, plan, item_data)
+        if plan.speculative_episodes > 0 and item_data.get('Type') == 'Episode':
+            for episode in self._next_episodes(item_data, plan, plan.speculative_episodes):
+                self._warm_item(str(episode.get('Id')), plan, episode)
+
+    def _warm_item(self, item_id, plan, item_data):
+        """预先完成路径映射和直链签名，写入 Item 直链缓存"""
+        if item_id in self.proxy_service.item_path_cache:
+            return False
+
+        file_path = self.proxy_service.item_path_db.get(item_id) or select_media_path(item_data)
+        if not file_path or file_path.startswith(('http://', 'https://')):
+            return False
+
+        match = self.proxy_service.resolve_path_mapping(file_path, plan)
+        if match is None:
+            return False  # 本地资源走代理，无需预解析
+
+        # 只签名并写入缓存，不提交直链验证（后续剧集不一定会播放，播放时再验证）
+        direct_url = self.proxy_service._fast_build_direct_url(
+            match.mapped_path, plan, match.mount_path, match.download_mode, validate=False
+        )
+        if not direct_url:
+            return False
+
+        self.proxy_service.cache_item_link(item_id, file_path, match, direct_url)
+        with self._lock:
+            self.items_warmed += 1
+        logger.debug(f"🔮 预解析完成: {item_id} → {os.path.basename(file_path)}")
+        return True
+
+    def _next_episodes(self, item_data, plan, count):
+        """查询同一季中当前剧集之后的 count 集"""
+        series_id = item_data.get('SeriesId')
+        if not series_id:
+            return []
+
+        emby_server = plan.emby_server
+        if emby_server.endswith('/emby'):
+            episodes_url = f"{emby_server}/Shows/{series_id}/Episodes"
+        else:
+            episodes_url = f"{emby_server}/emby/Shows/{series_id}/Episodes"
+
+        params = {'Fields': 'Path,MediaSources', 'api_key': plan.api_key}
+        if item_data.get('SeasonId'):
+            params['SeasonId'] = item_data['SeasonId']
+
+        session = self.proxy_service.get_emby_session()
+        resp = session.get(episodes_url, params=params, timeout=(10, 30), verify=plan.ssl_verify)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Emby Episodes 请求失败: {resp.status_code}")
+        episodes = (resp.json() or {}).get('Items') or []
+
+        # 缺少集号时按文件名中的 SxxEyy 排序
+        if any(ep.get('IndexNumber') is None for ep in episodes):
+            episodes.sort(key=self._episode_order)
+
+        current_id = str(item_data.get('Id'))
+        for index, episode in enumerate(episodes):
+            if str(episode.get('Id')) == current_id:
+                following = episodes[index + 1:index + 1 + count]
+                paths = {}
+                for ep in following:
+                    file_path = select_media_path(ep)
+                    if file_path and not file_path.startswith(('http://', 'https://')):
+                        paths[str(ep.get('Id'))] = file_path
+                if paths:
+                    self.proxy_service.item_path_db.set_many(paths)
+                return following
+        return []
+
+    def _episode_order(self, episode):
+        season = episode.get('ParentIndexNumber')
+        number = episode.get('IndexNumber')
+        if season is None or number is None:
+            info = self.proxy_service.strm_parser_service.extract_media_info_from_filename(
+                os.path.basename(select_media_path(episode) or '')
+            ) or {}
+            season = season if season is not None else info.get('season')
+            number = number if number is not None else info.get('episode')
+        return (season or 0, number or 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'items_warmed': self.items_warmed,
+                'errors': self.errors
+            }
@@ -183,6 +183,8 @@ function populateConfigForm(config) {
     if (!domainsInput.value || domainsInput.value.trim() === '') {
         domainsInput.value = config['123']?.url_auth?.custom_domains?.join(',') || '';
     }
+
+    document.getElementById('domain-strategy').value = config['123']?.url_auth?.domain_strategy || 'latency';
     
     // 服务配置
     document.getElementById('service-port').value = config.service?.port || 5245;
@@ -225,7 +227,8 @@ async function saveConfig() {
                 secret_key: document.getElementById('secret-key').value.trim(),
                 uid: document.getElementById('uid').value.trim(),
                 expire_time: parseInt(document.getElementById('expire-time').value),
-                custom_domains: document.getElementById('custom-domains').value.split(',').map(d => d.trim()).filter(d => d)
+                custom_domains: document.getElementById('custom-domains').value.split(',').map(d => d.trim()).filter(d => d),
+                domain_strategy: document.getElementById('domain-strategy').value
             }
         },
         service: {
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""services/fanout.py：超前订阅共享拉取的回归测试"""
+
+import os
+import sys
+import time
+import queue
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fanout import FanoutHub, JOIN_AHEAD
+
+CHUNK = 64 * 1024
+CAPACITY = 1024 * 1024      # 小于 JOIN_AHEAD
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+def _start_fetch(hub, data, capacity):
+    """新建共享拉取，上游数据块由测试逐个放入"""
+    size = len(data)
+    fetch, subscriber, created = hub._attach_or_create('k', 0, 0, size, size, None, capacity)
+    assert created
+    feed = queue.Queue()
+    chunks = iter(feed.get, None)
+    threading.Thread(target=fetch.run, args=(chunks, lambda: None), daemon=True).start()
+    return fetch, subscriber, feed
+
+
+def test_join_ahead_is_capped_by_capacity():
+    assert CAPACITY < JOIN_AHEAD
+    data = os.urandom(4 * 1024 * 1024)
+    hub = FanoutHub()
+    fetch, first, feed = _start_fetch(hub, data, CAPACITY)
+    feed.put(data[:CHUNK])
+    _wait_for(lambda: fetch.head == CHUNK)
+
+    assert fetch.can_join(fetch.head + CAPACITY, len(data))
+    assert not fetch.can_join(fetch.head + CAPACITY + 1, len(data))
+
+    fetch.leave(first)
+    feed.put(None)
+
+
+def test_join_ahead_after_chunk_evicted_returns_correct_bytes():
+    data = os.urandom(4 * 1024 * 1024)
+    hub = FanoutHub()
+    fetch, first, feed = _start_fetch(hub, data, CAPACITY)
+    for offset in range(0, 4 * CHUNK, CHUNK):
+        feed.put(data[offset:offset + CHUNK])
+    _wait_for(lambda: fetch.head == 4 * CHUNK)
+
+    # 第二个客户端在已拉取位置之后超过缓冲区容量处订阅（超前距离未按容量限制时的情形）
+    position = fetch.head + 3 * CAPACITY
+    second = fetch.subscribe(position)
+
+    # 第二个客户端读取之前，订阅时记录的数据块已被移出缓冲区
+    for offset in range(4 * CHUNK, len(data), CHUNK):
+        feed.put(data[offset:offset + CHUNK])
+    _wait_for(lambda: fetch.head == len(data))
+    assert second.index < fetch._popped
+
+    received = b''.join(fetch.read(second, len(data)))
+    assert position < len(data)
+    assert received == data[position:]
+
+    fetch.leave(first)
+    fetch.leave(second)
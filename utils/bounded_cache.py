@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有界内存缓存（TTL + LRU）
+
+替代服务里只增不减的 dict 缓存：
+- 条目数上限，超出时淘汰最久未使用的条目
+- 每个条目独立 TTL（ttl=None 表示不过期），过期条目在读取或淘汰时清理
+- 统计命中 / 未命中 / 淘汰 / 过期次数，通过 /api/performance 查看
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 所有已创建的缓存（名称 → 实例），用于统计输出
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _CacheEntry:
+    """缓存条目（紧凑存储）"""
+
+    __slots__ = ('value', 'expire_at')
+
+    def __init__(self, value, expire_at):
+        self.value = value
+        self.expire_at = expire_at
+
+
+class BoundedCache:
+    """线程安全的有界 TTL + LRU 缓存"""
+
+    def __init__(self, name, max_size=1000, ttl=None):
+        """
+        :param name: 缓存名称（统计中显示，同名缓存会覆盖注册）
+        :param max_size: 最大条目数
+        :param ttl: 默认过期时间（秒），None 表示不过期
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        with _registry_lock:
+            _registry[name] = self
+
+    def get(self, key, default=None):
+        """读取缓存（命中时刷新 LRU 位置）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry.expire_at is not None and entry.expire_at <= time.time():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, key, value, ttl=None):
+        """
+        写入缓存
+
+        :param ttl: 本条目的过期时间（秒），默认使用缓存的 ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = _CacheEntry(value, expire_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._evict()
+
+    def pop(self, key, default=None):
+        """删除并返回条目"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry.value if entry is not None else default
+
+    def discard_if(self, predicate):
+        """
+        删除值满足条件的条目
+
+        :param predicate: predicate(key, value) → bool
+        :return: 删除的条数
+        """
+        with self._lock:
+            keys = [k for k, e in self._data.items() if predicate(k, e.value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        """超出上限时按 LRU 淘汰（调用方持有锁）；淘汰到的过期条目计入过期次数"""
+        now = time.time()
+        while len(self._data) > self.max_size:
+            _, entry = self._data.popitem(last=False)
+            if entry.expire_at is not None and entry.expire_at <= now:
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+    def stats(self):
+        """缓存统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+_MISSING = object()
+
+
+def get_cache_stats():
+    """获取所有内存缓存的统计信息"""
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {cache.name: cache.stats() for cache in caches}
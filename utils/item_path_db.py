@@ -4,8 +4,11 @@
 import os
 import json
 import logging
+import threading
 from pathlib import Path
 from database.database import get_db_manager
+from utils.bounded_cache import BoundedCache
+from utils.shared_state import get_shared_state, GEN_ITEM_PATHS
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +16,26 @@ class ItemPathDatabase:
     """
     Item ID 到文件路径的永久映射数据库 - SQLite 优化版本
     用于跳过Emby API查询，直接获取文件路径，极大提升性能
+
+    读取走进程内 LRU（read-through），热点 item 的重定向不再访问 SQLite
+    路径变更 / 删除时通知监听者，清理由旧路径派生的缓存（Item缓存、直链缓存）
     """
+
+    # 进程内 LRU 容量
+    LRU_MAX_SIZE = 10000
     
-    def __init__(self):
+    def __init__(self, lru_max_size=None):
         self.db_file = Path('config/item_path_db.json')
         self.db = get_db_manager()
+
+        # 🚀 read-through LRU：item_id → file_path（永久数据，不设TTL）
+        self._lru = BoundedCache('item_path_db', max_size=lru_max_size or self.LRU_MAX_SIZE)
+
+        # 路径变更监听者：callback({item_id: (old_path, new_path)})，删除时 new_path 为 None
+        self._listeners = []
+
+        # 多 worker 模式：其他进程修改路径后清空本进程 LRU
+        get_shared_state().subscribe(GEN_ITEM_PATHS, self._lru.clear)
         
         # 从旧JSON文件迁移数据
         self._migrate_from_json()
@@ -46,13 +64,19 @@ class ItemPathDatabase:
     
     def get(self, item_id):
         """
-        获取item对应的文件路径（SQLite优化版本）
+        获取item对应的文件路径（LRU → SQLite 读穿）
         
         :param item_id: Emby item ID
         :return: 文件路径或None
         """
-        file_path = self.db.get_item_path(str(item_id))
+        item_id = str(item_id)
+        file_path = self._lru.get(item_id)
+        if file_path is not None:
+            return file_path
+
+        file_path = self.db.get_item_path(item_id)
         if file_path:
+            self._lru.set(item_id, file_path)
             logger.debug(f"🎯 路径映射命中: {item_id} → {file_path[:50]}...")
         return file_path
     
@@ -63,21 +87,82 @@ class ItemPathDatabase:
         :param item_id: Emby item ID
         :param file_path: 文件路径
         """
-        success = self.db.set_item_path(str(item_id), str(file_path))
+        item_id = str(item_id)
+        file_path = str(file_path)
+        old_path = self.get(item_id)
+        success = self.db.set_item_path(item_id, file_path)
         if success:
+            self._lru.set(item_id, file_path)
             logger.debug(f"📝 路径映射已记录: {item_id} → {file_path[:50]}...")
+            if old_path and old_path != file_path:
+                self._notify({item_id: (old_path, file_path)})
+        return success
+    
+    def set_many(self, items):
+        """
+        批量设置item对应的文件路径（单个事务）
+        
+        :param items: {item_id: file_path}
+        """
+        items = {str(k): str(v) for k, v in items.items() if v}
+        if not items:
+            return True
+        old_paths = self.db.get_item_paths(list(items))
+        success = self.db.set_item_paths(list(items.items()))
+        if success:
+            for item_id, file_path in items.items():
+                self._lru.set(item_id, file_path)
+            logger.debug(f"📝 批量记录路径映射: {len(items)} 条")
+            changes = {item_id: (old_paths[item_id], file_path)
+                       for item_id, file_path in items.items()
+                       if old_paths.get(item_id) and old_paths[item_id] != file_path}
+            if changes:
+                self._notify(changes)
         return success
     
     def has(self, item_id):
-        """检查是否存在映射（SQLite优化版本）"""
-        return self.db.has_item_path(str(item_id))
+        """检查是否存在映射（需要路径时请直接使用 get，只查询一次）"""
+        return self.get(item_id) is not None
     
     def remove(self, item_id):
         """删除映射（SQLite优化版本）"""
-        success = self.db.remove_item_path(str(item_id))
-        if success:
-            logger.debug(f"🗑️ 删除映射: {item_id}")
-        return success
+        return self.remove_many([item_id]) > 0
+
+    def remove_many(self, item_ids):
+        """
+        批量删除映射（单个事务）
+
+        :return: 删除的条数
+        """
+        item_ids = [str(i) for i in item_ids]
+        old_paths = self.db.get_item_paths(item_ids)
+        for item_id in item_ids:
+            self._lru.pop(item_id)
+        removed = self.db.remove_item_paths(list(old_paths))
+        if old_paths:
+            logger.debug(f"🗑️ 删除映射: {', '.join(old_paths)}")
+            self._notify({item_id: (old_path, None) for item_id, old_path in old_paths.items()})
+        return removed
+
+    # ==================== 变更通知 ====================
+
+    def add_change_listener(self, callback):
+        """注册路径变更监听者"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_change_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, changes):
+        logger.info(f"🔄 Item路径变更: {len(changes)} 条")
+        get_shared_state().bump(GEN_ITEM_PATHS)
+        for callback in list(self._listeners):
+            try:
+                callback(changes)
+            except Exception as e:
+                logger.warning(f"⚠️ 路径变更通知失败: {e}")
     
     def clear(self):
         """清空数据库（危险操作，慎用）"""
@@ -88,5 +173,22 @@ class ItemPathDatabase:
     
     def stats(self):
         """获取统计信息（SQLite优化版本）"""
-        return self.db.get_item_path_stats()
+        stats = self.db.get_item_path_stats()
+        stats['lru'] = self._lru.stats()
+        return stats
+
+
+# 全局实例（所有服务共享同一个 LRU）
+_item_path_db = None
+_item_path_db_lock = threading.Lock()
+
+
+def get_item_path_db():
+    """获取全局 Item 路径数据库实例"""
+    global _item_path_db
+    if _item_path_db is None:
+        with _item_path_db_lock:
+            if _item_path_db is None:
+                _item_path_db = ItemPathDatabase()
+    return _item_path_db
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多规则路径映射引擎
+
+规则表来自 emby.path_mapping.rules，每条规则：
+- type: 'prefix'（字面前缀）或 'regex'（正则，从路径开头匹配）
+- pattern: Emby 本地路径前缀 / 正则
+- target: 网盘路径前缀（regex 规则支持 \\1、\\g<name> 反向引用）
+- mount_path: 该规则对应的网盘挂载前缀（留空继承 123.mount_path）
+- download_mode: 'direct' / 'proxy'（留空继承 123.download_mode）
+
+匹配顺序：
+1. 字面前缀规则：前缀树最长前缀匹配，耗时只与路径长度有关，与规则数量无关
+   （前缀相同时按规则顺序取第一条）
+2. 正则规则：前缀规则全部未命中时，按规则顺序取第一条命中
+"""
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 前缀树节点上保存规则的键（路径字符不可能是 None）
+_TERMINAL = None
+
+
+def normalize_path(path):
+    """统一路径分隔符（支持 Windows 和 Linux）"""
+    return (path or '').replace('\\', '/')
+
+
+class PathMappingRule:
+    """单条路径映射规则"""
+
+    __slots__ = ('index', 'match_type', 'pattern', 'target', 'mount_path', 'download_mode', 'regex')
+
+    def __init__(self, index, match_type, pattern, target, mount_path='', download_mode=''):
+        self.index = index
+        self.match_type = match_type
+        self.target = target or ''
+        self.mount_path = mount_path or ''
+        self.download_mode = download_mode or ''
+        if match_type == 'regex':
+            self.pattern = pattern
+            self.regex = re.compile(pattern)
+        else:
+            self.pattern = normalize_path(pattern)
+            self.regex = None
+
+    def describe(self):
+        return f"#{self.index} {self.match_type}:{self.pattern} -> {self.target}"
+
+
+class PathMappingMatch:
+    """路径映射结果"""
+
+    __slots__ = ('rule', 'mapped_path', 'mount_path', 'download_mode')
+
+    def __init__(self, rule, mapped_path, mount_path, download_mode):
+        self.rule = rule
+        self.mapped_path = mapped_path
+        self.mount_path = mount_path
+        self.download_mode = download_mode
+
+
+class PathMappingEngine:
+    """路径映射引擎（前缀树 + 有序正则规则）"""
+
+    def __init__(self, rules, default_mount_path='/123', default_download_mode='direct'):
+        """
+        :param rules: PathMappingRule 列表（已按顺序排列）
+        :param default_mount_path: 规则未指定挂载前缀时使用
+        :param default_download_mode: 规则未指定下载模式时使用
+        """
+        self.default_mount_path = default_mount_path or '/123'
+        self.default_download_mode = default_download_mode or 'direct'
+        self.rules = list(rules)
+        self.regex_rules = [r for r in self.rules if r.match_type == 'regex']
+        self._trie = {}
+        for rule in self.rules:
+            if rule.match_type != 'regex':
+                self._insert(rule)
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置构建引擎（emby.path_mapping + 123.mount_path/download_mode）"""
+        emby = config.get('emby', {}) or {}
+        path_mapping = emby.get('path_mapping', {}) or {}
+        pan123 = config.get('123', {}) or {}
+
+        rules = []
+        if path_mapping.get('enable', False):
+            rules = cls._parse_rules(path_mapping)
+
+        return cls(
+            rules,
+            default_mount_path=pan123.get('mount_path', '/123'),
+            default_download_mode=pan123.get('download_mode', 'direct')
+        )
+
+    @staticmethod
+    def _parse_rules(path_mapping):
+        """解析规则表；兼容旧的单条 from/to 配置"""
+        rules = []
+        configured = [r for r in (path_mapping.get('rules') or ()) if r.get('enable', True)]
+
+        # 旧配置的 from/to 作为第一条规则（没有规则表时保持原有行为）
+        legacy_from = path_mapping.get('from', '') or ''
+        if legacy_from or not configured:
+            rules.append(PathMappingRule(0, 'prefix', legacy_from, path_mapping.get('to', '')))
+
+        for rule_cfg in configured:
+            pattern = rule_cfg.get('pattern', '')
+            if not pattern:
+                continue
+            try:
+                rules.append(PathMappingRule(
+                    len(rules),
+                    rule_cfg.get('type', 'prefix'),
+                    pattern,
+                    rule_cfg.get('target', ''),
+                    rule_cfg.get('mount_path', ''),
+                    rule_cfg.get('download_mode', '')
+                ))
+            except re.error as e:
+                logger.error(f"❌ 路径映射正则无效，已跳过: {pattern} ({e})")
+        return rules
+
+    @staticmethod
+    def mount_paths_from_config(config):
+        """获取所有网盘挂载前缀（默认挂载 + 规则指定的挂载），长的在前"""
+        pan123 = config.get('123', {}) or {}
+        mounts = {pan123.get('mount_path', '/123') or '/123'}
+        path_mapping = (config.get('emby', {}) or {}).get('path_mapping', {}) or {}
+        for rule_cfg in path_mapping.get('rules') or ():
+            if rule_cfg.get('mount_path'):
+                mounts.add(rule_cfg['mount_path'])
+        return sorted(mounts, key=len, reverse=True)
+
+    def _insert(self, rule):
+        node = self._trie
+        for ch in rule.pattern:
+            node = node.setdefault(ch, {})
+        # 相同前缀保留顺序靠前的规则
+        node.setdefault(_TERMINAL, rule)
+
+    def _longest_prefix(self, path):
+        node = self._trie
+        best = node.get(_TERMINAL)
+        for ch in path:
+            node = node.get(ch)
+            if node is None:
+                break
+            rule = node.get(_TERMINAL)
+            if rule is not None:
+                best = rule
+        return best
+
+    def match(self, original_path):
+        """
+        匹配路径
+
+        :param original_path: Emby 中的文件路径
+        :return: PathMappingMatch；未命中任何规则返回 None（本地资源）
+        """
+        if not self.rules or not original_path:
+            return None
+
+        path = normalize_path(original_path)
+
+        rule = self._longest_prefix(path)
+        if rule is not None:
+            mapped_path = rule.target + path[len(rule.pattern):]
+            return self._build_match(rule, mapped_path)
+
+        for rule in self.regex_rules:
+            m = rule.regex.match(path)
+            if m:
+                mapped_path = m.expand(rule.target) + path[m.end():]
+                return self._build_match(rule, mapped_path)
+
+        return None
+
+    def _build_match(self, rule, mapped_path):
+        return PathMappingMatch(
+            rule,
+            mapped_path,
+            rule.mount_path or self.default_mount_path,
+            rule.download_mode or self.default_download_mode
+        )
+
+    def describe(self):
+        """规则摘要（日志使用）"""
+        return ', '.join(rule.describe() for rule in self.rules) or '无规则'
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式转发引擎（上游 HTTP 响应 → 客户端）
+
+iter_content(8192) 每 8KB 产生一个 bytes 对象和一次 Python 循环，一路 60Mbps
+的 4K 原盘每秒要上千次。转发引擎按条件选择最省的方式：
+1. splice：Linux、上游为明文连接（如局域网 Emby）、响应长度已知时，数据通过
+   内核管道在上游 socket 和客户端 socket 之间移动，不进入用户空间
+2. 直写 socket：响应长度已知时（如 HTTPS CDN），readinto 到池化的复用缓冲区，
+   再以 memoryview 直接写入客户端 socket，不分配 bytes 对象
+3. 大块迭代：其他情况（小响应、分块响应、压缩响应需要解码）按 256KB 大块 yield
+
+1、2 需要 Werkzeug 服务器提供的客户端 socket（environ['werkzeug.socket']）：
+先 yield b'' 让服务器发出响应头，之后由引擎写入响应体。Werkzeug 对每个响应
+都发送 Connection: close，写满 Content-Length 后连接随即关闭。
+
+上游响应可以是 requests 的流式响应，也可以是 httpx 的流式响应（网盘 CDN 经
+utils/upstream_client 的长连接池请求）。httpx 响应没有可 readinto 的底层文件对象，
+直写 socket 模式改为把 iter_raw 的数据块直接写入客户端 socket，不支持 splice。
+
+转发的是上游原始字节（不解码 Content-Encoding），调用方需保留上游的
+Content-Length / Content-Encoding 响应头，见 UpstreamRelay.response_headers()。
+
+传入带宽调度的流（services/bandwidth.py）时，三种方式都在每个数据块写出前按限速等待。
+
+吞吐基准：python -m utils.relay [MB]
+"""
+
+import os
+import ssl
+import sys
+import time
+import errno
+import select
+import logging
+import threading
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RELAY_CHUNK_SIZE = int(os.environ.get('RELAY_CHUNK_SIZE', 256 * 1024))
+SPLICE_AVAILABLE = hasattr(os, 'splice') and sys.platform.startswith('linux')
+# 小于该长度的响应走大块迭代（上游连接读完后放回连接池复用）
+DIRECT_MIN_LENGTH = 1024 * 1024
+
+# 原样转发时不透传的逐跳响应头
+HOP_BY_HOP_HEADERS = frozenset({'connection', 'keep-alive', 'transfer-encoding', 'proxy-connection',
+                                'te', 'trailer', 'upgrade'})
+# 解码转发时还需去掉的响应头（响应体已解码、长度改变）
+DECODED_EXCLUDED_HEADERS = HOP_BY_HOP_HEADERS | {'content-encoding', 'content-length'}
+
+MODE_SPLICE = 'splice'
+MODE_SOCKET = 'socket'
+MODE_ITER = 'iter'
+
+
+class BufferPool:
+    """复用的 bytearray 缓冲区池（超过上限的缓冲区归还时直接丢弃）"""
+
+    def __init__(self, buffer_size=RELAY_CHUNK_SIZE, max_buffers=64):
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+        self.allocated = 0
+        self.reused = 0
+        self.in_use = 0
+
+    def acquire(self):
+        with self._lock:
+            self.in_use += 1
+            if self._free:
+                self.reused += 1
+                return self._free.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        with self._lock:
+            self.in_use -= 1
+            if len(self._free) < self.max_buffers and len(buffer) == self.buffer_size:
+                self._free.append(buffer)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffer_size': self.buffer_size,
+                'free': len(self._free),
+                'in_use': self.in_use,
+                'allocated': self.allocated,
+                'reused': self.reused
+            }
+
+
+_buffer_pool = BufferPool()
+
+# 转发统计
+_stats = {'active': 0, 'streams': 0, 'bytes': 0, 'client_aborts': 0,
+          MODE_SPLICE: 0, MODE_SOCKET: 0, MODE_ITER: 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for key, delta in deltas.items():
+            _stats[key] += delta
+
+
+def get_relay_stats():
+    """获取转发引擎统计"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['splice_available'] = SPLICE_AVAILABLE
+    stats['buffer_pool'] = _buffer_pool.stats()
+    return stats
+
+
+class UpstreamRelay:
+    """
+    一个上游响应的转发（WSGI 可迭代对象，可直接作为 Flask Response 的响应体）
+
+    用法：
+        relay = UpstreamRelay(resp, request.environ)
+        return Response(relay, status=resp.status_code, headers=relay.response_headers())
+    """
+
+    def __init__(self, response, environ=None, chunk_size=None, decode=False, allow_splice=True, bandwidth=None):
+        """
+        :param response: requests 的流式响应（stream=True）或 httpx 的流式响应
+        :param environ: WSGI environ（提供客户端 socket 时启用 splice / 直写 socket）
+        :param decode: 是否解码 Content-Encoding（客户端不接受上游编码时使用）
+        :param allow_splice: 是否允许 splice（基准测试中单独测试直写 socket 时关闭）
+        :param bandwidth: 带宽调度的流（BandwidthStream），转发结束时由引擎关闭
+        """
+        self.response = response
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size or RELAY_CHUNK_SIZE
+        # 上游 Content-Encoding 需要解码时只能走 urllib3 解码迭代
+        self.decode = decode and bool(response.headers.get('Content-Encoding'))
+        self._httpx = isinstance(response, httpx.Response)
+        # http.client.HTTPResponse（绕过 urllib3 逐块分配）
+        self._fp = None if self._httpx else getattr(response.raw, '_fp', None)
+        self._client_sock = None
+        self._allow_splice = allow_splice
+        self.mode = MODE_ITER
+
+        length = self._content_length()
+        if (environ is not None and not self.decode and (self._fp is not None or self._httpx) and length is not None
+                and length >= DIRECT_MIN_LENGTH and environ.get('REQUEST_METHOD') != 'HEAD'):
+            self._client_sock = environ.get('werkzeug.socket')
+        if self._client_sock is not None:
+            self.mode = MODE_SPLICE if self._upstream_sock_for_splice() is not None else MODE_SOCKET
+        self.length = length
+
+    def _content_length(self):
+        value = self.response.headers.get('Content-Length')
+        if value is None or self.response.headers.get('Transfer-Encoding'):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    def _upstream_sock_for_splice(self):
+        """可以 splice 的上游 socket（明文 TCP）"""
+        if not SPLICE_AVAILABLE or not self._allow_splice or self._httpx:
+            return None
+        connection = getattr(self.response.raw, 'connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is None or isinstance(sock, ssl.SSLSocket) or not hasattr(sock, 'fileno'):
+            return None
+        return sock
+
+    def response_headers(self, excluded=None):
+        """
+        转发给客户端的响应头
+
+        :param excluded: 额外排除的响应头（小写）
+        """
+        skip = DECODED_EXCLUDED_HEADERS if self.decode else HOP_BY_HOP_HEADERS
+        if excluded:
+            skip = skip | excluded
+        headers = self.response.headers.multi_items() if self._httpx else self.response.raw.headers.items()
+        return [(name, value) for name, value in headers if name.lower() not in skip]
+
+    # ==================== WSGI 可迭代对象 ====================
+
+    def __iter__(self):
+        _count(active=1, streams=1, **{self.mode: 1})
+        try:
+            if self.mode == MODE_ITER:
+                yield from self._iter_chunks()
+                return
+            # 先让服务器发出响应头，响应体由引擎直接写入客户端 socket
+            yield b''
+            if self.mode == MODE_SPLICE:
+                self._relay_splice()
+            else:
+                self._relay_socket()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            _count(client_aborts=1)
+            logger.debug(f"客户端断开，停止转发: {e}")
+        finally:
+            _count(active=-1)
+            self.close()
+
+    def close(self):
+        if self.bandwidth is not None:
+            self.bandwidth.close()
+        if self._httpx:
+            # httpx 在响应体读完时把连接放回连接池，否则关闭连接（HTTP/2 只重置该 stream）
+            self.response.close()
+        elif self._fp is not None and self.mode != MODE_SPLICE and self._fully_read():
+            # 响应体已完整读取，连接放回连接池复用
+            self._fp.close()
+            self.response.raw.release_conn()
+        else:
+            self.response.close()
+
+    def _fully_read(self):
+        # read1 读到 Content-Length 后不会自动关闭 http.client 响应，需要看剩余长度
+        return self._fp.isclosed() or self._fp.length == 0
+
+    def _iter_chunks(self):
+        if self._httpx:
+            chunks = self.response.iter_bytes(self.chunk_size) if self.decode else self.response.iter_raw()
+            for chunk in chunks:
+                self._throttle(len(chunk))
+                _count(bytes=len(chunk))
+                yield chunk
+            return
+        if self.decode or self._fp is None:
+            for chunk in self.response.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    self._throttle(len(chunk))
+                    _count(bytes=len(chunk))
+                    yield chunk
+            return
+        # 直接从 http.client 读取大块：一次系统调用读入新 bytes，没有额外拷贝
+        read = self._fp.read1 if hasattr(self._fp, 'read1') else self._fp.read
+        while True:
+            chunk = read(self.chunk_size)
+            if not chunk:
+                return
+            self._throttle(len(chunk))
+            _count(bytes=len(chunk))
+            yield chunk
+
+    def _throttle(self, size):
+        if self.bandwidth is not None:
+            self.bandwidth.throttle(size)
+
+    def _relay_socket(self):
+        """readinto 复用缓冲区 → memoryview 直写客户端 socket"""
+        if self._httpx:
+            for chunk in self.response.iter_raw():
+                self._throttle(len(chunk))
+                self._client_sock.sendall(chunk)
+                _count(bytes=len(chunk))
+            return
+        buffer = _buffer_pool.acquire()
+        view = memoryview(buffer)
+        remaining = self.length
+        try:
+            while remaining > 0:
+                n = self._fp.readinto(view[:min(len(view), remaining)])
+                if not n:
+                    raise ConnectionError('上游提前关闭连接')
+                self._throttle(n)
+                self._client_sock.sendall(view[:n])
+                remaining -= n
+                _count(bytes=n)
+        finally:
+            view.release()
+            _buffer_pool.release(buffer)
+
+    def _relay_splice(self):
+        """上游 socket → 管道 → 客户端 socket（内核内移动）"""
+        remaining = self.length
+
+        # http.client 读响应头时可能已把部分响应体读入缓冲区，先原样发送
+        buffered = self._fp.fp.peek(0) if hasattr(self._fp, 'fp') else b''
+        if buffered:
+            data = self._fp.fp.read(min(len(buffered), remaining))
+            self._throttle(len(data))
+            self._client_sock.sendall(data)
+            remaining -= len(data)
+            _count(bytes=len(data))
+
+        if remaining > 0:
+            src = self._upstream_sock_for_splice()
+            timeout = src.gettimeout()
+            throttle = self.bandwidth.throttle if self.bandwidth is not None else None
+            _count(bytes=splice_sockets(src.fileno(), self._client_sock.fileno(), remaining,
+                                        self.chunk_size, timeout, throttle))
+
+
+def splice_sockets(src_fd, dst_fd, count, chunk_size=RELAY_CHUNK_SIZE, timeout=None, throttle=None):
+    """
+    用 os.splice 从 src 复制 count 字节到 dst（数据不进入用户空间）
+
+    :param timeout: 等待 socket 可读 / 可写的超时（秒），None 表示不限
+    :param throttle: throttle(n)：每读入 n 字节到管道后、写给 dst 前调用（限速）
+    :return: 复制的字节数
+    """
+    pipe_r, pipe_w = os.pipe()
+    try:
+        try:
+            import fcntl
+            fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, chunk_size)
+        except (ImportError, AttributeError, OSError):
+            pass  # 使用默认管道容量（64KB）
+
+        copied = 0
+        while copied < count:
+            n = _splice_retry(src_fd, pipe_w, min(chunk_size, count - copied), src_fd, select.POLLIN, timeout)
+            if n == 0:
+                raise ConnectionError('上游提前关闭连接')
+            if throttle is not None:
+                throttle(n)
+            pending = n
+            while pending:
+                written = _splice_retry(pipe_r, dst_fd, pending, dst_fd, select.POLLOUT, timeout)
+                if written == 0:
+                    raise BrokenPipeError('客户端已关闭连接')
+                pending -= written
+            copied += n
+        return copied
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+
+def _splice_retry(fd_in, fd_out, count, wait_fd, wait_event, timeout):
+    """非阻塞 socket 返回 EAGAIN 时等待就绪后重试"""
+    while True:
+        try:
+            return os.splice(fd_in, fd_out, count)
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if e.errno == errno.EPIPE:
+                raise BrokenPipeError(str(e))
+            raise
+        poller = select.poll()
+        poller.register(wait_fd, wait_event)
+        if not poller.poll(None if timeout is None else timeout * 1000):
+            raise TimeoutError('转发等待超时')
+
+
+# ==================== 吞吐基准 ====================
+
+def benchmark(size_mb=256):
+    """
+    本机吞吐基准：本地 HTTP 服务器 → 转发方式 → socketpair 接收端
+
+    对比 iter_content(8192)（旧实现）和转发引擎的三种模式，输出 MB/s 和 CPU 时间
+    """
+    import socket
+    import http.server
+    import socketserver
+    import requests
+
+    payload = os.urandom(1024 * 1024)
+    total = size_mb * len(payload)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(total))
+            self.end_headers()
+            try:
+                for _ in range(size_mb):
+                    self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def run(name, consume, fetch=None):
+        client, sink = socket.socketpair()
+        drained = [0]
+
+        def drain():
+            buffer = bytearray(1024 * 1024)
+            while True:
+                n = sink.recv_into(buffer)
+                if not n:
+                    return
+                drained[0] += n
+
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+        resp = fetch() if fetch else requests.get(url, stream=True, timeout=30)
+        wall, cpu = time.perf_counter(), time.process_time()
+        consume(resp, client)
+        client.shutdown(socket.SHUT_WR)
+        reader.join()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        client.close()
+        sink.close()
+        print(f"{name:<22} {drained[0] / wall / 1048576:>9.0f} MB/s   CPU {cpu:6.2f}s")
+
+    def legacy(resp, client):
+        for chunk in resp.iter_content(chunk_size=8192):
+            client.sendall(chunk)
+
+    def relay_mode(mode):
+        def consume(resp, client):
+            environ = None if mode == MODE_ITER else {'REQUEST_METHOD': 'GET', 'werkzeug.socket': client}
+            relay = UpstreamRelay(resp, environ, allow_splice=mode == MODE_SPLICE)
+            if relay.mode != mode:
+                print(f"{'relay/' + mode:<22} 不可用（当前: {relay.mode}）")
+                relay.close()
+                return
+            for chunk in relay:
+                if chunk:
+                    client.sendall(chunk)
+        return consume
+
+    print(f"转发 {size_mb}MB（本机回环，单连接）")
+    run('iter_content(8192)', legacy)
+    run('relay/iter', relay_mode(MODE_ITER))
+    run('relay/socket', relay_mode(MODE_SOCKET))
+    if SPLICE_AVAILABLE:
+        run('relay/splice', relay_mode(MODE_SPLICE))
+    with httpx.Client(timeout=30) as http_client:
+        def fetch():
+            return http_client.send(http_client.build_request('GET', url), stream=True)
+        run('relay/httpx-iter', relay_mode(MODE_ITER), fetch)
+        run('relay/httpx-socket', relay_mode(MODE_SOCKET), fetch)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
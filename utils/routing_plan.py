@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from utils.url_auth import URLAuthManager
+from utils.path_mapping import PathMappingEngine
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingPlan:
+    """
+    编译后的路由计划 - 每个配置版本只构建一次
+
+    把每个请求都要重复推导的内容（路径前缀、拦截名单、鉴权域名、鉴权参数）
+    预先计算好，热路径只做 O(1) 的集合查询和前缀比较
+    """
+
+    __slots__ = (
+        'version', 'config',
+        # Emby
+        'emby_enable', 'redirect_enable', 'modify_playback_info',
+        'emby_server', 'api_key', 'ssl_verify',
+        'items_batch_window_ms', 'items_batch_size', 'speculative_enable', 'speculative_episodes',
+        # 路径映射
+        'path_mapping_enable', 'path_mapping',
+        # 客户端拦截
+        'filter_enable', 'filter_mode',
+        'blocked_clients', 'blocked_devices', 'blocked_ips',
+        'allowed_clients', 'allowed_devices', 'allowed_ips',
+        # 123网盘 / URL鉴权
+        'mount_path', 'download_mode',
+        'url_auth_enable', 'secret_key', 'uid', 'expire_time', 'auth_bucket_seconds',
+        'custom_domains', 'domain_matcher', 'domain_strategy', 'domain_weights',
+        # 代理模式流传输
+        'block_cache_enable', 'block_cache_bytes', 'block_size', 'block_cache_policy',
+        'read_ahead_enable', 'read_ahead_seconds', 'read_ahead_max_bytes', 'read_ahead_memory_bytes',
+        'parallel_fetch_enable', 'parallel_max_connections', 'parallel_file_connections',
+        'fanout_enable', 'fanout_buffer_bytes',
+        'bandwidth_enable', 'bandwidth_global_mbps', 'bandwidth_user_mbps', 'bandwidth_device_mbps',
+        'bandwidth_user_weights',
+    )
+
+    def __init__(self, snapshot):
+        config = snapshot.config
+        self.version = snapshot.version
+        self.config = config
+
+        emby = config.get('emby', {}) or {}
+        self.emby_enable = bool(emby.get('enable', False))
+        self.redirect_enable = bool(emby.get('redirect_enable', True))
+        self.modify_playback_info = bool(emby.get('modify_playback_info', False))
+        self.emby_server = (emby.get('server', '') or '').rstrip('/')
+        self.api_key = emby.get('api_key', '') or ''
+        self.ssl_verify = bool(emby.get('ssl_verify', False))
+        self.items_batch_window_ms = int(emby.get('items_batch_window_ms', 5) or 0)
+        self.items_batch_size = int(emby.get('items_batch_size', 50) or 1)
+        self.speculative_enable = bool(emby.get('speculative_enable', True))
+        self.speculative_episodes = max(0, int(emby.get('speculative_episodes', 2) or 0))
+
+        self.path_mapping_enable = bool((emby.get('path_mapping', {}) or {}).get('enable', False))
+        self.path_mapping = PathMappingEngine.from_config(config)
+
+        client_filter = emby.get('client_filter', {}) or {}
+        self.filter_enable = bool(client_filter.get('enable', False))
+        self.filter_mode = client_filter.get('mode', 'blacklist')
+        self.blocked_clients = self._lower_set(client_filter.get('blocked_clients'))
+        self.blocked_devices = self._lower_set(client_filter.get('blocked_devices'))
+        self.blocked_ips = frozenset(client_filter.get('blocked_ips') or ())
+        self.allowed_clients = self._lower_set(client_filter.get('allowed_clients'))
+        self.allowed_devices = self._lower_set(client_filter.get('allowed_devices'))
+        self.allowed_ips = frozenset(client_filter.get('allowed_ips') or ())
+
+        pan123 = config.get('123', {}) or {}
+        self.mount_path = pan123.get('mount_path', '/123')
+        self.download_mode = pan123.get('download_mode', 'direct')
+
+        url_auth = pan123.get('url_auth', {}) or {}
+        self.url_auth_enable = bool(url_auth.get('enable', False))
+        self.secret_key = url_auth.get('secret_key', '') or ''
+        self.uid = url_auth.get('uid', '') or ''
+        self.expire_time = url_auth.get('expire_time', 3600)
+        self.auth_bucket_seconds = int(url_auth.get('bucket_seconds', 300) or 0)
+        self.custom_domains = tuple(d.strip() for d in (url_auth.get('custom_domains') or ()) if d and d.strip())
+        self.domain_matcher = URLAuthManager.compile_domain_matcher(self.custom_domains)
+        self.domain_strategy = url_auth.get('domain_strategy') or 'latency'
+        self.domain_weights = dict(url_auth.get('domain_weights') or {})
+
+        stream = config.get('stream', {}) or {}
+        self.block_cache_enable = bool(stream.get('block_cache_enable', False))
+        self.block_cache_bytes = max(0, int(stream.get('block_cache_size_mb', 20480) or 0)) * 1024 * 1024
+        self.block_size = max(1, int(stream.get('block_size_mb', 4) or 4)) * 1024 * 1024
+        self.block_cache_policy = stream.get('block_cache_policy') or 'lru'
+        self.read_ahead_enable = bool(stream.get('read_ahead_enable', False))
+        self.read_ahead_seconds = max(0, int(stream.get('read_ahead_seconds', 30) or 0))
+        self.read_ahead_max_bytes = max(0, int(stream.get('read_ahead_max_mb', 64) or 0)) * 1024 * 1024
+        self.read_ahead_memory_bytes = max(0, int(stream.get('read_ahead_memory_mb', 256) or 0)) * 1024 * 1024
+        self.parallel_fetch_enable = bool(stream.get('parallel_fetch_enable', False))
+        self.parallel_max_connections = max(1, int(stream.get('parallel_max_connections', 4) or 4))
+        self.parallel_file_connections = max(1, int(stream.get('parallel_file_connections', 8) or 8))
+        self.fanout_enable = bool(stream.get('fanout_enable', False))
+        self.fanout_buffer_bytes = max(1, int(stream.get('fanout_buffer_mb', 32) or 32)) * 1024 * 1024
+        self.bandwidth_enable = bool(stream.get('bandwidth_enable', False))
+        self.bandwidth_global_mbps = max(0, int(stream.get('bandwidth_global_mbps', 0) or 0))
+        self.bandwidth_user_mbps = max(0, int(stream.get('bandwidth_user_mbps', 0) or 0))
+        self.bandwidth_device_mbps = max(0, int(stream.get('bandwidth_device_mbps', 0) or 0))
+        self.bandwidth_user_weights = dict(stream.get('bandwidth_user_weights') or {})
+
+    @staticmethod
+    def _lower_set(values):
+        return frozenset(str(v).lower() for v in (values or ()))
+
+    # ==================== 路径映射 ====================
+
+    def match_path(self, original_path):
+        """
+        匹配路径映射规则
+
+        :return: PathMappingMatch；本地资源返回 None
+        """
+        if not self.path_mapping_enable:
+            return None
+        return self.path_mapping.match(original_path)
+
+    def map_path(self, original_path):
+        """
+        应用路径映射
+
+        :return: 映射后的网盘路径；不匹配时返回 'LOCAL_PROXY'
+        """
+        match = self.match_path(original_path)
+        return match.mapped_path if match else 'LOCAL_PROXY'
+
+    def is_cloud_path(self, original_path):
+        """判断路径是否属于网盘资源（匹配任一映射规则）"""
+        return self.match_path(original_path) is not None
+
+    # ==================== 客户端拦截 ====================
+
+    def client_denied_reason(self, client_name, device_name, ip_address):
+        """
+        检查客户端访问权限
+
+        :return: None 表示允许；否则返回拦截原因
+        """
+        if not self.filter_enable:
+            return None
+
+        client_lower = (client_name or '').lower()
+        device_lower = (device_name or '').lower()
+
+        if self.filter_mode == 'blacklist':
+            if client_lower in self.blocked_clients:
+                return f"客户端被拦截: {client_name}"
+            if device_lower in self.blocked_devices:
+                return f"设备被拦截: {device_name}"
+            if ip_address in self.blocked_ips:
+                return f"IP被拦截: {ip_address}"
+            return None
+
+        if self.filter_mode == 'whitelist':
+            if self.allowed_clients and client_lower not in self.allowed_clients:
+                return f"客户端不在白名单: {client_name}"
+            if self.allowed_devices and device_lower not in self.allowed_devices:
+                return f"设备不在白名单: {device_name}"
+            if self.allowed_ips and ip_address not in self.allowed_ips:
+                return f"IP不在白名单: {ip_address}"
+            return None
+
+        return None
+
+    # ==================== URL鉴权 ====================
+
+    @property
+    def can_sign_urls(self):
+        """是否可以使用自定义域名 + 鉴权直接构建直链"""
+        return bool(self.url_auth_enable and self.custom_domains and self.secret_key and self.uid)
+
+    def is_123pan_url(self, url):
+        """判断URL是否需要添加123鉴权（预编译域名匹配）"""
+        return bool(url) and self.domain_matcher.search(url) is not None
+
+
+# 当前路由计划（按配置版本缓存）
+_plan_lock = threading.Lock()
+_current_plan = None
+
+
+def get_routing_plan(snapshot):
+    """获取配置快照对应的路由计划（每个版本只构建一次）"""
+    global _current_plan
+    plan = _current_plan
+    if plan is not None and plan.version == snapshot.version:
+        return plan
+    with _plan_lock:
+        plan = _current_plan
+        if plan is None or plan.version != snapshot.version:
+            plan = RoutingPlan(snapshot)
+            _current_plan = plan
+            logger.debug(f"路由计划已编译: v{plan.version}")
+    return plan
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程共享状态同步（SQLite 代数计数器）
+
+多 worker 模式下每个进程都有自己的内存缓存，共享模型为：
+- SQLite 是唯一的数据源：配置、Item 路径数据库、网盘直链缓存
+- 进程内的 BoundedCache / 配置快照是 L1，只缓存 SQLite 中的数据
+- 某个进程修改了数据（保存配置、Item 路径变更）时，把 config_store 中对应的
+  代数计数器 +1；其他进程的后台线程每秒轮询一次，发现代数变化后清理 L1 / 重新加载快照
+
+重定向热路径从不访问计数器；单进程模式下不启动同步，bump() 不写数据库。
+"""
+
+import logging
+import threading
+
+from database.database import get_db_manager
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'shared_gen:'
+
+# 代数名称
+GEN_CONFIG = 'config'            # 配置保存
+GEN_ITEM_PATHS = 'item_paths'    # Item 路径变更 / 删除
+
+
+class SharedStateSync:
+    """跨进程 L1 缓存失效同步"""
+
+    POLL_INTERVAL = 1.0  # 轮询间隔（秒）
+
+    def __init__(self):
+        self._handlers = {}   # 代数名称 → [callback()]
+        self._seen = {}       # 代数名称 → 本进程已处理的代数
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.enabled = False
+
+        self.bumps = 0
+        self.invalidations = 0
+
+    def subscribe(self, name, callback):
+        """
+        订阅其他进程的数据变更
+
+        :param name: 代数名称（GEN_CONFIG / GEN_ITEM_PATHS）
+        :param callback: 无参回调，在同步线程中执行
+        """
+        with self._lock:
+            handlers = self._handlers.setdefault(name, [])
+            if callback not in handlers:
+                handlers.append(callback)
+
+    def bump(self, name):
+        """本进程修改了共享数据，通知其他进程（未启用同步时不做任何事）"""
+        if not self.enabled:
+            return
+        generation = get_db_manager().increment_config_value(KEY_PREFIX + name, '多进程缓存失效代数')
+        if generation is None:
+            return
+        with self._lock:
+            self.bumps += 1
+            # 期间没有其他进程修改时，本进程无需再处理自己的变更
+            if self._seen.get(name, 0) == generation - 1:
+                self._seen[name] = generation
+
+    def _read(self, name):
+        value = get_db_manager().get_config_value(KEY_PREFIX + name)
+        try:
+            return int(value or 0)
+        except ValueError:
+            return 0
+
+    def poll(self):
+        """检查一次代数，有变化时执行对应回调"""
+        with self._lock:
+            names = list(self._handlers)
+        for name in names:
+            generation = self._read(name)
+            with self._lock:
+                if self._seen.get(name, 0) == generation:
+                    continue
+                self._seen[name] = generation
+                self.invalidations += 1
+                handlers = list(self._handlers.get(name, []))
+            logger.debug(f"🔄 其他进程更新了共享数据: {name} (代数 {generation})")
+            for callback in handlers:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning(f"⚠️ 共享状态同步回调失败: {name} {e}")
+
+    def start(self):
+        """启用同步（多 worker 模式下每个进程调用一次）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # 以当前代数为起点，启动前的变更已经体现在刚加载的数据中
+        with self._lock:
+            names = list(self._handlers) + [GEN_CONFIG, GEN_ITEM_PATHS]
+        for name in names:
+            self._seen[name] = self._read(name)
+        self.enabled = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True, name='SharedStateSync')
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _poll_loop(self):
+        while not self._stop_event.wait(self.POLL_INTERVAL):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.debug(f"⚠️ 共享状态轮询失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'generations': dict(self._seen),
+                'bumps': self.bumps,
+                'invalidations': self.invalidations
+            }
+
+
+# 全局实例
+_shared_state = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    """获取全局共享状态同步实例"""
+    global _shared_state
+    if _shared_state is None:
+        with _shared_state_lock:
+            if _shared_state is None:
+                _shared_state = SharedStateSync()
+    return _shared_state
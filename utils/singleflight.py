@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SingleFlight 请求合并
+
+同一个 key 的并发调用只执行一次：第一个调用者（leader）执行函数，
+其余调用者等待并共享结果（包括异常）。完成后结果在 share_window 秒内
+继续共享，吸收紧随其后的突发请求。
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 所有已创建的 SingleFlight（名称 → 实例），用于统计输出
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Call:
+    """一次进行中（或刚完成）的调用"""
+
+    __slots__ = ('event', 'result', 'error', 'done_at', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.done_at = None
+        self.waiters = 0
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """按 key 合并并发调用"""
+
+    def __init__(self, name, share_window=2.0, wait_timeout=60.0):
+        """
+        :param name: 名称（统计中显示）
+        :param share_window: 调用完成后继续共享结果的时间（秒），0 表示只合并进行中的调用
+        :param wait_timeout: 等待 leader 的最长时间（秒），超时后自己执行
+        """
+        self.name = name
+        self.share_window = share_window
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.executions = 0
+        self.shared = 0
+        self.timeouts = 0
+
+        with _registry_lock:
+            _registry[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)；同一 key 的并发调用共享同一次执行的结果
+
+        :return: fn 的返回值（fn 抛出的异常会抛给所有等待者）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.done_at is not None:
+                if time.time() - call.done_at <= self.share_window:
+                    self.shared += 1
+                    return call.outcome()
+                call = None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self.executions += 1
+            else:
+                leader = False
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            if call.event.wait(self.wait_timeout):
+                return call.outcome()
+            with self._lock:
+                self.timeouts += 1
+            logger.warning(f"⚠️ 等待合并请求超时，独立执行: {self.name}:{key}")
+            return fn(*args, **kwargs)
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+        finally:
+            call.done_at = time.time()
+            call.event.set()
+            with self._lock:
+                if self.share_window <= 0 and self._calls.get(key) is call:
+                    del self._calls[key]
+                self._purge_expired()
+
+        if call.waiters:
+            logger.debug(f"🔀 合并请求: {self.name}:{key} 共享给 {call.waiters} 个等待者")
+        return call.outcome()
+
+    def forget(self, key):
+        """丢弃 key 的共享结果（下一次调用重新执行）"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.done_at is not None:
+                del self._calls[key]
+
+    def _purge_expired(self):
+        """清理超出共享窗口的已完成调用（调用方持有锁）"""
+        now = time.time()
+        expired = [k for k, c in self._calls.items()
+                   if c.done_at is not None and now - c.done_at > self.share_window]
+        for key in expired:
+            del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': sum(1 for c in self._calls.values() if c.done_at is None),
+                'executions': self.executions,
+                'shared': self.shared,
+                'timeouts': self.timeouts,
+                'share_window': self.share_window
+            }
+
+
+def get_singleflight_stats():
+    """获取所有 SingleFlight 的统计信息"""
+    with _registry_lock:
+        flights = list(_registry.values())
+    return {flight.name: flight.stats() for flight in flights}
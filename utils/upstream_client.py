@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游 HTTP 客户端池（网盘 CDN / 123 Open API）
+
+每个上游主机（scheme://host:port）一个长期存活的 httpx.Client：
+- keep-alive 连接复用，拖动进度条发起的新 Range 请求不再重新 TCP + TLS 握手
+- 安装 h2 时启用 HTTP/2，同一主机的多个 Range 请求复用一条连接；中途放弃的流只重置
+  该 stream，不必关闭整条连接
+- 每个主机的连接池上限可配置，主机数量有上限（LRU 淘汰最久未用的客户端）
+- 通过 httpcore trace 统计每个主机新建连接 / TLS 握手次数，以及复用率和首字节延迟
+- 需要多条独立 TCP 连接的请求（并行分段拉取，CDN 按连接限速）使用同一主机单独的
+  HTTP/1.1 客户端，不会被 HTTP/2 合并到一条连接上
+- 默认不跟随重定向（直链验证需要看到 3xx）；下载请求传 follow_redirects=True，
+  直链 / 下载网关 302 到 CDN 节点时跟随（与原先 requests.get 的行为一致）
+
+环境变量：
+- UPSTREAM_MAX_CONNECTIONS：每个主机的最大连接数（默认 32）
+- UPSTREAM_MAX_KEEPALIVE：每个主机保持的空闲连接数（默认 8）
+- UPSTREAM_KEEPALIVE_EXPIRY：空闲连接保持时间（秒，默认 60）
+- UPSTREAM_HTTP2：是否启用 HTTP/2（默认 1，未安装 h2 时自动关闭）
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+
+class HostStats:
+    """单个上游主机的连接统计"""
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connects = 0          # 新建 TCP 连接
+        self.tls_handshakes = 0    # TLS 握手
+        self.http_versions = {}
+        self.ttfb_ms = None        # 首字节延迟 EWMA（毫秒）
+        self.last_used = 0.0
+
+    def trace(self, event_name, info):
+        """httpcore trace 回调（在请求线程中执行）"""
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connects += 1
+        elif event_name == 'connection.start_tls.complete':
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def record(self, response=None, elapsed_ms=None):
+        with self._lock:
+            self.requests += 1
+            self.last_used = time.time()
+            if response is None:
+                self.errors += 1
+                return
+            version = response.http_version
+            self.http_versions[version] = self.http_versions.get(version, 0) + 1
+            if elapsed_ms is not None:
+                if self.ttfb_ms is None:
+                    self.ttfb_ms = elapsed_ms
+                else:
+                    self.ttfb_ms += self.EWMA_ALPHA * (elapsed_ms - self.ttfb_ms)
+
+    def to_dict(self):
+        with self._lock:
+            reused = max(self.requests - self.errors - self.connects, 0)
+            completed = self.requests - self.errors
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'connects': self.connects,
+                'tls_handshakes': self.tls_handshakes,
+                'reuse_rate': round(reused / completed, 3) if completed else None,
+                'http_versions': dict(self.http_versions),
+                'ttfb_ms': round(self.ttfb_ms, 1) if self.ttfb_ms is not None else None,
+                'last_used': self.last_used
+            }
+
+
+class UpstreamClientPool:
+    """按上游主机维护长连接 httpx.Client"""
+
+    MAX_HOSTS = 32
+
+    def __init__(self, max_connections=None, max_keepalive=None, keepalive_expiry=None, http2=None):
+        """
+        :param max_connections: 每个主机的最大连接数（默认 UPSTREAM_MAX_CONNECTIONS 或 32）
+        :param max_keepalive: 每个主机保持的空闲连接数（默认 UPSTREAM_MAX_KEEPALIVE 或 8）
+        :param keepalive_expiry: 空闲连接保持时间（秒，默认 UPSTREAM_KEEPALIVE_EXPIRY 或 60）
+        :param http2: 是否启用 HTTP/2（默认 UPSTREAM_HTTP2，未安装 h2 时关闭）
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 32)),
+            max_keepalive_connections=max_keepalive or int(os.environ.get('UPSTREAM_MAX_KEEPALIVE', 8)),
+            keepalive_expiry=keepalive_expiry or float(os.environ.get('UPSTREAM_KEEPALIVE_EXPIRY', 60))
+        )
+        if http2 is None:
+            http2 = os.environ.get('UPSTREAM_HTTP2', '1').lower() not in ('0', 'false', 'no')
+        self.http2 = bool(http2) and HTTP2_AVAILABLE
+
+        self._clients = OrderedDict()   # 主机 → httpx.Client
+        self._stats = {}                # 主机 → HostStats
+        self._active = {}               # 客户端 → 未关闭的请求 / 流式响应数
+        self._retired = set()           # 已淘汰、等待在途响应关闭的客户端
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def host_key(url):
+        parsed = httpx.URL(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        return f"{parsed.scheme}://{parsed.host}:{port}"
+
+    def _client_for(self, host, http1=False):
+        """获取（必要时创建）主机对应的客户端"""
+        http2 = self.http2 and not http1
+        if self.http2 and not http2:
+            host = f"{host} (http/1.1)"
+        with self._lock:
+            client = self._clients.get(host)
+            if client is not None:
+                self._clients.move_to_end(host)
+                self._active[client] = self._active.get(client, 0) + 1
+                return client, self._stats[host]
+            client = httpx.Client(
+                http2=http2,
+                limits=self.limits,
+                timeout=DEFAULT_TIMEOUT,
+                follow_redirects=False
+            )
+            self._clients[host] = client
+            self._active[client] = 1
+            stats = self._stats.setdefault(host, HostStats())
+            evicted = None
+            if len(self._clients) > self.MAX_HOSTS:
+                evicted_host, evicted = self._clients.popitem(last=False)
+                self._stats.pop(evicted_host, None)
+                self.evictions += 1
+                if self._active.get(evicted):
+                    # 仍有流式响应在读取：关闭连接池会中断它们，等最后一个响应关闭后再 close()
+                    self._retired.add(evicted)
+                    evicted = None
+                else:
+                    self._active.pop(evicted, None)
+        if evicted is not None:
+            evicted.close()
+        return client, stats
+
+    def _release(self, client):
+        """请求 / 流式响应结束；已淘汰的客户端在最后一个响应关闭后 close()"""
+        with self._lock:
+            count = self._active.get(client, 0) - 1
+            if count > 0:
+                self._active[client] = count
+                return
+            self._active.pop(client, None)
+            if client not in self._retired:
+                return
+            self._retired.discard(client)
+        client.close()
+
+    def _release_on_close(self, response, client):
+        """流式响应关闭（读完 / 调用方 close()）时释放客户端，只释放一次"""
+        close = response.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release(client)
+
+        response.close = close_and_release
+
+    def request(self, method, url, headers=None, timeout=None, stream=False, http1=False, follow_redirects=False):
+        """
+        发起请求（跟随 requests 的用法，但返回 httpx.Response）
+
+        :param method: HTTP 方法
+        :param url: 完整 URL
+        :param headers: 请求头
+        :param timeout: 超时（秒或 httpx.Timeout，默认读 30 秒 / 连接 10 秒）
+        :param stream: 是否流式读取响应体（调用方负责 close()）
+        :param http1: 只用 HTTP/1.1（并发请求各占一条 TCP 连接）
+        :param follow_redirects: 是否跟随重定向（下载请求开启）
+        :raises httpx.HTTPError: 连接 / 超时等传输错误
+        """
+        host = self.host_key(url)
+        client, stats = self._client_for(host, http1)
+        start = time.perf_counter()
+        try:
+            upstream_request = client.build_request(
+                method, url, headers=headers,
+                timeout=timeout if timeout is not None else DEFAULT_TIMEOUT
+            )
+            upstream_request.extensions['trace'] = stats.trace
+            response = client.send(upstream_request, stream=stream, follow_redirects=follow_redirects)
+        except BaseException as e:
+            if isinstance(e, httpx.HTTPError):
+                stats.record()
+            self._release(client)
+            raise
+        stats.record(response, (time.perf_counter() - start) * 1000)
+        if stream:
+            self._release_on_close(response, client)
+        else:
+            self._release(client)
+        return response
+
+    def stream(self, method, url, headers=None, timeout=None, http1=False, follow_redirects=False):
+        """流式请求（等价于 request(..., stream=True)）"""
+        return self.request(method, url, headers=headers, timeout=timeout, stream=True, http1=http1,
+                            follow_redirects=follow_redirects)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values()) + list(self._retired)
+            self._clients.clear()
+            self._retired.clear()
+            self._active.clear()
+        for client in clients:
+            client.close()
+
+    def stats(self):
+        with self._lock:
+            hosts = {host: stats.to_dict() for host, stats in self._stats.items()}
+            return {
+                'http2': self.http2,
+                'clients': len(self._clients),
+                'evictions': self.evictions,
+                'retired': len(self._retired),
+                'limits': {
+                    'max_connections': self.limits.max_connections,
+                    'max_keepalive': self.limits.max_keepalive_connections,
+                    'keepalive_expiry': self.limits.keepalive_expiry
+                },
+                'hosts': hosts
+            }
+
+
+# 全局实例
+_upstream_pool = None
+_upstream_pool_lock = threading.Lock()
+
+
+def get_upstream_pool():
+    """获取全局上游客户端池"""
+    global _upstream_pool
+    if _upstream_pool is None:
+        with _upstream_pool_lock:
+            if _upstream_pool is None:
+                _upstream_pool = UpstreamClientPool()
+    return _upstream_pool
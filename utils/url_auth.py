@@ -1,19 +1,53 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import re
 import hashlib
 import time
 import random
 import logging
-from urllib.parse import urlparse, parse_qs, urlencode
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+from utils.bounded_cache import BoundedCache
 
 logger = logging.getLogger(__name__)
 
+# 123网盘官方域名
+OFFICIAL_123_DOMAINS = (
+    'vip.123pan.cn',
+    '123pan.cn',
+    'cjjd19.com',
+    'download-cdn.cjjd19.com'
+)
+
+# 分桶签名结果缓存：(url, uid, secret_key, timestamp) → 鉴权URL
+_signed_url_cache = BoundedCache('signed_url', max_size=10000)
+
+
+@lru_cache(maxsize=32)
+def _compile_domain_pattern(custom_domains):
+    """把官方域名和自定义域名编译为一个正则（子串匹配语义）"""
+    domains = list(OFFICIAL_123_DOMAINS) + [d for d in custom_domains if d]
+    # 长域名优先，保证日志中显示最具体的匹配
+    domains.sort(key=len, reverse=True)
+    return re.compile('|'.join(re.escape(d) for d in domains))
+
+
 class URLAuthManager:
     """123网盘 URL 鉴权管理器"""
     
     @staticmethod
-    def add_auth_to_url(url, secret_key, uid, expire_seconds=3600):
+    def compile_domain_matcher(custom_domains=None):
+        """
+        预编译域名匹配器（按域名列表缓存）
+        
+        :param custom_domains: 用户自定义的域名列表
+        :return: 已编译的正则，search(url) 命中表示需要鉴权
+        """
+        return _compile_domain_pattern(tuple(custom_domains or ()))
+    
+    @staticmethod
+    def add_auth_to_url(url, secret_key, uid, expire_seconds=3600, bucket_seconds=0):
         """
         为123网盘直链添加鉴权参数
         
@@ -21,6 +55,7 @@ class URLAuthManager:
         :param secret_key: 鉴权密钥（在123网盘后台配置）
         :param uid: 云盘UID
         :param expire_seconds: 过期时间（秒）
+        :param bucket_seconds: 时间桶大小（秒），大于0时使用分桶签名（见 add_bucketed_auth_to_url）
         :return: 带鉴权的URL
         
         算法说明：
@@ -31,47 +66,16 @@ class URLAuthManager:
         原始URL: http://vip.123pan.cn/13/files/1.txt
         鉴权URL: http://vip.123pan.cn/13/files/1.txt?auth_key=1689220731-123-13-3bdacc0e031fd67fe829152f37c8fbad
         """
+        if bucket_seconds and bucket_seconds > 0:
+            return URLAuthManager.add_bucketed_auth_to_url(url, secret_key, uid, expire_seconds, bucket_seconds)
+
         try:
-            # 解析URL
-            from urllib.parse import unquote
-            parsed = urlparse(url)
-            
-            # 获取路径并解码（签名必须使用原始未编码的路径）
-            path = unquote(parsed.path)  # URL解码，例如: %E5%AA%92 -> 媒
-            
-            logger.debug(f"📍 URL路径: {parsed.path}")
-            logger.debug(f"📍 解码路径: {path}")
-            
-            # 生成时间戳（过期时间）
+            # 生成时间戳（过期时间）和随机数
             timestamp = int(time.time()) + expire_seconds
-            
-            # 生成随机数
             rand = random.randint(100, 999)
-            
-            # 构建待签名字符串
-            # 格式：$path-$timestamp-$rand-$uid-$secret_key
-            # 注意：路径必须是解码后的原始路径
-            sign_string = f"{path}-{timestamp}-{rand}-{uid}-{secret_key}"
-            
-            logger.debug(f"🔐 签名字符串: {sign_string[:100]}...")
-            
-            # 计算MD5
-            md5_hash = hashlib.md5(sign_string.encode('utf-8')).hexdigest()
-            
-            # 构建auth_key
-            # 格式：$timestamp-$rand-$uid-$md5hash
-            auth_key = f"{timestamp}-{rand}-{uid}-{md5_hash}"
-            
-            # 添加到URL
-            if '?' in url:
-                auth_url = f"{url}&auth_key={auth_key}"
-            else:
-                auth_url = f"{url}?auth_key={auth_key}"
-            
-            logger.debug(f"✅ 鉴权URL生成成功")
-            logger.debug(f"  auth_key: {auth_key}")
+
+            auth_url = URLAuthManager._sign_url(url, secret_key, uid, timestamp, rand)
             logger.debug(f"  过期时间: {expire_seconds}秒后")
-            
             return auth_url
             
         except Exception as e:
@@ -79,6 +83,74 @@ class URLAuthManager:
             import traceback
             logger.error(traceback.format_exc())
             return url  # 失败时返回原URL
+
+    @staticmethod
+    def add_bucketed_auth_to_url(url, secret_key, uid, expire_seconds=3600, bucket_seconds=300):
+        """
+        分桶签名：过期时间戳按 bucket_seconds 向上取整，rand 由路径和时间桶确定
+
+        同一时间桶内同一文件得到完全相同的URL，客户端和 CDN 可以复用缓存；
+        时间戳向上取整，剩余有效期始终不少于 expire_seconds。
+        签名结果缓存到时间桶切换为止，重复播放 / 拖动进度无需重新计算。
+        """
+        try:
+            now = int(time.time())
+            timestamp = -(-(now + expire_seconds) // bucket_seconds) * bucket_seconds
+
+            cache_key = (url, uid, secret_key, timestamp)
+            auth_url = _signed_url_cache.get(cache_key)
+            if auth_url is not None:
+                return auth_url
+
+            path = unquote(urlparse(url).path)
+            seed = hashlib.md5(f"{path}-{timestamp}-{secret_key}".encode('utf-8')).hexdigest()
+            rand = int(seed[:8], 16) % 900 + 100
+
+            auth_url = URLAuthManager._sign_url(url, secret_key, uid, timestamp, rand)
+            # now 超过 timestamp - expire_seconds 后时间戳会进入下一个桶
+            _signed_url_cache.set(cache_key, auth_url, ttl=timestamp - expire_seconds - now)
+            return auth_url
+
+        except Exception as e:
+            logger.error(f"❌ 生成鉴权URL失败: {e}")
+            return url  # 失败时返回原URL
+
+    @staticmethod
+    def _sign_url(url, secret_key, uid, timestamp, rand):
+        """按给定时间戳和随机数生成鉴权URL"""
+        # 解析URL
+        parsed = urlparse(url)
+        
+        # 获取路径并解码（签名必须使用原始未编码的路径）
+        path = unquote(parsed.path)  # URL解码，例如: %E5%AA%92 -> 媒
+        
+        logger.debug(f"📍 URL路径: {parsed.path}")
+        logger.debug(f"📍 解码路径: {path}")
+        
+        # 构建待签名字符串
+        # 格式：$path-$timestamp-$rand-$uid-$secret_key
+        # 注意：路径必须是解码后的原始路径
+        sign_string = f"{path}-{timestamp}-{rand}-{uid}-{secret_key}"
+        
+        logger.debug(f"🔐 签名字符串: {sign_string[:100]}...")
+        
+        # 计算MD5
+        md5_hash = hashlib.md5(sign_string.encode('utf-8')).hexdigest()
+        
+        # 构建auth_key
+        # 格式：$timestamp-$rand-$uid-$md5hash
+        auth_key = f"{timestamp}-{rand}-{uid}-{md5_hash}"
+        
+        # 添加到URL
+        if '?' in url:
+            auth_url = f"{url}&auth_key={auth_key}"
+        else:
+            auth_url = f"{url}?auth_key={auth_key}"
+        
+        logger.debug(f"✅ 鉴权URL生成成功")
+        logger.debug(f"  auth_key: {auth_key}")
+        
+        return auth_url
     
     @staticmethod
     def is_123pan_url(url, custom_domains=None):
@@ -92,26 +164,14 @@ class URLAuthManager:
         if not url:
             return False
         
-        # 1. 检查官方域名
-        official_domains = [
-            'vip.123pan.cn',
-            '123pan.cn',
-            'cjjd19.com',
-            'download-cdn.cjjd19.com'
-        ]
-        for domain in official_domains:
-            if domain in url:
-                logger.debug(f"  ✅ 匹配官方域名: {domain}")
-                return True
-        
-        # 2. 检查用户配置的自定义域名
-        if custom_domains and isinstance(custom_domains, list):
-            for domain in custom_domains:
-                if domain and domain in url:
-                    logger.debug(f"  ✅ 匹配自定义域名: {domain}")
-                    return True
-        
-        # 3. 不匹配任何规则，跳过鉴权
+        if custom_domains is not None and not isinstance(custom_domains, (list, tuple)):
+            custom_domains = None
+        
+        match = URLAuthManager.compile_domain_matcher(custom_domains).search(url)
+        if match:
+            logger.debug(f"  ✅ 匹配域名: {match.group(0)}")
+            return True
+        
+        # 不匹配任何规则，跳过鉴权
         logger.debug(f"  ⚪ URL不匹配，跳过鉴权")
         return False
-